@@ -0,0 +1,461 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2002 Ben Escoto <ben@emerose.org>
+# Copyright 2007 Kenneth Loafman <kenneth@loafman.com>
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+In-process symmetric encryption with an AEAD cipher
+
+This is the alternative to gpg used with --aead-encryption.  Files are
+encrypted with a key derived from the passphrase, without starting an
+external process, and several chunks of a file can be encrypted or
+decrypted at once on different CPUs.  The python cryptography module
+is required and only imported when first used.
+
+Container format, version 1 (integers are unsigned big-endian):
+
+    magic           8 bytes   "DUPAEAD\\n"
+    version         1 byte    1
+    cipher          1 byte    1 = AES-256-GCM, 2 = ChaCha20-Poly1305
+    kdf iterations  4 bytes   PBKDF2-HMAC-SHA256 iterations
+    kdf salt       16 bytes   salt for deriving the master key
+    file salt      16 bytes   HKDF-SHA256 salt for this file's key
+    chunk size      4 bytes   plaintext bytes per chunk
+    codec length    1 byte
+    codec           n bytes   compression codec applied before
+                              encryption, empty if none
+
+followed by the chunks.  Every chunk but the last holds exactly chunk
+size bytes of plaintext, the last one holds less (possibly nothing).
+Each is stored as its ciphertext followed by the 16 byte tag.  The
+nonce of chunk i is i as 8 bytes followed by 4 bytes that are 1 for
+the last chunk and 0 otherwise, and the whole header is the associated
+data of every chunk.  Since every file has its own key, nonces never
+repeat, and reordered, truncated, extended or tampered files all fail
+to decrypt.
+"""
+
+import os
+import struct
+
+from duplicity import compression
+from duplicity import globals
+from duplicity import gpg
+from duplicity import stagetimes
+
+magic = b"DUPAEAD\n"
+version = 1
+
+suffix = b".aead"  # suffix used with long filenames
+short_suffix = b".a"  # suffix used with --short-filenames
+
+ciphers = {u"aes-256-gcm": 1, u"chacha20-poly1305": 2}
+
+kdf_iterations = 100000
+chunk_size = 1024 * 1024
+tag_size = 16
+
+header_format = b">8sBBI16s16sIB"
+header_size = struct.calcsize(header_format)
+
+# master keys already derived, keyed by (passphrase, kdf salt, iterations)
+_master_keys = {}
+
+# kdf salt shared by all files written by this process, so the
+# expensive key derivation is done only once per backup
+_write_kdf_salt = None
+
+
+class AEADError(Exception):
+    u"""
+    Indicate some AEAD encryption/decryption error
+    """
+    pass
+
+
+def get_module():
+    u"""
+    Return the cryptography module, raise AEADError if not installed
+    """
+    try:
+        import cryptography.hazmat.backends
+        import cryptography.hazmat.primitives.ciphers.aead
+        import cryptography.hazmat.primitives.hashes
+        import cryptography.hazmat.primitives.kdf.hkdf
+        import cryptography.hazmat.primitives.kdf.pbkdf2
+    except ImportError:
+        raise AEADError(_(u"--aead-encryption requires the python cryptography module"))
+    return cryptography
+
+
+def check_available():
+    u"""
+    Raise AEADError if AEAD encryption cannot be used here
+    """
+    get_module()
+
+
+def get_master_key(passphrase, kdf_salt, iterations):
+    u"""
+    Return master key derived from passphrase
+    """
+    key = (passphrase, kdf_salt, iterations)
+    if key not in _master_keys:
+        crypto = get_module()
+        kdf = crypto.hazmat.primitives.kdf.pbkdf2.PBKDF2HMAC(
+            algorithm=crypto.hazmat.primitives.hashes.SHA256(), length=32,
+            salt=kdf_salt, iterations=iterations,
+            backend=crypto.hazmat.backends.default_backend())
+        _master_keys[key] = kdf.derive(passphrase)
+    return _master_keys[key]
+
+
+def get_cipher(cipher_id, master_key, file_salt):
+    u"""
+    Return AEAD cipher object keyed for one file
+    """
+    crypto = get_module()
+    hkdf = crypto.hazmat.primitives.kdf.hkdf.HKDF(
+        algorithm=crypto.hazmat.primitives.hashes.SHA256(), length=32,
+        salt=file_salt, info=b"duplicity aead file key",
+        backend=crypto.hazmat.backends.default_backend())
+    file_key = hkdf.derive(master_key)
+    aead = crypto.hazmat.primitives.ciphers.aead
+    if cipher_id == ciphers[u"aes-256-gcm"]:
+        return aead.AESGCM(file_key)
+    elif cipher_id == ciphers[u"chacha20-poly1305"]:
+        return aead.ChaCha20Poly1305(file_key)
+    raise AEADError(_(u"Unknown AEAD cipher %d") % (cipher_id,))
+
+
+def get_nonce(index, final):
+    u"""
+    Return nonce of chunk number index
+    """
+    return struct.pack(b">QI", index, 1 if final else 0)
+
+
+def get_threads():
+    u"""
+    Return number of chunks to process at once
+    """
+    if globals.aead_threads > 0:
+        return globals.aead_threads
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+class AEADFile:
+    u"""
+    File-like object that encrypts or decrypts another file on the fly
+    """
+    def __init__(self, encrypt, encrypt_path, passphrase, codec=None,
+                 hash_obj=None):
+        u"""
+        AEADFile initializer
+
+        If encrypt is true, data written to the AEADFile will be
+        encrypted and written to encrypt_path, and codec is recorded
+        as the compression already applied to that data.  Otherwise
+        encrypt_path is read and decrypted, and self.codec is set
+        from its header.
+
+        If hash_obj is given, it is updated with the encrypted data as
+        it is written to encrypt_path.
+        """
+        if not passphrase:
+            raise AEADError(_(u"--aead-encryption requires a passphrase"))
+        self.name = encrypt_path.name
+        self.encrypt = encrypt
+        self.threads = get_threads()
+        self.pool = None
+        self.index = 0
+        self.buffer = b""  # plaintext read but not yet returned
+        self.offset = 0  # position of unreturned data in self.buffer
+        self.pending = []  # plaintext written but not yet encrypted
+        self.pending_len = 0
+        self.closed = 0
+        self.byte_count = 0
+        self.output_byte_count = 0
+        self.at_end = False
+        self.fileobj = open(encrypt_path.name, u"wb" if encrypt else u"rb")
+        if encrypt and hash_obj:
+            self.fileobj = gpg.HashedFile(self.fileobj, hash_obj)
+        if encrypt:
+            self.codec = codec
+            self.write_header(passphrase)
+        else:
+            self.read_header(passphrase)
+
+    def write_header(self, passphrase):
+        u"""
+        Write container header and set up the cipher
+        """
+        global _write_kdf_salt
+        if _write_kdf_salt is None:
+            _write_kdf_salt = os.urandom(16)
+        cipher_id = ciphers[globals.aead_cipher]
+        file_salt = os.urandom(16)
+        codec = (self.codec or u"").encode(u"ascii")
+        self.chunk_size = chunk_size
+        self.header = struct.pack(header_format, magic, version, cipher_id,
+                                  kdf_iterations, _write_kdf_salt, file_salt,
+                                  self.chunk_size, len(codec)) + codec
+        master_key = get_master_key(passphrase, _write_kdf_salt, kdf_iterations)
+        self.cipher = get_cipher(cipher_id, master_key, file_salt)
+        self.fileobj.write(self.header)
+        self.output_byte_count += len(self.header)
+
+    def read_header(self, passphrase):
+        u"""
+        Read container header and set up the cipher
+        """
+        header = self.fileobj.read(header_size)
+        if len(header) < header_size or not header.startswith(magic):
+            raise AEADError(_(u"%s is not an AEAD encrypted file") % (self.name,))
+        (file_magic, file_version, cipher_id, iterations, kdf_salt,
+         file_salt, self.chunk_size, codec_len) = struct.unpack(header_format, header)
+        if file_version != version:
+            raise AEADError(_(u"Unsupported AEAD container version %d in %s") %
+                            (file_version, self.name))
+        codec = self.fileobj.read(codec_len)
+        self.header = header + codec
+        self.codec = codec.decode(u"ascii") or None
+        master_key = get_master_key(passphrase, kdf_salt, iterations)
+        self.cipher = get_cipher(cipher_id, master_key, file_salt)
+
+    def map(self, function, args):
+        u"""
+        Apply function to each of args, on several threads if allowed
+        """
+        if self.threads < 2 or len(args) < 2:
+            return [function(arg) for arg in args]
+        if not self.pool:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(self.threads)
+        return self.pool.map(function, args)
+
+    def encrypt_chunks(self, chunks, final=False):
+        u"""
+        Encrypt chunks and write them, the last being final if final is set
+        """
+        jobs = []
+        for i in range(len(chunks)):
+            jobs.append((self.index + i, final and i == len(chunks) - 1, chunks[i]))
+        self.index += len(chunks)
+
+        def encrypt_one(job):
+            index, last, chunk = job
+            return self.cipher.encrypt(get_nonce(index, last), chunk, self.header)
+
+        with stagetimes.stage(u"aead") as st:
+            results = self.map(encrypt_one, jobs)
+            st.add(sum(len(job[2]) for job in jobs))
+        for data in results:
+            self.fileobj.write(data)
+            self.output_byte_count += len(data)
+
+    def write(self, buf):
+        u"""
+        Encrypt buf and write it out once enough chunks are buffered
+        """
+        assert self.encrypt and not self.closed
+        self.pending.append(buf)
+        self.pending_len += len(buf)
+        self.byte_count += len(buf)
+        batch = self.chunk_size * self.threads
+        if self.pending_len > batch:
+            data = b"".join(self.pending)
+            self.pending = [data[batch:]]
+            self.pending_len = len(self.pending[0])
+            self.encrypt_chunks([data[i:i + self.chunk_size]
+                                 for i in range(0, batch, self.chunk_size)])
+
+    def decrypt_chunks(self):
+        u"""
+        Read and decrypt the next batch of chunks, return plaintext
+        """
+        size = self.chunk_size + tag_size
+        jobs = []
+        while len(jobs) < self.threads:
+            data = self.fileobj.read(size)
+            last = len(data) < size
+            if len(data) < tag_size:
+                raise AEADError(_(u"%s is truncated") % (self.name,))
+            jobs.append((self.index, last, data))
+            self.index += 1
+            if last:
+                if self.fileobj.read(1):
+                    raise AEADError(_(u"%s has trailing data") % (self.name,))
+                self.at_end = True
+                break
+
+        def decrypt_one(job):
+            index, last, data = job
+            try:
+                return self.cipher.decrypt(get_nonce(index, last), data, self.header)
+            except Exception:
+                raise AEADError(_(u"Failed to authenticate %s, wrong passphrase or "
+                                  u"damaged file") % (self.name,))
+
+        with stagetimes.stage(u"aead") as st:
+            result = b"".join(self.map(decrypt_one, jobs))
+            st.add(len(result))
+        return result
+
+    def read(self, length=-1):
+        u"""
+        Read and decrypt up to length bytes, everything if length < 0
+        """
+        assert not self.encrypt and not self.closed
+        if length < 0:
+            bufs = [self.buffer[self.offset:]]
+            while not self.at_end:
+                bufs.append(self.decrypt_chunks())
+            result = b"".join(bufs)
+            self.buffer, self.offset = b"", 0
+        else:
+            while not self.at_end and len(self.buffer) - self.offset < length:
+                self.buffer = self.buffer[self.offset:] + self.decrypt_chunks()
+                self.offset = 0
+            result = self.buffer[self.offset:self.offset + length]
+            self.offset += len(result)
+        self.byte_count += len(result)
+        return result
+
+    def tell(self):
+        return self.byte_count
+
+    def seek(self, offset):
+        assert not self.encrypt
+        assert offset >= self.byte_count, u"%d < %d" % (offset, self.byte_count)
+        while offset > self.byte_count:
+            if not self.read(min(offset - self.byte_count, self.chunk_size)):
+                break
+
+    def flush(self):
+        if self.encrypt:
+            self.fileobj.flush()
+
+    def get_output_size(self):
+        u"""
+        Return encrypted size of what has been written so far
+
+        Data still buffered is counted as if it was already encrypted.
+        """
+        assert self.encrypt
+        chunks = self.pending_len // self.chunk_size + 1
+        return self.output_byte_count + self.pending_len + chunks * tag_size
+
+    def close(self):
+        u"""
+        Close file, writing out remaining data when encrypting
+        """
+        if self.closed:
+            return
+        try:
+            if self.encrypt:
+                # the final chunk must be short so readers can spot it
+                data = b"".join(self.pending)
+                chunks = [data[i:i + self.chunk_size]
+                          for i in range(0, len(data), self.chunk_size)]
+                if not chunks or len(chunks[-1]) == self.chunk_size:
+                    chunks.append(b"")
+                self.pending, self.pending_len = [], 0
+                self.encrypt_chunks(chunks, final=True)
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+            self.closed = 1
+        return self.fileobj.close()
+
+
+def open_file(encrypt_path, mode, passphrase, hash_obj=None):
+    u"""
+    Return fileobj that encrypts or decrypts encrypt_path
+
+    Written files are compressed first with the configured codec
+    unless compression is disabled.  Read files are decompressed
+    with the codec recorded in their header.  hash_obj is passed on
+    to AEADFile when writing.
+    """
+    if mode == u"rb":
+        fileobj = AEADFile(False, encrypt_path, passphrase)
+        if fileobj.codec:
+            return compression.get_codec(fileobj.codec).open_reader(fileobj, closefd=True)
+        return fileobj
+    assert mode == u"wb", mode
+    if globals.compression:
+        codec = compression.get_codec()
+        fileobj = AEADFile(True, encrypt_path, passphrase, codec.name, hash_obj)
+        return codec.open_writer(fileobj, closefd=True)
+    return AEADFile(True, encrypt_path, passphrase, hash_obj=hash_obj)
+
+
+def AEADWriteFile(block_iter, filename, passphrase,
+                  size=200 * 1024 * 1024,
+                  max_footer_size=16 * 1024,
+                  hash_obj=None):
+    u"""
+    Write AEAD encrypted file of given size
+
+    This works like gpg.GPGWriteFile, except that the data is
+    compressed and encrypted in-process.  The volume is ended as soon
+    as another block might not fit.  If hash_obj is given, it is
+    updated with everything written to filename.
+
+    Returns true if succeeded in writing until end of block_iter.
+    """
+
+    # workaround for circular module imports
+    from duplicity import path
+
+    target_size = size - 32 * 1024  # fudge factor, compensate for compressor buffering
+    data_size = target_size - max_footer_size
+    if globals.compression:
+        codec = compression.get_codec()
+        file = AEADFile(True, path.Path(filename), passphrase, codec.name, hash_obj)
+        outfile = codec.open_writer(file)
+    else:
+        file = outfile = AEADFile(True, path.Path(filename), passphrase,
+                                  hash_obj=hash_obj)
+    at_end_of_blockiter = 0
+    try:
+        while True:
+            bytes_to_go = data_size - file.get_output_size()
+            if bytes_to_go < block_iter.get_read_size():
+                break
+            try:
+                data = block_iter.next().data
+            except StopIteration:
+                at_end_of_blockiter = 1
+                break
+            outfile.write(data)
+
+        outfile.write(block_iter.get_footer())
+        assert not outfile.close() and not file.close()
+        return at_end_of_blockiter
+    except Exception:
+        file.close()
+        raise
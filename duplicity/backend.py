@@ -26,8 +26,10 @@ intended to be used by the backends themselves.
 
 import errno
 import os
+import random
 import sys
 import socket
+import threading
 import time
 import re
 import getpass
@@ -40,9 +42,11 @@ import urlparse
 from duplicity import dup_temp
 from duplicity import file_naming
 from duplicity import globals
+from duplicity import gpg
 from duplicity import log
 from duplicity import path
 from duplicity import progress
+from duplicity import stagetimes
 from duplicity import util
 
 from duplicity.util import exception_traceback
@@ -359,14 +363,142 @@ def _get_code_from_exception(backend, operation, e):
     return log.ErrorCode.backend_error
 
 
+# HTTP status codes, and names of error codes and exception classes,
+# with which the storage providers tell us to slow down
+throttle_status = (429, 503)
+throttle_names = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                  'TooManyRequests', 'TooManyRequestsException', 'ServerBusy')
+
+
+def _is_throttled(e):
+    """
+    Return true if exception e means the backend is overloaded
+    """
+    if isinstance(e, TemporaryLoadException):
+        return True
+    for attr in ['status', 'http_status', 'status_code']:
+        if getattr(e, attr, None) in throttle_status:
+            return True
+    return (getattr(e, 'error_code', None) in throttle_names or
+            e.__class__.__name__ in throttle_names)
+
+
+def retry_delay(attempt, throttled=False):
+    """
+    Return seconds to wait before retrying after attempt failed
+
+    The delay starts at --backend-retry-delay, three times that if the
+    backend is overloaded, and doubles with each attempt up to
+    --backend-retry-max-delay.  A random part of up to half of it
+    keeps concurrent operations from retrying in lockstep.
+    """
+    delay = globals.backend_retry_delay
+    if throttled:
+        delay *= 3
+    delay = min(delay * 2 ** (attempt - 1), max(delay, globals.backend_retry_max_delay))
+    return random.uniform(delay / 2.0, delay)
+
+
+class Throttle:
+    """
+    Client-side limit on the rate of operations of a backend
+
+    Unlimited until the backend says it is overloaded.  Then it becomes
+    a token bucket allowing half the rate of operations started in the
+    last few seconds, or half of one per second if that is less, and
+    halved again, down to one a minute, when an operation started after
+    that still gets throttled.  Each operation that succeeds raises the
+    rate by a twentieth, and once it is twice what first got us
+    throttled the limit is lifted.
+    """
+    window = 10.0  # seconds over which the unthrottled rate is measured
+    min_rate = 1.0 / 60  # operations per second
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = None  # operations per second, None when unlimited
+        self.ceiling = None
+        self.tokens = 0.0
+        self.last = time.time()
+        self.cut_time = 0.0  # when the rate was last lowered
+        self.started = []  # start times of operations in the last window
+        self.throttled_count = 0
+        self.wait_time = 0.0  # seconds operations waited for the limit
+        self.retry_time = 0.0  # seconds operations waited to be retried
+
+    def wait(self):
+        """
+        Wait until another operation may start, return the time it does
+        """
+        with self.lock:
+            now = time.time()
+            if self.rate is None:
+                self.started.append(now)
+                while self.started[0] < now - self.window:
+                    self.started.pop(0)
+                return now
+            burst = max(1.0, self.rate)
+            self.tokens = min(burst, self.tokens + (now - self.last) * self.rate) - 1
+            self.last = now
+            delay = -self.tokens / self.rate
+        if delay > 0:
+            with stagetimes.stage("backend.throttle"):
+                time.sleep(delay)
+            with self.lock:
+                self.wait_time += delay
+        return now + max(delay, 0)
+
+    def throttled(self, start):
+        """
+        Lower the rate after an operation started at start was refused
+        because the backend is overloaded
+        """
+        with self.lock:
+            now = time.time()
+            self.throttled_count += 1
+            if self.rate is not None and start < self.cut_time:
+                # started before the last cut, which may be enough
+                return
+            if self.rate is None:
+                recent = len(self.started) / max(now - min(self.started or [now]), 1.0)
+                self.ceiling = max(recent, 1.0)
+                self.rate = self.ceiling
+                self.tokens = 0.0
+                self.last = now
+                self.started = []
+            self.rate = max(self.rate / 2, self.min_rate)
+            self.cut_time = now
+            rate = self.rate
+        log.Warn(_("Backend is overloaded, slowing down to %.2f operations per second") % rate)
+
+    def succeeded(self):
+        """
+        Raise the rate after an operation succeeded
+        """
+        if self.rate is None:
+            return
+        with self.lock:
+            if self.rate is None:
+                return
+            self.rate *= 1.05
+            if self.rate < 2 * self.ceiling:
+                return
+            self.rate = None
+            self.started = []
+        log.Info(_("Backend recovered, no longer limiting the operation rate"))
+
+
 def retry(operation, fatal=True):
     # Decorators with arguments introduce a new level of indirection.  So we
     # have to return a decorator function (which itself returns a function!)
     def outer_retry(fn):
         def inner_retry(self, *args):
             for n in range(1, globals.num_retries + 1):
+                start = self.throttle.wait()
                 try:
-                    return fn(self, *args)
+                    result = fn(self, *args)
+                    self.throttle.succeeded()
+                    return result
                 except FatalBackendException as e:
                     # die on fatal errors
                     raise e
@@ -393,11 +525,15 @@ def retry(operation, fatal=True):
                     else:
                         log.Warn(_("Attempt %s failed. %s: %s")
                                  % (n, e.__class__.__name__, util.uexc(e)))
+                    throttled = _is_throttled(e)
+                    if throttled:
+                        self.throttle.throttled(start)
                     if not at_end:
-                        if isinstance(e, TemporaryLoadException):
-                            time.sleep(3 * globals.backend_retry_delay)  # wait longer before trying again
-                        else:
-                            time.sleep(globals.backend_retry_delay)  # wait a bit before trying again
+                        delay = retry_delay(n, throttled)
+                        with stagetimes.stage("backend.retry"):
+                            time.sleep(delay)
+                        with self.throttle.lock:
+                            self.throttle.retry_time += delay
                         if hasattr(self.backend, '_retry_cleanup'):
                             self.backend._retry_cleanup()
 
@@ -508,13 +644,20 @@ class BackendWrapper(object):
 
     def __init__(self, backend):
         self.backend = backend
+        self.throttle = Throttle()
 
     def __do_put(self, source_path, remote_filename):
         if hasattr(self.backend, '_put'):
             log.Info(_("Writing %s") % util.fsdecode(remote_filename))
-            self.backend._put(source_path, remote_filename)
+            with stagetimes.stage("backend.put") as st:
+                info = self.backend._put(source_path, remote_filename)
+                st.add(os.path.getsize(source_path.name))
         else:
             raise NotImplementedError()
+        if isinstance(info, dict):
+            info.setdefault('size', None)
+            return info
+        return None
 
     @retry('put', fatal=True)
     def put(self, source_path, remote_filename=None):
@@ -523,10 +666,14 @@ class BackendWrapper(object):
 
         If remote_filename is None, get the filename from the last
         path component of pathname.
+
+        Backends whose _put() can tell what was stored, as verified by
+        the server, return a metadata dictionary like query_info() has
+        for each file.  This is returned, or None.
         """
         if not remote_filename:
             remote_filename = source_path.get_filename()
-        self.__do_put(source_path, remote_filename)
+        return self.__do_put(source_path, remote_filename)
 
     @retry('move', fatal=True)
     def move(self, source_path, remote_filename=None):
@@ -545,18 +692,111 @@ class BackendWrapper(object):
         self.__do_put(source_path, remote_filename)
         source_path.delete()
 
+    def copy_from(self, src_backend, remote_filename):
+        """
+        Copy remote_filename from src_backend (BackendWrapper) unchanged
+
+        Backends that can copy from src_backend without the data passing
+        through here do that in _copy_from().  Otherwise the file is
+        downloaded and uploaded again as it is.
+        """
+        if hasattr(self.backend, '_copy_from'):
+            if self._do_copy_from(src_backend, remote_filename) is not False:
+                return
+        tdp = dup_temp.new_tempduppath(file_naming.parse(remote_filename))
+        src_backend.get(remote_filename, tdp)
+        self.put(tdp, remote_filename)
+        tdp.delete()
+
+    @retry('copy', fatal=True)
+    def _do_copy_from(self, src_backend, remote_filename):
+        log.Info(_("Copying %s") % util.fsdecode(remote_filename))
+        return self.backend._copy_from(src_backend.backend, remote_filename)
+
     @retry('get', fatal=True)
-    def get(self, remote_filename, local_path):
-        """Retrieve remote_filename and place in local_path"""
+    def get(self, remote_filename, local_path, hash_name=None):
+        """
+        Retrieve remote_filename and place in local_path
+
+        If hash_name is given, return the hex digest of the file with
+        that hash, see gpg.get_hash_obj.  Files read in ranges are
+        hashed as the ranges arrive, others as soon as _get() has
+        written them, so the file is checked before anyone uses it.
+        """
         if hasattr(self.backend, '_get'):
-            self.backend._get(remote_filename, local_path)
-            local_path.setdata()
+            hash_obj = gpg.get_hash_obj(hash_name) if hash_name else None
+            with stagetimes.stage("backend.get") as st:
+                ranged = self.__get_ranges(remote_filename, local_path, hash_obj)
+                if not ranged:
+                    self.backend._get(remote_filename, local_path)
+                local_path.setdata()
+                if local_path.exists():
+                    st.add(local_path.getsize())
             if not local_path.exists():
                 raise BackendException(_("File %s not found locally after get "
                                          "from backend") % local_path.uc_name)
+            if not hash_name:
+                return None
+            if not ranged:
+                return gpg.get_hash(hash_name, local_path)
+            return hash_obj.hexdigest()
         else:
             raise NotImplementedError()
 
+    def __get_ranges(self, remote_filename, local_path, hash_obj=None):
+        """
+        Retrieve remote_filename in byte ranges, several at once
+
+        Return False if the backend has no _read_range(), or the file
+        fits in one range.  The ranges are written at their offsets
+        into local_path, preallocated to the size of the file.  The
+        first range is read before the others are started, so the
+        backend can prepare the file for download then, e.g. restore
+        it from cold storage.  If hash_obj is given, it is updated
+        with the ranges in order.
+        """
+        if globals.download_concurrency < 2 or not hasattr(self.backend, '_read_range'):
+            return False
+        size = self.query_info([remote_filename])[remote_filename]['size']
+        chunk_size = globals.download_chunk_size
+        if size is None or size <= chunk_size:
+            return False
+
+        def read_range(offset):
+            length = min(chunk_size, size - offset)
+            buf = self.backend._read_range(remote_filename, offset, length)
+            if len(buf) != length:
+                raise BackendException(_("Read %d bytes of %s at offset %d, expected %d")
+                                       % (len(buf), util.fsdecode(remote_filename), offset, length))
+            fp = open(local_path.name, "r+b")
+            try:
+                fp.seek(offset)
+                fp.write(buf)
+            finally:
+                fp.close()
+            return buf if hash_obj else None
+
+        def add_ranges(bufs):
+            if hash_obj:
+                with stagetimes.stage("hash") as st:
+                    for buf in bufs:
+                        hash_obj.update(buf)
+                        st.add(len(buf))
+
+        log.Info(_("Reading %s in ranges of %d bytes") % (util.fsdecode(remote_filename), chunk_size))
+        fp = open(local_path.name, "wb")
+        fp.truncate(size)
+        fp.close()
+        offsets = range(0, size, chunk_size)
+        add_ranges([read_range(offsets[0])])
+        concurrency = globals.download_concurrency
+        # ranges are hashed in order, so then only as many are read
+        # ahead as there are threads, to bound the memory they take
+        batch = concurrency if hash_obj else len(offsets)
+        for i in range(1, len(offsets), batch):
+            add_ranges(util.run_concurrently(read_range, offsets[i:i + batch], concurrency))
+        return True
+
     @retry('list', fatal=True)
     def list(self):
         """
@@ -575,33 +815,73 @@ class BackendWrapper(object):
         if hasattr(self.backend, '_list'):
             # Make sure that duplicity internals only ever see byte strings
             # for filenames, no matter what the backend thinks it is talking.
-            return [tobytes(x) for x in self.backend._list()]
+            with stagetimes.stage("backend.list"):
+                filenames = self.backend._list()
+            return [tobytes(x) for x in filenames]
         else:
             raise NotImplementedError()
 
     def delete(self, filename_list):
         """
         Delete each filename in filename_list, in order if possible.
+
+        Backends with _delete_list() get the files in batches of their
+        delete_list_size, 100 if they do not set it, or all at once if
+        it is None.  With --delete-concurrency N the first file is
+        deleted alone, and the others N files or batches at a time in
+        no particular order.
+
+        Backends with _get_delete_filenames() can add the files that
+        go with those in filename_list, which are then deleted the
+        same way.
+
+        Return the list of files that could not be deleted, as failed
+        deletes are retried but do not raise.
         """
         assert not isinstance(filename_list, types.StringType)
+        if hasattr(self.backend, '_get_delete_filenames'):
+            filename_list = self.backend._get_delete_filenames(filename_list)
         if hasattr(self.backend, '_delete_list'):
-            self._do_delete_list(filename_list)
+            size = getattr(self.backend, 'delete_list_size', 100) or len(filename_list) or 1
+            do_delete = self._do_delete_list
         elif hasattr(self.backend, '_delete'):
-            for filename in filename_list:
-                self._do_delete(filename)
+            size = None
+            do_delete = self._do_delete
         else:
             raise NotImplementedError()
 
+        concurrency = globals.delete_concurrency
+        if concurrency > 1 and len(filename_list) > 1:
+            first, rest = filename_list[:1], filename_list[1:]
+        else:
+            first, rest = [], filename_list
+        if size:
+            tasks = [first] + [rest[i:i + size] for i in range(0, len(rest), size)]
+        else:
+            tasks = first + rest
+        tasks = [t for t in tasks if t]
+
+        if concurrency < 2 or len(tasks) < 3:
+            deleted = [do_delete(task) for task in tasks]
+        else:
+            deleted = [do_delete(tasks[0])] + util.run_concurrently(do_delete, tasks[1:], concurrency)
+        failed = []
+        for task, ok in zip(tasks, deleted):
+            if not ok:
+                failed.extend(task if size else [task])
+        return failed
+
     @retry('delete', fatal=False)
     def _do_delete_list(self, filename_list):
-        while filename_list:
-            sublist = filename_list[:100]
-            self.backend._delete_list(sublist)
-            filename_list = filename_list[100:]
+        with stagetimes.stage("backend.delete"):
+            self.backend._delete_list(filename_list)
+        return True
 
     @retry('delete', fatal=False)
     def _do_delete(self, filename):
-        self.backend._delete(filename)
+        with stagetimes.stage("backend.delete"):
+            self.backend._delete(filename)
+        return True
 
     # Should never cause FatalError.
     # Returns a dictionary of dictionaries.  The outer dictionary maps
@@ -638,7 +918,8 @@ class BackendWrapper(object):
 
     @retry('query', fatal=False)
     def _do_query_list(self, filename_list):
-        info = self.backend._query_list(filename_list)
+        with stagetimes.stage("backend.query"):
+            info = self.backend._query_list(filename_list)
         if info is None:
             info = {}
         return info
@@ -646,7 +927,8 @@ class BackendWrapper(object):
     @retry('query', fatal=False)
     def _do_query(self, filename):
         try:
-            return self.backend._query(filename)
+            with stagetimes.stage("backend.query"):
+                return self.backend._query(filename)
         except Exception as e:
             code = _get_code_from_exception(self.backend, 'query', e)
             if code == log.ErrorCode.backend_not_found:
@@ -659,9 +941,25 @@ class BackendWrapper(object):
         Close the backend, releasing any resources held and
         invalidating any file objects obtained from the backend.
         """
+        if self.throttle.throttled_count:
+            log.Info(_("Backend was overloaded %d times, operations waited %.1f seconds "
+                       "for the rate limit and %.1f seconds to be retried")
+                     % (self.throttle.throttled_count, self.throttle.wait_time,
+                        self.throttle.retry_time))
         if hasattr(self.backend, '_close'):
             self.backend._close()
 
+    def pre_process_download(self, remote_filenames):
+        """
+        Prepare remote_filenames for download, e.g. restore them from
+        cold storage, all at once if the backend can
+        """
+        if hasattr(self.backend, 'pre_process_download_batch'):
+            self.backend.pre_process_download_batch(remote_filenames)
+        elif hasattr(self.backend, 'pre_process_download'):
+            for filename in remote_filenames:
+                self.backend.pre_process_download(filename)
+
     def get_fileobj_read(self, filename, parseresults=None):
         """
         Return fileobject opened for reading of filename on backend
@@ -27,11 +27,13 @@ import Queue
 import time
 import traceback
 
+import duplicity.backend
 from duplicity import globals
 from duplicity import log
 from duplicity.errors import *  # @UnusedWildImport
 from duplicity.filechunkio import FileChunkIO
 from duplicity import progress
+from duplicity import util
 
 from ._boto_single import BotoBackend as BotoSingleBackend
 from ._boto_single import get_connection
@@ -67,6 +69,110 @@ class ConsumerThread(threading.Thread):
                 pass
 
 
+class PartUploader:
+    """
+    Threads uploading the parts of multipart uploads
+
+    Each thread keeps its own connection for the parts it uploads
+    later, and retries a failed part by itself, over a new connection,
+    without affecting the other parts.  Parts are read from the volume
+    at their offsets while they are sent, not copied into memory.
+    """
+    def __init__(self, backend, threads):
+        from multiprocessing.pool import ThreadPool
+        self.backend = backend
+        self.pool = ThreadPool(threads)
+        self.local = threading.local()
+        self.progress_lock = threading.Lock()
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def get_bucket(self, reset=False):
+        """
+        Return bucket over the connection of the calling thread
+        """
+        import boto
+        if reset and getattr(self.local, 'conn', None):
+            self.local.conn.close()
+            self.local.conn = None
+        if not getattr(self.local, 'conn', None):
+            storage_uri = boto.storage_uri(self.backend.boto_uri_str)
+            self.local.conn = get_connection(self.backend.scheme, self.backend.parsed_url, storage_uri)
+            self.local.bucket = self.local.conn.get_bucket(self.backend.bucket_name, validate=False)
+        return self.local.bucket
+
+    def report_progress(self, uploaded, total):
+        with self.progress_lock:
+            progress.report_transfer(uploaded, total)
+
+    def upload_part(self, key_name, multipart_id, filename, part_num, offset, size, cancelled):
+        """
+        Upload part part_num, raise the last exception if all attempts fail
+
+        Nothing more is tried once threading.Event cancelled is set, as
+        it is when the upload was given up, and an upload that no longer
+        exists on the server is not retried.
+        """
+        from boto.s3.multipart import MultiPartUpload
+        cb = None
+        if globals.progress:
+            cb = self.report_progress
+        for n in range(1, globals.num_retries + 1):
+            if cancelled.is_set():
+                log.Debug("Upload of %s cancelled, skipping part %d" % (key_name, part_num))
+                return
+            try:
+                mp = MultiPartUpload(self.get_bucket(reset=n > 1))
+                mp.key_name = key_name
+                mp.id = multipart_id
+                with open(filename, "rb") as fp:
+                    fp.seek(offset)
+                    mp.upload_part_from_file(fp, part_num, size=size, cb=cb,
+                                             num_cb=max(2, 8 * size / (1024 * 1024)))
+                log.Debug("Uploaded part %d of %s" % (part_num, key_name))
+                return
+            except Exception as e:
+                log.Debug("Upload of part %d of %s failed, attempt %d: %s" %
+                          (part_num, key_name, n, e))
+                if (n == globals.num_retries or
+                        getattr(e, 'error_code', None) == 'NoSuchUpload' or
+                        getattr(e, 'status', None) == 404):
+                    raise
+                cancelled.wait(duplicity.backend.retry_delay(n, duplicity.backend._is_throttled(e)))
+
+    def upload(self, bucket, filename, key, headers, chunk_size):
+        size = os.path.getsize(filename)
+        offsets = range(0, size, chunk_size) or [0]
+        log.Debug("Uploading %d bytes in %d chunks with threads" % (size, len(offsets)))
+
+        mp = bucket.initiate_multipart_upload(key.key, headers, encrypt_key=globals.s3_use_sse)
+        cancelled = threading.Event()
+        parts = []
+        for part_num, offset in enumerate(offsets):
+            parts.append((key.key, mp.id, filename, part_num + 1, offset,
+                          min(chunk_size, size - offset), cancelled))
+
+        try:
+            util.run_concurrently(lambda part: self.upload_part(*part), parts, 0,
+                                  pool=self.pool, timeout=globals.s3_multipart_max_timeout)
+        except BaseException as e:
+            # stop the parts still queued or waiting to be retried
+            cancelled.set()
+            mp.cancel_upload()
+            if isinstance(e, multiprocessing.TimeoutError):
+                raise BackendException("Multipart upload part did not finish in %s seconds. Aborted." %
+                                       globals.s3_multipart_max_timeout)
+            if isinstance(e, Exception):
+                raise BackendException("Multipart upload failed: %s. Aborted." % e)
+            raise
+
+        mp.complete_upload()
+        # each part was checked against its Content-MD5 by S3
+        return {'size': size}
+
+
 class BotoBackend(BotoSingleBackend):
     """
     Backend for Amazon's Simple Storage System, (aka Amazon S3), though
@@ -85,7 +191,20 @@ class BotoBackend(BotoSingleBackend):
             import boto
         except ImportError:
             raise
-        self._setup_pool()
+        self._uploader = None
+        if globals.s3_multipart_threads:
+            self._setup_uploader()
+        else:
+            self._setup_pool()
+
+    def _setup_uploader(self):
+        number_of_threads = globals.s3_multipart_max_procs
+        if not number_of_threads:
+            number_of_threads = multiprocessing.cpu_count()
+
+        log.Debug("Setting multipart boto backend thread pool to %d threads" % number_of_threads)
+
+        self._uploader = PartUploader(self, number_of_threads)
 
     def _setup_pool(self):
         number_of_procs = globals.s3_multipart_max_procs
@@ -105,8 +224,11 @@ class BotoBackend(BotoSingleBackend):
     def _close(self):
         BotoSingleBackend._close(self)
         log.Debug("Closing pool")
-        self._pool.terminate()
-        self._pool.join()
+        if self._uploader:
+            self._uploader.close()
+        else:
+            self._pool.terminate()
+            self._pool.join()
 
     def upload(self, filename, key, headers=None):
         chunk_size = globals.s3_multipart_chunk_size
@@ -117,6 +239,9 @@ class BotoBackend(BotoSingleBackend):
                 globals.s3_multipart_minimum_chunk_size, chunk_size))
             chunk_size = globals.s3_multipart_minimum_chunk_size
 
+        if self._uploader:
+            return self._uploader.upload(self.bucket, filename, key, headers, chunk_size)
+
         # Decide in how many chunks to upload
         bytes = os.path.getsize(filename)
         if bytes < chunk_size:
@@ -30,6 +30,9 @@ from duplicity import progress
 
 BOTO_MIN_VERSION = "2.1.1"
 
+# seconds between checks of keys being restored from Glacier
+thaw_poll_interval = 60
+
 
 def get_connection(scheme, parsed_url, storage_uri):
     try:
@@ -114,6 +117,61 @@ def get_connection(scheme, parsed_url, storage_uri):
     return conn
 
 
+class ThawPlanner:
+    """
+    Restores of keys from Glacier to S3, requested and checked as a group
+
+    All keys a restore needs are requested at once, so they thaw at the
+    same time rather than one after the other.  Waiting for one key
+    checks all pending keys, so later waits return at once for keys
+    that have thawed meanwhile.
+    """
+    cold_storage_classes = ("GLACIER", "DEEP_ARCHIVE")
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.pending = set()  # names of keys being restored
+
+    def request(self, keys):
+        """
+        Request restore of those keys that are in cold storage
+        """
+        for key in keys:
+            if key.storage_class not in self.cold_storage_classes or key.key in self.pending:
+                continue
+            # ongoing_restore is None if never requested, False once done
+            ongoing_restore = self.backend.bucket.get_key(key.key).ongoing_restore
+            if ongoing_restore is False:
+                continue
+            if ongoing_restore is None:
+                log.Info("File %s is in Glacier storage, restoring to S3" % key.key)
+                key.restore(days=1)  # Shouldn't need this again after 1 day
+            self.pending.add(key.key)
+
+    def poll(self):
+        """
+        Check all pending keys once, return names of those restored now
+        """
+        restored = []
+        for key_name in sorted(self.pending):
+            if not self.backend.bucket.get_key(key_name).ongoing_restore:
+                self.pending.discard(key_name)
+                restored.append(key_name)
+                log.Info("File %s was successfully restored from Glacier" % key_name)
+        return restored
+
+    def wait(self, key_name):
+        """
+        Return once key key_name is restored, or was never in Glacier
+        """
+        if key_name in self.pending:
+            log.Info("Waiting for file %s to restore from Glacier" % key_name)
+        while key_name in self.pending:
+            time.sleep(thaw_poll_interval)
+            self.backend.resetConnection()
+            self.poll()
+
+
 class BotoBackend(duplicity.backend.Backend):
     """
     Backend for Amazon's Simple Storage System, (aka Amazon S3), though
@@ -169,6 +227,7 @@ class BotoBackend(duplicity.backend.Backend):
             self.my_location = ''
         self.resetConnection()
         self._listed_keys = {}
+        self.thaw_planner = ThawPlanner(self)
 
     def _close(self):
         del self._listed_keys
@@ -217,14 +276,7 @@ class BotoBackend(duplicity.backend.Backend):
 
         key = self.bucket.new_key(self.key_prefix + remote_filename)
 
-        if globals.s3_use_rrs:
-            storage_class = 'REDUCED_REDUNDANCY'
-        elif globals.s3_use_ia:
-            storage_class = 'STANDARD_IA'
-        elif globals.s3_use_onezone_ia:
-            storage_class = 'ONEZONE_IA'
-        else:
-            storage_class = 'STANDARD'
+        storage_class = self.get_storage_class()
         log.Info("Uploading %s/%s to %s Storage" % (self.straight_url, remote_filename, storage_class))
         if globals.s3_use_sse:
             headers = {
@@ -239,13 +291,34 @@ class BotoBackend(duplicity.backend.Backend):
             }
 
         upload_start = time.time()
-        self.upload(source_path.name, key, headers)
+        info = self.upload(source_path.name, key, headers)
         upload_end = time.time()
         total_s = abs(upload_end - upload_start) or 1  # prevent a zero value!
         rough_upload_speed = os.path.getsize(source_path.name) / total_s
         log.Debug("Uploaded %s/%s to %s Storage at roughly %f bytes/second" %
                   (self.straight_url, remote_filename, storage_class,
                    rough_upload_speed))
+        return info
+
+    def _copy_from(self, src_backend, remote_filename):
+        # S3 copies objects between buckets of the same endpoint by itself
+        if (not isinstance(src_backend, BotoBackend) or
+                src_backend.scheme != self.scheme or
+                src_backend.parsed_url.hostname != self.parsed_url.hostname):
+            return False
+        src_key_name = src_backend.key_prefix + remote_filename
+        src_key = src_backend._listed_keys.get(src_key_name)
+        if src_key is None or src_key.storage_class in ThawPlanner.cold_storage_classes:
+            # the copy would fail, a download restores it first
+            return False
+        storage_class = self.get_storage_class()
+        log.Info("Copying %s/%s to %s/%s in %s Storage" %
+                 (src_backend.straight_url, remote_filename,
+                  self.straight_url, remote_filename, storage_class))
+        self.bucket.copy_key(self.key_prefix + remote_filename,
+                             src_backend.bucket_name, src_key_name,
+                             storage_class=storage_class,
+                             encrypt_key=globals.s3_use_sse)
 
     def _get(self, remote_filename, local_path):
         key_name = self.key_prefix + remote_filename
@@ -254,6 +327,20 @@ class BotoBackend(duplicity.backend.Backend):
         self.resetConnection()
         key.get_contents_to_filename(local_path.name)
 
+    def _read_range(self, remote_filename, offset, length):
+        if offset == 0:
+            # the first range is read before the others are started, so
+            # they all wait for a restore from Glacier here
+            self.pre_process_download(remote_filename, wait=True)
+        # boto connections are not safe to share between threads, so
+        # each range is read over a connection of its own
+        conn = get_connection(self.scheme, self.parsed_url, self.storage_uri)
+        try:
+            key = conn.get_bucket(self.bucket_name, validate=False).new_key(self.key_prefix + remote_filename)
+            return key.get_contents_as_string(headers={'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        finally:
+            conn.close()
+
     def _list(self):
         if not self.bucket:
             raise BackendException("No connection to backend")
@@ -283,34 +370,55 @@ class BotoBackend(duplicity.backend.Backend):
     def _delete(self, filename):
         self.bucket.delete_key(self.key_prefix + filename)
 
+    # largest number of keys S3 deletes with one request
+    delete_list_size = 1000
+
+    def _delete_list(self, filename_list):
+        result = self.bucket.delete_keys([self.key_prefix + filename for filename in filename_list],
+                                         quiet=True)
+        if result.errors:
+            raise BackendException("Failed to delete %s" %
+                                   ", ".join("%s (%s)" % (e.key, e.code) for e in result.errors))
+
     def _query(self, filename):
         key = self.bucket.lookup(self.key_prefix + filename)
         if key is None:
             return {'size': -1}
         return {'size': key.size}
 
+    def get_storage_class(self):
+        if globals.s3_use_rrs:
+            return 'REDUCED_REDUNDANCY'
+        elif globals.s3_use_ia:
+            return 'STANDARD_IA'
+        elif globals.s3_use_onezone_ia:
+            return 'ONEZONE_IA'
+        else:
+            return 'STANDARD'
+
     def upload(self, filename, key, headers):
         key.set_contents_from_filename(filename, headers,
                                        cb=progress.report_transfer,
                                        num_cb=(max(2, 8 * globals.volsize / (1024 * 1024)))
                                        )  # Max num of callbacks = 8 times x megabyte
         key.close()
+        # boto sends the Content-MD5 of the file, and S3 only stores
+        # the object if its MD5 matches, so the upload is verified
+        return {'size': os.path.getsize(filename)}
 
-    def pre_process_download(self, remote_filename, wait=False):
-        # Used primarily to move files in Glacier to S3
+    def get_listed_key(self, remote_filename):
         key_name = self.key_prefix + remote_filename
         if not self._listed_keys.get(key_name, False):
             self._listed_keys[key_name] = list(self.bucket.list(key_name))[0]
-        key = self._listed_keys[key_name]
+        return self._listed_keys[key_name]
 
-        if key.storage_class == "GLACIER":
-            # We need to move the file out of glacier
-            if not self.bucket.get_key(key.key).ongoing_restore:
-                log.Info("File %s is in Glacier storage, restoring to S3" % remote_filename)
-                key.restore(days=1)  # Shouldn't need this again after 1 day
-            if wait:
-                log.Info("Waiting for file %s to restore from Glacier" % remote_filename)
-                while self.bucket.get_key(key.key).ongoing_restore:
-                    time.sleep(60)
-                    self.resetConnection()
-                log.Info("File %s was successfully restored from Glacier" % remote_filename)
+    def pre_process_download(self, remote_filename, wait=False):
+        # Used primarily to move files in Glacier to S3
+        key = self.get_listed_key(remote_filename)
+        self.thaw_planner.request([key])
+        if wait:
+            self.thaw_planner.wait(key.key)
+
+    def pre_process_download_batch(self, remote_filenames):
+        # Request all files in Glacier at once, the first _get waits
+        self.thaw_planner.request([self.get_listed_key(f) for f in remote_filenames])
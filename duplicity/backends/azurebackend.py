@@ -128,6 +128,17 @@ Exception: %s""" % str(e))
         # https://azure.microsoft.com/en-us/documentation/articles/storage-python-how-to-use-blob-storage/#download-blobs
         self.blob_service.get_blob_to_path(self.container, remote_filename, local_path.name)
 
+    def _read_range(self, remote_filename, offset, length):
+        end = offset + length - 1
+        if hasattr(self.blob_service, 'get_blob_to_bytes'):
+            blob = self.blob_service.get_blob_to_bytes(self.container, remote_filename,
+                                                       start_range=offset, end_range=end,
+                                                       max_connections=1)
+            # azure-storage>=0.30.0 returns a Blob object
+            return getattr(blob, 'content', blob)
+        return self.blob_service.get_blob(self.container, remote_filename,
+                                          x_ms_range='bytes=%d-%d' % (offset, end))
+
     def _list(self):
         # https://azure.microsoft.com/en-us/documentation/articles/storage-python-how-to-use-blob-storage/#list-the-blobs-in-a-container
         blobs = []
@@ -102,14 +102,26 @@ class B2Backend(duplicity.backend.Backend):
         self.bucket.download_file_by_name(quote_plus(self.path + remote_filename),
                                           b2.download_dest.DownloadDestLocalFile(local_path.name))
 
+    def _read_range(self, remote_filename, offset, length):
+        """
+        Return length bytes of remote_filename from offset
+        """
+        download_dest = b2.download_dest.DownloadDestBytes()
+        self.bucket.download_file_by_name(quote_plus(self.path + remote_filename), download_dest,
+                                          range_=(offset, offset + length - 1))
+        return download_dest.get_bytes_written()
+
     def _put(self, source_path, remote_filename):
         """
         Copy source_path to remote_filename
         """
         log.Log("Put: %s -> %s" % (source_path.name, self.path + remote_filename), log.INFO)
-        self.bucket.upload_local_file(source_path.name, quote_plus(self.path + remote_filename),
-                                      content_type='application/pgp-encrypted',
-                                      progress_listener=B2ProgressListener())
+        file_version_info = self.bucket.upload_local_file(source_path.name,
+                                                          quote_plus(self.path + remote_filename),
+                                                          content_type='application/pgp-encrypted',
+                                                          progress_listener=B2ProgressListener())
+        # B2 checked the SHA1 sent along, and reports what it stored
+        return {'size': getattr(file_version_info, 'size', None)}
 
     def _list(self):
         """
@@ -53,14 +53,29 @@ class LocalBackend(duplicity.backend.Backend):
         except OSError:
             return False
 
+    def _copy_from(self, src_backend, remote_filename):
+        if not isinstance(src_backend, LocalBackend):
+            return False
+        source_path = src_backend.remote_pathdir.append(remote_filename)
+        self._put(source_path, remote_filename)
+
     def _put(self, source_path, remote_filename):
         target_path = self.remote_pathdir.append(remote_filename)
         target_path.writefileobj(source_path.open("rb"))
+        return {'size': target_path.getsize()}
 
     def _get(self, filename, local_path):
         source_path = self.remote_pathdir.append(filename)
         local_path.writefileobj(source_path.open("rb"))
 
+    def _read_range(self, filename, offset, length):
+        fp = self.remote_pathdir.append(filename).open("rb")
+        try:
+            fp.seek(offset)
+            return fp.read(length)
+        finally:
+            fp.close()
+
     def _list(self):
         return self.remote_pathdir.listdir()
 
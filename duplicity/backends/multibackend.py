@@ -25,14 +25,21 @@
 
 import os
 import os.path
+import Queue
 import string
+import threading
+import time
 import urllib
 import urlparse
 import json
 
 import duplicity.backend
 from duplicity.errors import BackendException
+from duplicity import erasure
 from duplicity import log
+from duplicity import path
+from duplicity import tempdir
+from duplicity import util
 
 
 class MultiBackend(duplicity.backend.Backend):
@@ -45,18 +52,29 @@ class MultiBackend(duplicity.backend.Backend):
 
     # Set of known query paramaters
     __knownQueryParameters = frozenset([
+        'data',
+        'hedge',
         'mode',
         'onfail',
+        'quorum',
+        'read',
+        'stripe',
     ])
 
     # the mode of operation to follow
-    # can be one of 'stripe' or 'mirror' currently
+    # can be one of 'stripe', 'mirror' or 'erasure' currently
     __mode = 'stripe'
     __mode_allowedSet = frozenset([
+        'erasure',
         'mirror',
         'stripe',
     ])
 
+    # in erasure mode, the number of data shards each file is split
+    # into; with n stores, n - data parity shards are added, and any
+    # data shards give back the file.  Defaults to n - 1.
+    __data_shards = None
+
     # the write error handling logic
     # can be one of the following:
     # * continue - default, on failure continues to next source
@@ -67,12 +85,41 @@ class MultiBackend(duplicity.backend.Backend):
         'continue',
     ])
 
+    # the number of stores a mirror write must reach to succeed
+    # defaults to 1 with onfail=continue, all stores with onfail=abort
+    __quorum = None
+
     # when we write in stripe mode, we "stripe" via a simple round-robin across
-    # remote stores.  It's hard to get too much more sophisticated
-    # since we can't rely on the backend to give us any useful meta
-    # data (e.g. sizes of files, capacity of the store (quotas)) to do
-    # a better job of balancing load across stores.
+    # remote stores by default.  We can't rely on the backend to give us
+    # any useful meta data (e.g. capacity of the store (quotas)), but we
+    # know what we wrote ourselves, so we can also place each file on the
+    # store with the fewest bytes written so far ('size'), or on the store
+    # expected to be done with its share first given the write speed
+    # measured so far ('throughput').
     __write_cursor = 0
+    __stripe_policy = 'roundrobin'
+    __stripe_policy_allowedSet = frozenset([
+        'roundrobin',
+        'size',
+        'throughput',
+    ])
+
+    # the store to read a file from when several have it
+    # * order - default, the first in config order
+    # * fastest - the one with the best read speed measured so far
+    __read_policy = 'order'
+    __read_policy_allowedSet = frozenset([
+        'fastest',
+        'order',
+    ])
+
+    # if set, a read taking longer than this percentile of the previous
+    # reads from its store is also started on the next store, and the
+    # first to complete is used
+    __hedge = None
+
+    # number of previous read durations kept per store
+    __read_samples = 20
 
     @staticmethod
     def get_query_params(parsed_url):
@@ -156,6 +203,74 @@ class MultiBackend(duplicity.backend.Backend):
                     % ('onfail', self.__onfail_mode), log.ERROR)
             raise BackendException("MultiBackend: invalid onfail value")
 
+        if 'quorum' in queryParams:
+            try:
+                self.__quorum = int(queryParams['quorum'])
+            except ValueError:
+                self.__quorum = 0
+            if self.__quorum < 1:
+                log.Log(_("MultiBackend: illegal value for %s: %s")
+                        % ('quorum', queryParams['quorum']), log.ERROR)
+                raise BackendException("MultiBackend: invalid quorum value")
+
+        if 'data' in queryParams:
+            try:
+                self.__data_shards = int(queryParams['data'])
+            except ValueError:
+                self.__data_shards = 0
+            if self.__data_shards < 1:
+                log.Log(_("MultiBackend: illegal value for %s: %s")
+                        % ('data', queryParams['data']), log.ERROR)
+                raise BackendException("MultiBackend: invalid data value")
+
+        if 'stripe' in queryParams:
+            self.__stripe_policy = queryParams['stripe']
+
+        if self.__stripe_policy not in MultiBackend.__stripe_policy_allowedSet:
+            log.Log(_("MultiBackend: illegal value for %s: %s")
+                    % ('stripe', self.__stripe_policy), log.ERROR)
+            raise BackendException("MultiBackend: invalid stripe value")
+
+        if 'read' in queryParams:
+            self.__read_policy = queryParams['read']
+
+        if self.__read_policy not in MultiBackend.__read_policy_allowedSet:
+            log.Log(_("MultiBackend: illegal value for %s: %s")
+                    % ('read', self.__read_policy), log.ERROR)
+            raise BackendException("MultiBackend: invalid read value")
+
+        if 'hedge' in queryParams:
+            try:
+                self.__hedge = int(queryParams['hedge'])
+            except ValueError:
+                self.__hedge = 0
+            if not 0 < self.__hedge < 100:
+                log.Log(_("MultiBackend: illegal value for %s: %s")
+                        % ('hedge', queryParams['hedge']), log.ERROR)
+                raise BackendException("MultiBackend: invalid hedge value")
+
+        # the stores of this instance, not shared with other instances
+        self.__stores = []
+        self.__affinities = {}
+
+        # bytes written to and seconds spent writing to each store,
+        # by this process; updated from several threads in mirror mode
+        self.__write_stats = {}
+        self.__write_stats_lock = threading.Lock()
+
+        # per store, the read speed in bytes/second (a moving average)
+        # and the durations of the last reads
+        self.__read_stats = {}
+
+        # the files in each store, once listed, kept up to date as we
+        # write and delete
+        self.__listings = {}
+
+        # per store, the thread of a read we stopped waiting for; the
+        # store is not read from again until it is done
+        self.__inflight = {}
+        self.__read_lock = threading.Lock()
+
         try:
             with open(parsed_url.path) as f:
                 configs = json.load(f)
@@ -188,8 +303,9 @@ class MultiBackend(duplicity.backend.Backend):
 
             # Prefix affinity
             if 'prefixes' in config:
-                if self.__mode == 'stripe':
-                    raise BackendException("Multibackend: stripe mode not supported with prefix affinity.")
+                if self.__mode in ('stripe', 'erasure'):
+                    raise BackendException("Multibackend: %s mode not supported with prefix affinity."
+                                           % self.__mode)
                 for prefix in config['prefixes']:
                     log.Log(_("Multibackend: register affinity for prefix %s")
                             % prefix, log.INFO)
@@ -203,6 +319,18 @@ class MultiBackend(duplicity.backend.Backend):
             #         % (url, len(store_list)),
             #         log.INFO)
 
+        if self.__mode == 'erasure':
+            if self.__data_shards is None:
+                self.__data_shards = len(self.__stores) - 1
+            if not 1 <= self.__data_shards < len(self.__stores):
+                log.Log(_("MultiBackend: erasure mode needs fewer data shards (%s) than stores (%s)")
+                        % (self.__data_shards, len(self.__stores)), log.ERROR)
+                raise BackendException("MultiBackend: invalid data value")
+            if self.__quorum and self.__quorum < self.__data_shards:
+                log.Log(_("MultiBackend: erasure mode needs a quorum of at least %s")
+                        % self.__data_shards, log.ERROR)
+                raise BackendException("MultiBackend: invalid quorum value")
+
     def _eligible_stores(self, filename):
         if self.__affinities:
             matching_prefixes = [k for k in self.__affinities.keys() if filename.startswith(k)]
@@ -214,41 +342,258 @@ class MultiBackend(duplicity.backend.Backend):
         # No affinity rule or no matching store for that prefix
         return self.__stores
 
-    def _put(self, source_path, remote_filename):
-        # Store an indication of whether any of these passed
-        passed = False
+    def _map_stores(self, fn, stores):
+        """
+        Call fn(store) for all stores at once, return list of
+        (store, result, exception) in store order
+        """
+        def call(store):
+            try:
+                return store, fn(store), None
+            except BaseException as e:
+                # SystemExit from log.FatalError too, which would
+                # otherwise just end the pool thread
+                return store, None, e
 
+        return util.run_concurrently(call, stores, len(stores))
+
+    def _write_to_store(self, store, source_path, remote_filename):
+        log.Log(_("MultiBackend: _put: write to store #%s (%s)")
+                % (self.__stores.index(store), store.backend.parsed_url.url_string),
+                log.DEBUG)
+        start = time.time()
+        store.put(source_path, remote_filename)
+        seconds = time.time() - start
+        with self.__write_stats_lock:
+            stats = self.__write_stats.setdefault(store, [0, 0.0])
+            stats[0] += os.path.getsize(source_path.name)
+            stats[1] += seconds
+            if store in self.__listings:
+                self.__listings[store].add(remote_filename)
+
+    def _put(self, source_path, remote_filename):
         # Eligibile stores for this action
         stores = self._eligible_stores(remote_filename)
 
-        # Mirror mode always starts at zero
         if self.__mode == 'mirror':
-            self.__write_cursor = 0
+            self._put_mirror(stores, source_path, remote_filename)
+        elif self.__mode == 'erasure':
+            self._put_erasure(stores, source_path, remote_filename)
+        else:
+            self._put_stripe(stores, source_path, remote_filename)
+
+    def _put_mirror(self, stores, source_path, remote_filename):
+        # Write to all stores at once, and wait for all of them since
+        # source_path may be gone once we return
+        if self.__onfail_mode == 'abort':
+            quorum = len(stores)
+        else:
+            quorum = min(self.__quorum or 1, len(stores))
+
+        passed = 0
+        for store, result, e in self._map_stores(
+                lambda store: self._write_to_store(store, source_path, remote_filename),
+                stores):
+            if e is None:
+                passed += 1
+                continue
+            log.Log(_("MultiBackend: failed to write to store #%s (%s), Exception: %s")
+                    % (self.__stores.index(store), store.backend.parsed_url.url_string, e),
+                    log.INFO)
 
-        first = self.__write_cursor
-        while True:
-            store = stores[self.__write_cursor]
+        if passed < quorum:
+            if self.__onfail_mode == 'abort':
+                log.Log(_("MultiBackend: failed to write %s. Aborting process.")
+                        % (source_path),
+                        log.ERROR)
+            else:
+                log.Log(_("MultiBackend: failed to write %s. Only %s of %s backing stores succeeded, %s needed")
+                        % (source_path, passed, len(stores), quorum),
+                        log.ERROR)
+            raise BackendException("failed to write")
+
+    # each shard ends with its index and a footer giving the shard
+    # number and the index length, so any shard can be read by itself
+    __shard_footer = "%08d %020d\n"
+    __shard_footer_size = 30
+
+    def _put_erasure(self, stores, source_path, remote_filename):
+        # Code the file into one shard per store, and write them all at
+        # once.  The shards are named like the file, store i has shard i.
+        k = self.__data_shards
+        m = len(stores) - k
+        if self.__onfail_mode == 'abort':
+            quorum = len(stores)
+        else:
+            quorum = self.__quorum or k
+
+        shard_paths = [path.Path(tempdir.default().mktemp()) for store in stores]
+        try:
+            shard_fps = [open(p.name, "wb") for p in shard_paths]
             try:
-                next = self.__write_cursor + 1
-                if (next > len(stores) - 1):
-                    next = 0
-                log.Log(_("MultiBackend: _put: write to store #%s (%s)")
-                        % (self.__write_cursor, store.backend.parsed_url.url_string),
-                        log.DEBUG)
-                store.put(source_path, remote_filename)
-                passed = True
-                self.__write_cursor = next
-                # No matter what, if we loop around, break this loop
-                if next == 0:
-                    break
-                # If in stripe mode, don't continue to the next
-                if self.__mode == 'stripe':
-                    break
+                with open(source_path.name, "rb") as infp:
+                    block_size = erasure.get_block_size(os.path.getsize(source_path.name), k)
+                    index = erasure.encode(infp, k, m, block_size, shard_fps[k:], shard_fps[:k])
+                index_string = index.to_string()
+                for i, fp in enumerate(shard_fps):
+                    fp.write(index_string)
+                    fp.write(self.__shard_footer % (i, len(index_string)))
+            finally:
+                for fp in shard_fps:
+                    fp.close()
+
+            passed = 0
+            for store, result, e in self._map_stores(
+                    lambda store: self._write_to_store(store, shard_paths[stores.index(store)],
+                                                       remote_filename),
+                    stores):
+                if e is None:
+                    passed += 1
+                    continue
+                log.Log(_("MultiBackend: failed to write to store #%s (%s), Exception: %s")
+                        % (self.__stores.index(store), store.backend.parsed_url.url_string, e),
+                        log.INFO)
+        finally:
+            for p in shard_paths:
+                self._delete_temp(p)
+
+        if passed < quorum:
+            log.Log(_("MultiBackend: failed to write %s. Only %s of %s shards stored, %s needed")
+                    % (source_path, passed, len(stores), quorum),
+                    log.ERROR)
+            raise BackendException("failed to write")
+        if passed < len(stores):
+            log.Log(_("MultiBackend: only %s of %s shards of %s stored")
+                    % (passed, len(stores), remote_filename),
+                    log.WARNING)
+
+    def _read_shard(self, shard_path):
+        """
+        Return (shard number, ErasureIndex) of shard file shard_path
+        """
+        with open(shard_path.name, "rb") as fp:
+            try:
+                fp.seek(-self.__shard_footer_size, 2)
+                footer = fp.read().split()
+                number, index_size = int(footer[0]), int(footer[1])
+                fp.seek(-self.__shard_footer_size - index_size, 2)
+            except (IOError, IndexError, ValueError):
+                raise erasure.ErasureError("Bad shard footer")
+            index = erasure.ErasureIndex().from_string(fp.read(index_size))
+        if not 0 <= number < index.k + index.m:
+            raise erasure.ErasureError("Bad shard number")
+        return number, index
+
+    def _decode_shards(self, shards, local_path):
+        """
+        Write the file coded in dict shards (number -> (path, index))
+        to local_path, or raise ErasureError
+        """
+        indexes = {}
+        for shard_path, index in shards.values():
+            indexes[index.to_string()] = index
+        shard_fps = []
+        try:
+            for index in indexes.values():
+                # a corrupt shard may have a corrupt index too
+                shard_fps = [None] * (index.k + index.m)
+                for number, (shard_path, shard_index) in shards.items():
+                    if number < len(shard_fps):
+                        shard_fps[number] = open(shard_path.name, "rb")
+                try:
+                    with open(local_path.name, "wb") as outfp:
+                        erasure.decode(shard_fps, index, outfp)
+                    return
+                except erasure.ErasureError as e:
+                    error = e
+                finally:
+                    for fp in shard_fps:
+                        if fp:
+                            fp.close()
+            raise error
+        finally:
+            local_path.setdata()
+
+    def _get_erasure(self, stores, remote_filename, local_path):
+        # Read the shards from all stores at once, and decode once
+        # enough have arrived
+        results = Queue.Queue()
+        state = {'done': False}
+        for store in stores:
+            self._start_read(store, remote_filename, results, state)
+
+        shards = {}
+        running = len(stores)
+        try:
+            while running:
+                store, tmp_path, error = results.get()
+                running -= 1
+                if error is None:
+                    try:
+                        number, index = self._read_shard(tmp_path)
+                    except erasure.ErasureError as e:
+                        self._delete_temp(tmp_path)
+                        error = e
+                if error is not None:
+                    log.Log(_("MultiBackend: failed to get %s from %s, Exception: %s")
+                            % (remote_filename, store.backend.parsed_url.url_string, error),
+                            log.INFO)
+                    continue
+                if number in shards:
+                    self._delete_temp(tmp_path)
+                    continue
+                shards[number] = (tmp_path, index)
+                if len(shards) < index.k:
+                    continue
+                try:
+                    self._decode_shards(shards, local_path)
+                    return
+                except erasure.ErasureError as e:
+                    log.Log(_("MultiBackend: cannot decode %s from %s shards yet: %s")
+                            % (remote_filename, len(shards), e),
+                            log.INFO)
+            log.Log(_("MultiBackend: failed to get %s. Too few intact shards")
+                    % (remote_filename),
+                    log.ERROR)
+            raise BackendException("failed to get")
+        finally:
+            self._finish_reads(results, state)
+            for tmp_path, index in shards.values():
+                self._delete_temp(tmp_path)
+
+    def _stripe_order(self, stores, size):
+        """
+        Return stores in the order to try them for a file of size bytes
+        """
+        if self.__stripe_policy == 'roundrobin':
+            first = self.__write_cursor % len(stores)
+            return stores[first:] + stores[:first]
+
+        def done_at(store):
+            """Relative time the store would be done with this file too"""
+            written, seconds = self.__write_stats.get(store, (0, 0.0))
+            if self.__stripe_policy == 'size':
+                return written + size
+            if not written or not seconds:
+                # not measured yet, try it first
+                return 0
+            return (written + size) * seconds / written
+
+        return sorted(stores, key=done_at)
+
+    def _put_stripe(self, stores, source_path, remote_filename):
+        size = os.path.getsize(source_path.name)
+        for store in self._stripe_order(stores, size):
+            index = stores.index(store)
+            try:
+                self._write_to_store(store, source_path, remote_filename)
+                self.__write_cursor = (index + 1) % len(stores)
+                return
             except Exception as e:
-                log.Log(_("MultiBackend: failed to write to store #%s (%s), try #%s, Exception: %s")
-                        % (self.__write_cursor, store.backend.parsed_url.url_string, next, e),
+                log.Log(_("MultiBackend: failed to write to store #%s (%s), Exception: %s")
+                        % (index, store.backend.parsed_url.url_string, e),
                         log.INFO)
-                self.__write_cursor = next
+                self.__write_cursor = (index + 1) % len(stores)
 
                 # If we consider write failure as abort, abort
                 if self.__onfail_mode == 'abort':
@@ -257,43 +602,198 @@ class MultiBackend(duplicity.backend.Backend):
                             log.ERROR)
                     raise BackendException("failed to write")
 
-                # If we've looped around, and none of them passed, fail
-                if (self.__write_cursor == first) and not passed:
-                    log.Log(_("MultiBackend: failed to write %s. Tried all backing stores and none succeeded")
-                            % (source_path),
-                            log.ERROR)
-                    raise BackendException("failed to write")
+        log.Log(_("MultiBackend: failed to write %s. Tried all backing stores and none succeeded")
+                % (source_path),
+                log.ERROR)
+        raise BackendException("failed to write")
+
+    def _store_list(self, store):
+        """
+        Return the set of files in store, listing it only the first time
+        """
+        if store not in self.__listings:
+            self.__listings[store] = set(store.list())
+        return self.__listings[store]
+
+    def _read_order(self, stores):
+        """
+        Return stores in the order to read from them
+        """
+        if self.__read_policy == 'fastest':
+            def speed(store):
+                # stores not read from yet come first, to be measured
+                stats = self.__read_stats.get(store)
+                return -stats[0] if stats else -float('inf')
+            stores = sorted(stores, key=speed)
+        # stores still busy with a read we gave up on come last
+        return ([s for s in stores if s not in self.__inflight] +
+                [s for s in stores if s in self.__inflight])
+
+    def _read_from_store(self, store, remote_filename, local_path):
+        log.Log(_("MultiBackend: _get: read from store #%s (%s)")
+                % (self.__stores.index(store), store.backend.parsed_url.url_string),
+                log.DEBUG)
+        start = time.time()
+        store.get(remote_filename, local_path)
+        seconds = max(time.time() - start, 1e-6)
+        speed = os.path.getsize(local_path.name) / seconds
+        with self.__read_lock:
+            stats = self.__read_stats.setdefault(store, [speed, []])
+            stats[0] = 0.7 * stats[0] + 0.3 * speed
+            stats[1] = (stats[1] + [seconds])[-self.__read_samples:]
+
+    def _wait_idle(self, store):
+        thread = self.__inflight.get(store)
+        if thread:
+            thread.join()
+
+    def _hedge_delay(self, store):
+        """
+        Return seconds to wait for store before reading elsewhere too,
+        None when there are too few previous reads to tell
+        """
+        samples = self.__read_stats.get(store, [0, []])[1]
+        if len(samples) < 3:
+            # judge by the reads from all stores instead
+            samples = [s for stats in self.__read_stats.values() for s in stats[1]]
+            if len(samples) < 3:
+                return None
+        samples = sorted(samples)
+        return samples[min(len(samples) - 1, len(samples) * self.__hedge // 100)]
 
     def _get(self, remote_filename, local_path):
         # since the backend operations will be retried, we can't
         # simply try to get from the store, if not found, move to the
         # next store (since each failure will be retried n times
-        # before finally giving up).  So we need to get the list first
-        # before we try to fetch
-        # ENHANCEME: maintain a cached list for each store
-        stores = self._eligible_stores(remote_filename)
-
-        for s in stores:
-            list = s.list()
-            if remote_filename in list:
-                s.get(remote_filename, local_path)
-                return
-            log.Log(_("MultiBackend: failed to get %s to %s from %s")
-                    % (remote_filename, local_path, s.backend.parsed_url.url_string),
+        # before finally giving up).  So we use the list of each store
+        # to find the ones that have the file.
+        stores = [s for s in self._read_order(self._eligible_stores(remote_filename))
+                  if remote_filename in self._store_list(s)]
+        if not stores:
+            log.Log(_("MultiBackend: failed to get %s. Tried all backing stores and none succeeded")
+                    % (remote_filename),
+                    log.ERROR)
+            raise BackendException("failed to get")
+
+        if self.__mode == 'erasure':
+            self._get_erasure(stores, remote_filename, local_path)
+        elif self.__hedge and len(stores) > 1:
+            self._get_hedged(stores, remote_filename, local_path)
+        else:
+            self._wait_idle(stores[0])
+            self._read_from_store(stores[0], remote_filename, local_path)
+
+    def _start_read(self, store, remote_filename, results, state):
+        """
+        Read remote_filename from store into a temp file in a thread
+
+        (store, temp path, None) or (store, None, exception) is put to
+        queue results when done, unless state['done'] is set by then,
+        in which case the temp file is deleted.
+        """
+        def fetch(tmp_path):
+            error = None
+            try:
+                self._read_from_store(store, remote_filename, tmp_path)
+            except BaseException as e:
+                # SystemExit from log.FatalError too, we may still
+                # get the file elsewhere
+                error = e
+            with self.__read_lock:
+                if self.__inflight.get(store) is threading.current_thread():
+                    del self.__inflight[store]
+                if error is None and not state['done']:
+                    results.put((store, tmp_path, None))
+                    return
+                if error is not None and not state['done']:
+                    results.put((store, None, error))
+            self._delete_temp(tmp_path)
+
+        self._wait_idle(store)
+        tmp_path = path.Path(tempdir.default().mktemp())
+        thread = threading.Thread(target=fetch, args=(tmp_path,))
+        thread.daemon = True
+        with self.__read_lock:
+            self.__inflight[store] = thread
+        thread.start()
+
+    def _finish_reads(self, results, state):
+        """
+        Drop the reads started with results and state still to come
+        """
+        with self.__read_lock:
+            state['done'] = True
+        while True:
+            try:
+                store, tmp_path, e = results.get_nowait()
+            except Queue.Empty:
+                break
+            if tmp_path:
+                self._delete_temp(tmp_path)
+
+    def _delete_temp(self, tmp_path):
+        tmp_path.setdata()
+        if tmp_path.exists():
+            tmp_path.delete()
+        tempdir.default().forget(tmp_path.name)
+
+    def _get_hedged(self, stores, remote_filename, local_path):
+        results = Queue.Queue()
+        state = {'done': False}
+
+        self._start_read(stores[0], remote_filename, results, state)
+        started = 1
+        running = 1
+        delay = self._hedge_delay(stores[0])
+        winner = None
+        while running:
+            try:
+                if started < len(stores):
+                    store, tmp_path, e = results.get(timeout=delay)
+                else:
+                    store, tmp_path, e = results.get()
+            except Queue.Empty:
+                log.Log(_("MultiBackend: reading %s from store #%s takes over %.1f seconds, also reading from #%s")
+                        % (remote_filename, self.__stores.index(stores[started - 1]), delay,
+                           self.__stores.index(stores[started])),
+                        log.INFO)
+                self._start_read(stores[started], remote_filename, results, state)
+                started += 1
+                running += 1
+                continue
+            running -= 1
+            if e is None:
+                winner = tmp_path
+                break
+            log.Log(_("MultiBackend: failed to get %s from %s, Exception: %s")
+                    % (remote_filename, store.backend.parsed_url.url_string, e),
                     log.INFO)
-        log.Log(_("MultiBackend: failed to get %s. Tried all backing stores and none succeeded")
-                % (remote_filename),
-                log.ERROR)
-        raise BackendException("failed to get")
+            if not running and started < len(stores):
+                self._start_read(stores[started], remote_filename, results, state)
+                started += 1
+                running += 1
+
+        # a read that completed meanwhile is not needed either
+        self._finish_reads(results, state)
+
+        if not winner:
+            log.Log(_("MultiBackend: failed to get %s. Tried all backing stores and none succeeded")
+                    % (remote_filename),
+                    log.ERROR)
+            raise BackendException("failed to get")
+        winner.rename(local_path)
+        tempdir.default().forget(winner.name)
 
     def _list(self):
         lists = []
-        for s in self.__stores:
-            l = s.list()
+        for s, l, e in self._map_stores(lambda s: s.list(), self.__stores):
+            if e is not None:
+                raise e
             log.Log(_("MultiBackend: list from %s: %s")
                     % (s.backend.parsed_url.url_string, l),
                     log.DEBUG)
-            lists.append(s.list())
+            self.__listings[s] = set(l)
+            lists.append(l)
         # combine the lists into a single flat list w/o duplicates via set:
         result = list({item for sublist in lists for item in sublist})
         log.Log(_("MultiBackend: combined list: %s")
@@ -312,11 +812,10 @@ class MultiBackend(duplicity.backend.Backend):
         # next store (since each failure will be retried n times
         # before finally giving up).  So we need to get the list first
         # before we try to delete
-        # ENHANCEME: maintain a cached list for each store
         for s in stores:
-            list = s.list()
-            if filename in list:
+            if filename in self._store_list(s):
                 s._do_delete(filename)
+                self._store_list(s).discard(filename)
                 passed = True
                 # In stripe mode, only one item will have the file
                 if self.__mode == 'stripe':
@@ -20,26 +20,37 @@ from future_builtins import filter
 
 import os
 import re
+import threading
 from duplicity import backend
+from duplicity import erasure
 from duplicity.errors import BackendException
 from duplicity import log
 from duplicity import globals
 
+# data blocks per row of native recovery files
+native_blocks = 20
+
 
 class Par2Backend(backend.Backend):
     """This backend wrap around other backends and create Par2 recovery files
     before the file and the Par2 files are transfered with the wrapped backend.
 
     If a received file is corrupt it will try to repair it on the fly.
+
+    With --par2-native the recovery files are computed in-process with
+    erasure instead, while the file is transfered.
     """
     def __init__(self, parsed_url):
         backend.Backend.__init__(self, parsed_url)
 
+        self.native = globals.par2_native
+
         global pexpect
         try:
             import pexpect
         except ImportError:
-            raise
+            if not self.native:
+                raise
 
         self.parsed_url = parsed_url
         try:
@@ -60,9 +71,16 @@ class Par2Backend(backend.Backend):
             if hasattr(self.wrapped_backend, attr):
                 setattr(self, attr, getattr(self, attr[1:]))
 
-        # always declare _delete_list support because _delete queries file
-        # list for every call
+        # always declare _delete_list support, the .par2 files to delete
+        # are added by _get_delete_filenames, which queries the file
+        # list once for all files
         self._delete_list = self.delete_list
+        self._get_delete_filenames = self.get_delete_filenames
+        # and let BackendWrapper batch them as the wrapped backend likes
+        if hasattr(self.wrapped_backend, '_delete_list'):
+            self.delete_list_size = getattr(self.wrapped_backend, 'delete_list_size', 100)
+        else:
+            self.delete_list_size = 1
 
     def transfer(self, method, source_path, remote_filename):
         """create Par2 files and transfer the given file and the Par2 files
@@ -72,6 +90,9 @@ class Par2Backend(backend.Backend):
         temp-filename later on. So first of all create a tempdir and symlink
         the soure_path with remote_filename into this.
         """
+        if self.native:
+            return self.transfer_native(method, source_path, remote_filename)
+
         par2temp = source_path.get_temp_in_same_dir()
         par2temp.mkdir()
         source_symlink = par2temp.append(remote_filename)
@@ -97,6 +118,53 @@ class Par2Backend(backend.Backend):
 
         par2temp.deltree()
 
+    def transfer_native(self, method, source_path, remote_filename):
+        """compute Reed-Solomon recovery files while the given file is
+        transfered, then transfer them and their index.
+
+        The file is opened before the transfer, so it can still be read
+        when method moves it away.
+        """
+        par2temp = source_path.get_temp_in_same_dir()
+        par2temp.mkdir()
+        m = max(1, (native_blocks * self.redundancy + 99) // 100)
+        parity_files = [par2temp.append('%s.rs%d.par2' % (remote_filename, i + 1))
+                        for i in range(m)]
+        index_file = par2temp.append(remote_filename + '.rs.par2')
+        block_size = erasure.get_block_size(os.path.getsize(source_path.name),
+                                            native_blocks)
+        infp = source_path.open("rb")
+        result = []
+
+        def create():
+            parity_fps = [open(f.name, "wb") for f in parity_files]
+            try:
+                index = erasure.encode(infp, native_blocks, m, block_size, parity_fps)
+                with open(index_file.name, "wb") as fp:
+                    fp.write(index.to_string())
+                result.append(True)
+            except Exception as e:
+                log.Warn("Failed to create Par2 recovery files for %s: %s" % (remote_filename, e))
+            finally:
+                for fp in parity_fps:
+                    fp.close()
+
+        log.Info("Create Par2 recovery files")
+        thread = threading.Thread(target=create)
+        thread.start()
+        try:
+            method(source_path, remote_filename)
+        finally:
+            thread.join()
+            infp.close()
+
+        if result:
+            # the index last, so it only exists with all recovery files
+            for file in parity_files + [index_file]:
+                file.setdata()
+                method(file, file.get_filename())
+        par2temp.deltree()
+
     def put(self, local, remote):
         self.transfer(self.wrapped_backend._put, local, remote)
 
@@ -111,6 +179,9 @@ class Par2Backend(backend.Backend):
         If "par2 verify" detect an error transfer the Par2-volumes into the
         temp-dir and try to repair.
         """
+        if self.native:
+            return self.get_native(remote_filename, local_path)
+
         par2temp = local_path.get_temp_in_same_dir()
         par2temp.mkdir()
         local_path_temp = par2temp.append(remote_filename)
@@ -151,32 +222,79 @@ class Par2Backend(backend.Backend):
             local_path_temp.rename(local_path)
             par2temp.deltree()
 
-    def delete(self, filename):
-        """delete given filename and its .par2 files
+    def get_native(self, remote_filename, local_path):
+        """transfer remote_filename and its recovery index into a temp-dir
+        and check it block by block.  Recovery files are only transfered
+        to repair corrupt blocks, their names follow from remote_filename.
         """
-        self.wrapped_backend._delete(filename)
+        par2temp = local_path.get_temp_in_same_dir()
+        par2temp.mkdir()
+        local_path_temp = par2temp.append(remote_filename)
+        parity_fps = []
 
-        remote_list = self.unfiltered_list()
+        self.wrapped_backend._get(remote_filename, local_path_temp)
 
-        c = re.compile(r'%s(?:\.vol[\d+]*)?\.par2' % filename)
-        for remote_filename in remote_list:
-            if c.match(remote_filename):
-                self.wrapped_backend._delete(remote_filename)
+        def get_parity_fps():
+            log.Warn("File is corrupt. Try to repair %s" % remote_filename)
+            for i in range(index.m):
+                file = par2temp.append('%s.rs%d.par2' % (remote_filename, i + 1))
+                try:
+                    self.wrapped_backend._get(file.get_filename(), file)
+                    parity_fps.append(open(file.name, "rb"))
+                except (BackendException, EnvironmentError):
+                    parity_fps.append(None)
+            return parity_fps
 
-    def delete_list(self, filename_list):
-        """delete given filename_list and all .par2 files that belong to them
+        try:
+            index_file = par2temp.append(remote_filename + '.rs.par2')
+            try:
+                self.wrapped_backend._get(index_file.get_filename(), index_file)
+                index = erasure.ErasureIndex().from_string(index_file.get_data())
+            except (BackendException, EnvironmentError, erasure.ErasureError):
+                # recovery files not available
+                return
+            with open(local_path_temp.name, "r+b") as fp:
+                if erasure.repair(fp, index, get_parity_fps):
+                    log.Warn("Repair successful %s" % remote_filename)
+        except erasure.ErasureError as e:
+            log.Error("Failed to repair %s: %s" % (remote_filename, e))
+        finally:
+            for fp in parity_fps:
+                if fp:
+                    fp.close()
+            local_path_temp.rename(local_path)
+            par2temp.deltree()
+
+    def delete(self, filename):
+        """delete given filename and its .par2 files
         """
-        remote_list = self.unfiltered_list()
+        self.delete_list(self.get_delete_filenames([filename]))
 
-        for filename in filename_list[:]:
-            c = re.compile(r'%s(?:\.vol[\d+]*)?\.par2' % filename)
-            for remote_filename in remote_list:
-                if c.match(remote_filename):
-                    # insert here to make sure par2 files will be removed first
-                    filename_list.insert(0, remote_filename)
+    def get_delete_filenames(self, filename_list):
+        """return filename_list with all .par2 files that belong to them
+        before it, so none are left behind without their file
+        """
+        c = re.compile(r'(.*?)(?:\.vol[\d+]*|\.rs\d*)?\.par2$')
+        par2_files = {}
+        for remote_filename in self.unfiltered_list():
+            m = c.match(remote_filename)
+            if m:
+                par2_files.setdefault(m.group(1), []).append(remote_filename)
+
+        filenames = set(filename_list)
+        par2_list = []
+        for filename in filename_list:
+            par2_list.extend([f for f in par2_files.get(filename, [])
+                              if f not in filenames])
+        return par2_list + filename_list
 
+    def delete_list(self, filename_list):
+        """delete given filename_list with the wrapped backend, the .par2
+        files are added before by get_delete_filenames
+        """
+        # retries are left to the BackendWrapper around this backend
         if hasattr(self.wrapped_backend, '_delete_list'):
-            return self.wrapped_backend._delete_list(filename_list)
+            self.wrapped_backend._delete_list(filename_list)
         else:
             for filename in filename_list:
                 self.wrapped_backend._delete(filename)
@@ -0,0 +1,212 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import os
+import random
+import threading
+import time
+import urllib
+import urlparse
+
+import duplicity.backend
+from duplicity import log
+from duplicity.errors import BackendException
+from duplicity.errors import TemporaryLoadException
+
+
+class ShapedBackend(duplicity.backend.Backend):
+    u"""
+    Wrap another backend, usually file://, to behave like a slow remote
+
+    For testing and benchmarking only.  URLs look like
+
+      shaped+file:///tmp/remote?latency=0.1&stream_bandwidth=1000000
+
+    with these query parameters, all optional:
+
+      latency           seconds each operation waits before it starts
+      jitter            up to this many seconds more, at random
+      bandwidth         bytes per second shared by all transfers
+      stream_bandwidth  bytes per second of each transfer
+      fail              probability of an operation failing
+      fail_ops          comma separated operations that may fail, e.g.
+                        put,get; all of them by default
+      concurrency       operations served at once, more have to wait
+      rate              operations served per second, more are refused
+                        as if the remote were overloaded
+      seed              seed of the random jitter and failures
+
+    The operations are put, get, read_range, list, delete and query.
+    Other query parameters are left in the URL of the wrapped backend.
+    """
+    __params = {
+        u'latency': float,
+        u'jitter': float,
+        u'bandwidth': float,
+        u'stream_bandwidth': float,
+        u'fail': float,
+        u'fail_ops': str,
+        u'concurrency': int,
+        u'rate': float,
+        u'seed': int,
+    }
+
+    def __init__(self, parsed_url):
+        duplicity.backend.Backend.__init__(self, parsed_url)
+
+        url = urlparse.urlsplit(parsed_url.url_string)
+        params = {}
+        rest = []
+        for name, value in urlparse.parse_qsl(url.query):
+            if name in self.__params:
+                try:
+                    params[name] = self.__params[name](value)
+                except ValueError:
+                    raise BackendException(u"ShapedBackend: invalid value for %s: %s" % (name, value))
+            else:
+                rest.append((name, value))
+
+        self.latency = params.get(u'latency', 0.0)
+        self.jitter = params.get(u'jitter', 0.0)
+        self.bandwidth = params.get(u'bandwidth')
+        self.stream_bandwidth = params.get(u'stream_bandwidth')
+        self.fail = params.get(u'fail', 0.0)
+        self.fail_ops = None
+        if u'fail_ops' in params:
+            self.fail_ops = params[u'fail_ops'].split(u',')
+        self.slots = None
+        if params.get(u'concurrency'):
+            self.slots = threading.Semaphore(params[u'concurrency'])
+        self.random = random.Random(params.get(u'seed'))
+        self.lock = threading.Lock()
+        self.link_free = 0.0  # time the shared link is done with earlier transfers
+        self.rate = params.get(u'rate')
+        self.rate_tokens = self.rate
+        self.rate_time = time.time()
+
+        wrapped_url = urlparse.urlunsplit(url[:3] + (urllib.urlencode(rest), url.fragment))
+        self.wrapped_backend = duplicity.backend.get_backend_object(wrapped_url)
+
+        for attr in [u'_get', u'_put', u'_read_range', u'_list', u'_delete', u'_delete_list',
+                     u'_query', u'_query_list', u'_retry_cleanup', u'_error_code', u'_close']:
+            if hasattr(self.wrapped_backend, attr):
+                setattr(self, attr, getattr(self, attr[1:]))
+        if hasattr(self.wrapped_backend, u'delete_list_size'):
+            self.delete_list_size = self.wrapped_backend.delete_list_size
+        if hasattr(self.wrapped_backend, u'_get_delete_filenames'):
+            self._get_delete_filenames = self.wrapped_backend._get_delete_filenames
+
+        log.Info(u"ShapedBackend: latency %s, jitter %s, bandwidth %s, stream bandwidth %s, "
+                 u"fail %s, concurrency %s, rate %s" %
+                 (self.latency, self.jitter, self.bandwidth, self.stream_bandwidth,
+                  self.fail, params.get(u'concurrency'), self.rate))
+
+    def shape(self, op, fn):
+        u"""
+        Call fn() as operation op of a slow and unreliable remote
+
+        fn returns a tuple of its result and the number of bytes it
+        transferred, which are sent at the configured bandwidth.
+        """
+        if self.slots:
+            self.slots.acquire()
+        try:
+            with self.lock:
+                delay = self.latency + self.random.uniform(0, self.jitter)
+                failed = (self.fail and (self.fail_ops is None or op in self.fail_ops) and
+                          self.random.random() < self.fail)
+                refused = False
+                if self.rate:
+                    now = time.time()
+                    self.rate_tokens = min(max(self.rate, 1.0),
+                                           self.rate_tokens + (now - self.rate_time) * self.rate)
+                    self.rate_time = now
+                    refused = self.rate_tokens < 1
+                    if not refused:
+                        self.rate_tokens -= 1
+            time.sleep(delay)
+            if refused:
+                raise TemporaryLoadException(u"ShapedBackend: too many requests, refused %s" % op)
+            if failed:
+                raise BackendException(u"ShapedBackend: injected failure of %s" % op)
+
+            start = time.time()
+            result, size = fn()
+            done = start
+            if self.stream_bandwidth:
+                done = start + size / self.stream_bandwidth
+            if self.bandwidth:
+                with self.lock:
+                    self.link_free = max(self.link_free, start) + size / self.bandwidth
+                    done = max(done, self.link_free)
+            wait = done - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            return result
+        finally:
+            if self.slots:
+                self.slots.release()
+
+    def put(self, source_path, remote_filename):
+        def do_put():
+            return (self.wrapped_backend._put(source_path, remote_filename),
+                    os.path.getsize(source_path.name))
+        return self.shape(u'put', do_put)
+
+    def get(self, remote_filename, local_path):
+        def do_get():
+            self.wrapped_backend._get(remote_filename, local_path)
+            return None, os.path.getsize(local_path.name)
+        return self.shape(u'get', do_get)
+
+    def read_range(self, remote_filename, offset, length):
+        def do_read_range():
+            buf = self.wrapped_backend._read_range(remote_filename, offset, length)
+            return buf, len(buf)
+        return self.shape(u'read_range', do_read_range)
+
+    def list(self):
+        def do_list():
+            filenames = self.wrapped_backend._list()
+            # a listing takes about as long as sending the names
+            return filenames, sum(len(f) for f in filenames)
+        return self.shape(u'list', do_list)
+
+    def delete(self, filename):
+        return self.shape(u'delete', lambda: (self.wrapped_backend._delete(filename), 0))
+
+    def delete_list(self, filename_list):
+        return self.shape(u'delete', lambda: (self.wrapped_backend._delete_list(filename_list), 0))
+
+    def query(self, filename):
+        return self.shape(u'query', lambda: (self.wrapped_backend._query(filename), 0))
+
+    def query_list(self, filename_list):
+        return self.shape(u'query', lambda: (self.wrapped_backend._query_list(filename_list), 0))
+
+    def retry_cleanup(self):
+        self.wrapped_backend._retry_cleanup()
+
+    def error_code(self, operation, e):
+        return self.wrapped_backend._error_code(operation, e)
+
+    def close(self):
+        self.wrapped_backend._close()
+
+
+duplicity.backend.register_backend_prefix(u'shaped', ShapedBackend)
@@ -0,0 +1,153 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Block sizes of signatures chosen per file, for --adaptive-blocksize
+
+The block size of a signature is the unit the next delta of the file
+can copy from the old file.  Small blocks make small deltas but large
+signatures, and slow down making the delta; large blocks the reverse.
+The block size of a file is chosen from
+
+  its size     about the square root of its length, which balances
+               the signature against the delta of a few changes
+  its type     compressed and encrypted files change all over when
+               they change at all, so they get larger blocks
+  its history  in how many places the file differed from its old
+               version the last time it changed
+
+The history is kept in the archive dir, see History.  Files without
+history, like new files, are judged by size and type only.
+"""
+
+import math
+import os
+import pickle
+
+from duplicity import log
+
+# Block sizes are multiples of min_block_size up to max_block_size
+min_block_size = 512
+max_block_size = 64 * 1024
+
+# Length of a block's weak and strong checksum in a signature
+sig_entry_len = 12
+
+# Most the block size of a file changes by from one backup to the next
+max_step = 4
+
+# Extensions of compressed or encrypted files, and how much larger
+# their blocks are
+compressed_extensions = set([
+    b"7z", b"bz2", b"gpg", b"gz", b"jar", b"jpeg", b"jpg", b"lz4", b"lzma", b"mkv", b"mov",
+    b"mp3", b"mp4", b"ogg", b"pgp", b"png", b"rar", b"tbz", b"tgz", b"txz", b"webm",
+    b"webp", b"xz", b"zip", b"zst",
+])
+compressed_factor = 4
+
+
+def round_block_size(block_size):
+    u"""
+    Return block_size rounded down to a multiple of min_block_size,
+    between min_block_size and max_block_size
+    """
+    block_size = int(block_size) // min_block_size * min_block_size
+    return max(min_block_size, min(block_size, max_block_size))
+
+
+def is_compressed(index):
+    u"""
+    Return true if the file at index has the extension of a compressed file
+    """
+    if not index:
+        return False
+    return os.path.splitext(index[-1])[1][1:].lower() in compressed_extensions
+
+
+def get_block_size(file_len, index=(), previous=None):
+    u"""
+    Return block size for the signature of file index of length file_len
+
+    previous is the (block size, changes) History recorded for the
+    last delta of the file, if any.
+    """
+    if previous:
+        block_len, changes = previous
+        if changes:
+            # Besides the changed data itself the delta sends about a
+            # block around each change, so if the file changes in as
+            # many places again, blocks of size b cost changes * b of
+            # delta and file_len / b * sig_entry_len of signature, which
+            # is least for this b.
+            block_size = math.sqrt(sig_entry_len * file_len / float(changes))
+        else:
+            block_size = block_len * max_step
+        block_size = max(block_len / max_step, min(block_size, block_len * max_step))
+    else:
+        block_size = math.sqrt(file_len)
+        if is_compressed(index):
+            block_size *= compressed_factor
+    return round_block_size(block_size)
+
+
+class History:
+    u"""
+    How well the block size of changed files worked the last time
+
+    Maps the index of each file that has had a delta to a tuple of the
+    block size of the signature the delta was made with and the number
+    of places the delta changed, see librsync.DeltaStats.  Entries are
+    replaced when files change again and dropped when they are deleted,
+    so unchanged files keep theirs.  If filename is given the history is
+    read from and saved to it as a pickle.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        if filename and os.path.exists(filename):
+            try:
+                with open(filename, u"rb") as fp:
+                    self.entries = pickle.load(fp)
+            except Exception as e:
+                log.Warn(_(u"Cannot read block size history %s: %s") % (filename, e))
+
+    def get(self, index):
+        u"""Return (block size, changes) of index or None"""
+        return self.entries.get(index)
+
+    def record(self, index, block_len, changes):
+        u"""Remember the delta of index"""
+        self.entries[index] = (block_len, changes)
+
+    def forget(self, index):
+        u"""Drop the entry of a deleted file"""
+        self.entries.pop(index, None)
+
+    def save(self):
+        u"""
+        Write the history to filename, replacing the old one in one go
+        """
+        if not self.filename:
+            return
+        tmpname = b"%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            with open(tmpname, u"wb") as fp:
+                pickle.dump(self.entries, fp, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError) as e:
+            log.Warn(_(u"Cannot write block size history %s: %s") % (self.filename, e))
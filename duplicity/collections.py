@@ -52,9 +52,12 @@ class BackupSet:
     """
     Backup set - the backup information produced by one session
     """
-    def __init__(self, backend, action):
+    def __init__(self, backend, action, local_manifests=None):
         """
         Initialize new backup set, only backend is required at first
+
+        local_manifests is what get_local_manifests() returns, so sets
+        of one collection need not list the archive dir each.
         """
         self.backend = backend
         self.info_set = False  # true if fields are set
@@ -66,8 +69,9 @@ class BackupSet:
         self.end_time = None  # will be set if inc
         self.partial = False  # true if a partial backup
         self.encrypted = False  # true if an encrypted backup
-        self.files_changed = []
         self.action = action
+        self.local_manifests = local_manifests
+        self.loaded_manifest = None  # memoized by get_manifest()
 
     def is_complete(self):
         """
@@ -131,49 +135,56 @@ class BackupSet:
         self.encrypted = bool(pr.encrypted)
         self.info_set = True
 
-    def set_files_changed(self):
-        mf = self.get_manifest()
-        self.files_changed = mf.get_files_changed()
-
     def set_manifest(self, remote_filename):
         """
         Add local and remote manifest filenames to backup set
+
+        The manifest is not read here, see get_manifest().
         """
         assert not self.remote_manifest_name, (self.remote_manifest_name,
                                                remote_filename)
         self.remote_manifest_name = remote_filename
 
-        if self.action not in ["collection-status", "replicate"]:
-            local_filename_list = globals.archive_dir_path.listdir()
-        else:
-            local_filename_list = []
-        for local_filename in local_filename_list:
-            pr = file_naming.parse(local_filename)
-            if (pr and pr.manifest and pr.type == self.type and
-                    pr.time == self.time and
-                    pr.start_time == self.start_time and
-                    pr.end_time == self.end_time):
-                self.local_manifest_path = \
-                    globals.archive_dir_path.append(local_filename)
-
-                self.set_files_changed()
-                break
+        if self.local_manifests is None:
+            self.local_manifests = get_local_manifests(self.action)
+        local_filename = self.local_manifests.get((self.type, self.time,
+                                                   self.start_time,
+                                                   self.end_time))
+        if local_filename:
+            self.local_manifest_path = \
+                globals.archive_dir_path.append(local_filename)
 
     def delete(self):
         """
         Remove all files in set, both local and remote
         """
-        rfn = self.get_filenames()
-        rfn.reverse()
+        rfn = self.get_delete_filenames()
         try:
             self.backend.delete(rfn)
         except Exception:
             log.Debug(_("BackupSet.delete: missing %s") % [util.fsdecode(f) for f in rfn])
             pass
-        if self.action not in ["collection-status", "replicate"]:
+        self.delete_local()
+        util.release_lockfile()
+
+    def get_delete_filenames(self):
+        """
+        Return remote filenames of set, in the order they are deleted
+        """
+        rfn = self.get_filenames()
+        rfn.reverse()
+        return rfn
+
+    def delete_local(self, local_filename_list=None):
+        """
+        Remove the files of set in the archive dir
+
+        local_filename_list is the listing of the archive dir, if known.
+        """
+        if self.action in ["collection-status", "replicate"]:
+            return
+        if local_filename_list is None:
             local_filename_list = globals.archive_dir_path.listdir()
-        else:
-            local_filename_list = []
         for lfn in local_filename_list:
             pr = file_naming.parse(lfn)
             if (pr and pr.time == self.time and
@@ -184,7 +195,6 @@ class BackupSet:
                 except Exception:
                     log.Debug(_("BackupSet.delete: missing %s") % [util.fsdecode(f) for f in lfn])
                     pass
-        util.release_lockfile()
 
     def __unicode__(self):
         """
@@ -257,11 +267,20 @@ class BackupSet:
     def get_manifest(self):
         """
         Return manifest object, showing preference for local copy
+
+        The manifest is only read once per set.  A local one is taken
+        from the manifest summary cache if it is there.
         """
-        if self.local_manifest_path:
-            return self.get_local_manifest()
-        else:
-            return self.get_remote_manifest()
+        if not self.loaded_manifest:
+            if self.local_manifest_path:
+                cache = manifest.get_summary_cache()
+                self.loaded_manifest = cache.get(self.local_manifest_path)
+                if not self.loaded_manifest:
+                    self.loaded_manifest = self.get_local_manifest()
+                    cache.put(self.local_manifest_path, self.loaded_manifest)
+            else:
+                self.loaded_manifest = self.get_remote_manifest()
+        return self.loaded_manifest
 
     def get_filenames(self):
         """
@@ -292,7 +311,12 @@ class BackupSet:
         assert 0, "Neither self.time nor self.end_time set"
 
     def get_files_changed(self):
-        return self.files_changed
+        """
+        Return files changed in set, as listed in the local manifest
+        """
+        if not self.local_manifest_path:
+            return []
+        return self.get_manifest().get_files_changed()
 
     def __len__(self):
         """
@@ -311,6 +335,26 @@ class BackupSet:
             len(self) == len(other)
 
 
+def get_local_manifests(action):
+    """
+    Return dict of local manifest filenames
+
+    Keys are (type, time, start_time, end_time) of their backup set.
+    As in the rest of the collection, the archive dir is not looked
+    at for the collection-status and replicate actions.
+    """
+    local_manifests = {}
+    if action in ["collection-status", "replicate"]:
+        return local_manifests
+    for local_filename in globals.archive_dir_path.listdir():
+        pr = file_naming.parse(local_filename)
+        if pr and pr.manifest and pr.type in ["full", "inc"]:
+            key = (pr.type, pr.time, pr.start_time, pr.end_time)
+            if key not in local_manifests or not pr.partial:
+                local_manifests[key] = local_filename
+    return local_manifests
+
+
 class BackupChain:
     """
     BackupChain - a number of linked BackupSets
@@ -369,6 +413,32 @@ class BackupChain:
         if self.fullset and not keep_full:
             self.fullset.delete()
 
+    def get_delete_sets(self, keep_full=False):
+        """
+        Return sets delete() removes, in its order
+        """
+        sets = self.incset_list[::-1]
+        if self.fullset and not keep_full:
+            sets.append(self.fullset)
+        return sets
+
+    def get_delete_filenames(self, keep_full=False):
+        """
+        Return remote filenames delete() removes, in its order
+        """
+        filenames = []
+        for s in self.get_delete_sets(keep_full):
+            filenames.extend(s.get_delete_filenames())
+        return filenames
+
+    def delete_local(self, keep_full=False):
+        """
+        Remove the local files of the sets delete() removes
+        """
+        local_filename_list = globals.archive_dir_path.listdir()
+        for s in self.get_delete_sets(keep_full):
+            s.delete_local(local_filename_list)
+
     def get_sets_at_time(self, time):
         """
         Return a list of sets in chain earlier or equal to time
@@ -463,6 +533,54 @@ class BackupChain:
             return self.incset_list
 
 
+class SigPartsFile:
+    """
+    Read the parts of a split signature one after the other as one file
+
+    A part is only opened, and so fetched from the backend, once
+    reading gets to it.
+    """
+    def __init__(self, filenames, filename_to_fileobj):
+        self.filenames = filenames[:]
+        self.filename_to_fileobj = filename_to_fileobj
+        self.fileobj = None  # fileobj of the part being read
+        self.byte_count = 0
+        self.name = filenames[0]
+
+    def read(self, length=-1):
+        buflist = []
+        while length:
+            if not self.fileobj:
+                if not self.filenames:
+                    break
+                self.fileobj = self.filename_to_fileobj(self.filenames.pop(0))
+            buf = self.fileobj.read(length)
+            if not buf:
+                self.fileobj.close()
+                self.fileobj = None
+                continue
+            buflist.append(buf)
+            if length > 0:
+                length -= len(buf)
+        buf = "".join(buflist)
+        self.byte_count += len(buf)
+        return buf
+
+    def tell(self):
+        return self.byte_count
+
+    def seek(self, offset):
+        assert offset >= self.byte_count, "%d < %d" % (offset, self.byte_count)
+        if offset > self.byte_count:
+            self.read(offset - self.byte_count)
+
+    def close(self):
+        if self.fileobj:
+            self.fileobj.close()
+            self.fileobj = None
+        self.filenames = []
+
+
 class SignatureChain:
     """
     A number of linked SignatureSets
@@ -490,6 +608,8 @@ class SignatureChain:
             self.archive_dir_path, self.backend = None, location
         self.fullsig = None  # filename of full signature
         self.inclist = []  # list of filenames of incremental signatures
+        self.parts = {}  # signature filename -> dict part number -> filename
+        self.sigindexes = {}  # signature filename -> filename of part index
         self.start_time, self.end_time = None, None
 
     def __str__(self):
@@ -532,6 +652,9 @@ class SignatureChain:
         if not pr:
             return None
 
+        if pr.type in ["full-sig", "new-sig"] and (pr.volume_number or pr.manifest):
+            return self.add_part(filename, pr)
+
         if self.fullsig:
             if pr.type != "new-sig":
                 return None
@@ -549,10 +672,31 @@ class SignatureChain:
             self.start_time, self.end_time = pr.time, pr.time
             return 1
 
-    def get_fileobjs(self, time=None):
+    def add_part(self, filename, pr):
+        """
+        Add later part or part index of a split signature in the chain
+        """
+        for sig in self.get_sig_filenames():
+            sig_pr = file_naming.parse(sig)
+            if (pr.type != sig_pr.type or pr.time != sig_pr.time or
+                    pr.start_time != sig_pr.start_time or
+                    pr.end_time != sig_pr.end_time):
+                continue
+            if pr.manifest:
+                self.sigindexes[sig] = filename
+            else:
+                self.parts.setdefault(sig, {})[pr.volume_number] = filename
+            return 1
+        return None
+
+    def get_fileobjs(self, time=None, index=()):
         """
         Return ordered list of signature fileobjs opened for reading,
         optionally at a certain time
+
+        A split signature is read through all of its parts in turn,
+        or, if index is given and the part index is there, through
+        just the parts which may hold entries under index.
         """
         assert self.fullsig
         if self.archive_dir_path:  # local
@@ -562,29 +706,69 @@ class SignatureChain:
                 return sig_dp.filtered_open("rb")
         else:
             filename_to_fileobj = self.backend.get_fileobj_read
-        return [filename_to_fileobj(f) for f in self.get_filenames(time)]
+
+        def sig_to_fileobj(sig):
+            """Return fileobj reading all needed parts of sig"""
+            parts = self.parts.get(sig)
+            if not parts:
+                return filename_to_fileobj(sig)
+            part_dict = parts.copy()
+            part_dict[1] = sig
+            part_nums = sorted(part_dict.keys())
+            last = part_nums[-1]
+            if index and sig in self.sigindexes:
+                fileobj = filename_to_fileobj(self.sigindexes[sig])
+                sigindex = manifest.SigIndex().from_string(fileobj.read())
+                fileobj.close()
+                part_nums = sigindex.get_parts(index)
+                last = max([last] + sigindex.part_dict.keys())
+            # joined with a gap, the parts would make a corrupt sigtar
+            missing = [n for n in range(1, last + 1) if n not in part_dict]
+            if missing:
+                raise CollectionsError("Signature %s is missing part(s) %s" %
+                                       (sig, ", ".join(map(str, missing))))
+            return SigPartsFile([part_dict[n] for n in part_nums],
+                                filename_to_fileobj)
+
+        return [sig_to_fileobj(f) for f in self.get_sig_filenames(time)]
 
     def delete(self, keep_full=False):
         """
         Remove all files in signature set
         """
-        # Try to delete in opposite order, so something useful even if aborted
+        filelist = self.get_delete_filenames(keep_full)
         if self.archive_dir_path:
-            for i in range(len(self.inclist) - 1, -1, -1):
-                self.archive_dir_path.append(self.inclist[i]).delete()
-            if not keep_full:
-                self.archive_dir_path.append(self.fullsig).delete()
+            for filename in filelist:
+                self.archive_dir_path.append(filename).delete()
         else:
             assert self.backend
-            inclist_copy = self.inclist[:]
-            inclist_copy.reverse()
-            if not keep_full:
-                inclist_copy.append(self.fullsig)
-            self.backend.delete(inclist_copy)
+            self.backend.delete(filelist)
 
-    def get_filenames(self, time=None):
+    def get_delete_filenames(self, keep_full=False):
         """
-        Return ordered list of filenames in set, up to a provided time
+        Return filenames delete() removes, in its order
+        """
+        # Try to delete in opposite order, so something useful even if aborted
+        filelist = self.get_filenames()
+        if keep_full:
+            filelist = filelist[len(self.get_sig_part_filenames(self.fullsig)):]
+        filelist.reverse()
+        return filelist
+
+    def delete_local(self, keep_full=False):
+        """
+        Remove the files of chain, if it is in the archive dir
+        """
+        if self.archive_dir_path:
+            for filename in self.get_delete_filenames(keep_full):
+                self.archive_dir_path.append(filename).delete()
+
+    def get_sig_filenames(self, time=None):
+        """
+        Return ordered list of signatures in set, up to a provided time
+
+        Signatures are named by their first part, see get_filenames()
+        for all the files.
         """
         if self.fullsig:
             l = [self.fullsig]
@@ -599,6 +783,25 @@ class SignatureChain:
         l.extend(inclist)
         return l
 
+    def get_sig_part_filenames(self, sig):
+        """
+        Return filenames of all parts of signature sig, then its index
+        """
+        parts = self.parts.get(sig, {})
+        l = [sig] + [parts[n] for n in sorted(parts.keys())]
+        if sig in self.sigindexes:
+            l.append(self.sigindexes[sig])
+        return l
+
+    def get_filenames(self, time=None):
+        """
+        Return ordered list of filenames in set, up to a provided time
+        """
+        l = []
+        for sig in self.get_sig_filenames(time):
+            l.extend(self.get_sig_part_filenames(sig))
+        return l
+
 
 class CollectionsStatus:
     """
@@ -841,6 +1044,7 @@ class CollectionsStatus:
                   % [util.fsdecode(f) for f in filename_list])
         # First put filenames in set form
         sets = []
+        local_manifests = get_local_manifests(self.action)
 
         def add_to_sets(filename):
             """
@@ -852,7 +1056,7 @@ class CollectionsStatus:
                     break
             else:
                 log.Debug(_("File %s is not part of a known set; creating new set") % (util.fsdecode(filename),))
-                new_set = BackupSet(self.backend, self.action)
+                new_set = BackupSet(self.backend, self.action, local_manifests)
                 if new_set.add_filename(filename):
                     sets.append(new_set)
                 else:
@@ -931,11 +1135,15 @@ class CollectionsStatus:
                 return SignatureChain(False, self.backend)
 
         # Build initial chains from full sig filenames
-        chains, new_sig_filenames = [], []
+        chains, new_sig_filenames, part_filenames = [], [], []
         for filename in get_filelist():
             pr = file_naming.parse(filename)
             if pr:
-                if pr.type == "full-sig":
+                if pr.type not in ["full-sig", "new-sig"]:
+                    continue
+                elif pr.volume_number or pr.manifest:
+                    part_filenames.append(filename)
+                elif pr.type == "full-sig":
                     new_chain = get_new_sigchain()
                     assert new_chain.add_filename(filename, pr)
                     chains.append(new_chain)
@@ -955,6 +1163,14 @@ class CollectionsStatus:
                     break
             else:
                 orphaned_filenames.append(sig_filename)
+
+        # Parts of split signatures go with their first part
+        for part_filename in part_filenames:
+            for chain in chains:
+                if chain.add_filename(part_filename):
+                    break
+            else:
+                orphaned_filenames.append(part_filename)
         return (chains, orphaned_filenames)
 
     def get_sorted_chains(self, chain_list):
@@ -37,7 +37,9 @@ try:
 except ImportError:
     from md5 import new as md5
 
+from duplicity import aead
 from duplicity import backend
+from duplicity import compression
 from duplicity import dup_time
 from duplicity import globals
 from duplicity import gpg
@@ -272,10 +274,28 @@ def parse_cmdline_options(arglist):
 
     parser = OPHelpFix(option_class=DupOption, usage=usage())
 
+    # Choose block sizes from the size, type and last delta of each file
+    parser.add_option("--adaptive-blocksize", action="store_true")
+
+    # Encrypt with a passphrase in-process instead of using gpg
+    parser.add_option("--aead-encryption", action="store_true")
+
+    # Cipher used by --aead-encryption
+    parser.add_option("--aead-cipher", type="choice", metavar=_("cipher"),
+                      choices=sorted(aead.ciphers.keys()))
+
+    # Chunks encrypted at once by --aead-encryption, 0 for one per CPU
+    parser.add_option("--aead-threads", type="int", metavar=_("number"))
+
     # If this is true, only warn and don't raise fatal error when backup
     # source directory doesn't match previous backup source directory.
     parser.add_option("--allow-source-mismatch", action="store_true")
 
+    # Read only the appended data of files that grew, checked by "sample"
+    # blocks or just by their "size"
+    parser.add_option("--append-only-check", type="choice", metavar=_("method"),
+                      choices=["sample", "size"])
+
     # Set to the path of the archive directory (the directory which
     # contains the signatures and manifests of the relevent backup
     # collection), and for checkpoint state between volumes.
@@ -290,6 +310,16 @@ def parse_cmdline_options(arglist):
 
     parser.add_option("--compare-data", action="store_true")
 
+    # Codec used for compressing files that are not encrypted
+    parser.add_option("--compression-codec", type="choice", metavar=_("codec"),
+                      choices=compression.get_names())
+
+    # Compression level, meaning depends on the codec
+    parser.add_option("--compression-level", type="int", metavar=_("number"))
+
+    # Threads used by codecs that can compress in parallel
+    parser.add_option("--compression-threads", type="int", metavar=_("number"))
+
     # config dir for future use
     parser.add_option("--config-dir", type="file", metavar=_("path"),
                       help=optparse.SUPPRESS_HELP)
@@ -302,6 +332,16 @@ def parse_cmdline_options(arglist):
     parser.add_option("--current-time", type="int",
                       dest="current_time", help=optparse.SUPPRESS_HELP)
 
+    # Number of files, or batches of files, deleted at once
+    parser.add_option("--delete-concurrency", type="int", metavar=_("number"))
+
+    # Number of byte ranges of a file downloaded at once
+    parser.add_option("--download-concurrency", type="int", metavar=_("number"))
+
+    # Size of the byte ranges files are downloaded in, in MB
+    parser.add_option("--download-chunk-size", type="int", action="callback", metavar=_("number"),
+                      callback=lambda o, s, v, p: setattr(p.values, "download_chunk_size", v * 1024 * 1024))
+
     # Don't actually do anything, but still report what would be done
     parser.add_option("--dry-run", action="store_true")
 
@@ -501,6 +541,9 @@ def parse_cmdline_options(arglist):
     # Verbatim par2 options
     parser.add_option("--par2-options", action="extend", metavar=_("options"))
 
+    # Compute recovery files in-process instead of with par2
+    parser.add_option("--par2-native", action="store_true")
+
     # Used to display the progress for the full and incremental backup operations
     parser.add_option("--progress", action="store_true")
 
@@ -521,6 +564,12 @@ def parse_cmdline_options(arglist):
     # duplicity remove-older-than time [options] target_url
     parser.add_option("--restore-time", "--time", "-t", type="time", metavar=_("time"))
 
+    # Number of files replicate copies at once
+    parser.add_option("--replicate-concurrency", type="int", metavar=_("number"))
+
+    # Copy files as they are when replicating
+    parser.add_option("--replicate-raw", action="store_true")
+
     # user added rsync options
     parser.add_option("--rsync-options", action="extend", metavar=_("options"))
 
@@ -560,6 +609,9 @@ def parse_cmdline_options(arglist):
     # to prevent hangups when doing a multipart upload to S3.
     parser.add_option("--s3-multipart-max-timeout", type="int", metavar=_("number"))
 
+    # Upload the parts of multipart uploads to S3 with threads instead of processes
+    parser.add_option("--s3-multipart-threads", action="store_true")
+
     # Option to allow the s3/boto backend use the multiprocessing version.
     parser.add_option("--s3-use-multiprocessing", action="store_true")
 
@@ -599,6 +651,10 @@ def parse_cmdline_options(arglist):
                       callback=lambda o, s, v, p: (setattr(p.values, o.dest, True),
                                                    old_fn_deprecation(s)))
 
+    # signature part size, 0 to not split signatures
+    parser.add_option("--sig-part-size", type="int", action="callback", metavar=_("number"),
+                      callback=lambda o, s, v, p: setattr(p.values, "sig_part_size", v * 1024 * 1024))
+
     # TRANSL: Used in usage help to represent an ID for a GnuPG key. Example:
     # --encrypt-key <gpg_key_id>
     parser.add_option("--sign-key", type="string", metavar=_("gpg-key-id"),
@@ -616,6 +672,15 @@ def parse_cmdline_options(arglist):
     parser.add_option("--ssl-cacert-path", metavar=_("path to a folder with certificate authority files"))
     parser.add_option("--ssl-no-check-certificate", action="store_true")
 
+    # write the time spent in each stage of the run to a JSON file
+    parser.add_option("--stage-times", type="file", metavar=_("filename"))
+
+    # rewrite the --stage-times file every so many seconds
+    parser.add_option("--stage-times-interval", type="int", metavar=_("seconds"))
+
+    # number of files fetched at once when syncing the archive dir
+    parser.add_option("--sync-concurrency", type="int", metavar=_("number"))
+
     # Working directory for the tempfile module. Defaults to /tmp on most systems.
     parser.add_option("--tempdir", dest="temproot", type="file", metavar=_("path"))
 
@@ -648,6 +713,10 @@ def parse_cmdline_options(arglist):
     parser.add_option("--volsize", type="int", action="callback", metavar=_("number"),
                       callback=lambda o, s, v, p: setattr(p.values, "volsize", v * 1024 * 1024))
 
+    # Hash recorded in the manifest for each volume
+    parser.add_option("--volume-hash", type="choice", metavar=_("hash"),
+                      choices=[h for h in gpg.hash_names if h != "MD5"])
+
     # If set, collect only the file status, not the whole root.
     parser.add_option("--file-changed", action="callback", type="file",
                       metavar=_("path"), dest="file_changed",
@@ -658,6 +727,11 @@ def parse_cmdline_options(arglist):
     # --backend-retry-delay <seconds>
     parser.add_option("--backend-retry-delay", type="int", metavar=_("seconds"))
 
+    # longest delay before the next try, the delay doubles with each failure
+    # TRANSL: Used in usage help. Example:
+    # --backend-retry-max-delay <seconds>
+    parser.add_option("--backend-retry-max-delay", type="int", metavar=_("seconds"))
+
     # parse the options
     (options, args) = parser.parse_args(arglist)
 
@@ -674,6 +748,27 @@ def parse_cmdline_options(arglist):
 
     socket.setdefaulttimeout(globals.timeout)
 
+    # fail now rather than after the first volume if the codec is missing
+    try:
+        compression.get_codec().check_available()
+    except compression.CompressionError as e:
+        command_line_error(util.uexc(e))
+
+    try:
+        gpg.get_hash_obj(globals.volume_hash)
+    except gpg.GPGError as e:
+        command_line_error(util.uexc(e))
+
+    if globals.aead_encryption and globals.encryption:
+        if (globals.gpg_profile.recipients or globals.gpg_profile.hidden_recipients or
+                globals.gpg_profile.sign_key):
+            command_line_error(_("--aead-encryption only supports symmetric encryption, "
+                                 "it cannot be used with encryption or signing keys"))
+        try:
+            aead.check_available()
+        except aead.AEADError as e:
+            command_line_error(util.uexc(e))
+
     # expect no cmd and two positional args
     cmd = ""
     num_expect = 2
@@ -0,0 +1,396 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2002 Ben Escoto <ben@emerose.org>
+# Copyright 2007 Kenneth Loafman <kenneth@loafman.com>
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Compression codecs for unencrypted volumes, signatures and manifests
+
+Each codec is identified by a name and by the filename suffix it adds
+(see file_naming), so a file can always be decompressed with the codec
+that wrote it, whatever --compression-codec is set to now.  gzip is
+always available; zstd and lz4 need the python-zstandard and lz4
+modules and are only imported when first used.
+"""
+
+import gzip
+import zlib
+
+from duplicity import globals
+from duplicity import stagetimes
+
+blocksize = 128 * 1024
+
+
+class CompressionError(Exception):
+    u"""
+    Indicate an unknown or unavailable codec
+    """
+    pass
+
+
+class Codec:
+    u"""
+    Base class of all codecs
+
+    Subclasses set name, suffix and short_suffix and implement
+    open_reader() and open_writer(), which wrap an already opened
+    file object.
+    """
+    name = None
+    suffix = None  # suffix used with long filenames
+    short_suffix = None  # suffix used with --short-filenames
+    default_level = None
+
+    def check_available(self):
+        u"""
+        Raise CompressionError if the codec cannot be used here
+        """
+        pass
+
+    def get_level(self):
+        u"""
+        Return compression level from globals or the codec default
+        """
+        if globals.compression_level is None:
+            return self.default_level
+        return globals.compression_level
+
+    def open(self, filename, mode=u"rb"):
+        u"""
+        Return fileobj that (de)compresses filename on the fly
+        """
+        assert mode in (u"rb", u"wb", u"ab"), mode
+        fileobj = open(filename, mode)
+        if mode == u"rb":
+            return self.open_reader(fileobj, closefd=True)
+        else:
+            return self.open_writer(fileobj, closefd=True)
+
+    def open_reader(self, fileobj, closefd=False):
+        raise NotImplementedError()
+
+    def open_writer(self, fileobj, closefd=False):
+        raise NotImplementedError()
+
+
+class GzipCodec(Codec):
+    u"""
+    gzip, duplicity's traditional compression
+    """
+    name = u"gzip"
+    suffix = b".gz"
+    short_suffix = b".z"
+    default_level = 6
+
+    def open(self, filename, mode=u"rb"):
+        if mode == u"rb":
+            return gzip.GzipFile(filename, mode)
+        return gzip.GzipFile(filename, mode, self.get_level())
+
+    def open_reader(self, fileobj, closefd=False):
+        # GzipFile wants to seek in its input, which may be a stream here
+        return _StreamReader(fileobj, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                             closefd)
+
+    def open_writer(self, fileobj, closefd=False):
+        return _CloseFileobj(gzip.GzipFile(None, u"wb", self.get_level(), fileobj),
+                             fileobj, closefd)
+
+
+class ZstdCodec(Codec):
+    u"""
+    Zstandard, optionally compressing on several threads
+    """
+    name = u"zstd"
+    suffix = b".zst"
+    short_suffix = b".zs"
+    default_level = 3
+
+    def get_module(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise CompressionError(_(u"The zstd codec requires the python-zstandard module"))
+        return zstandard
+
+    def check_available(self):
+        self.get_module()
+
+    def open_reader(self, fileobj, closefd=False):
+        dctx = self.get_module().ZstdDecompressor()
+        return _StreamReader(fileobj, dctx.decompressobj, closefd)
+
+    def open_writer(self, fileobj, closefd=False):
+        zstandard = self.get_module()
+        cctx = zstandard.ZstdCompressor(level=self.get_level(),
+                                        threads=globals.compression_threads)
+        return _StreamWriter(fileobj, cctx.compressobj(), closefd)
+
+
+class Lz4Codec(Codec):
+    u"""
+    LZ4 frame format, very fast with a lower ratio
+    """
+    name = u"lz4"
+    suffix = b".lz4"
+    short_suffix = b".l4"
+    default_level = 0
+
+    def get_module(self):
+        try:
+            import lz4.frame
+        except ImportError:
+            raise CompressionError(_(u"The lz4 codec requires the lz4 module"))
+        return lz4.frame
+
+    def check_available(self):
+        self.get_module()
+
+    def open_reader(self, fileobj, closefd=False):
+        return _CloseFileobj(self.get_module().LZ4FrameFile(fileobj, u"rb"),
+                             fileobj, closefd)
+
+    def open_writer(self, fileobj, closefd=False):
+        lz4frame = self.get_module()
+        return _CloseFileobj(lz4frame.LZ4FrameFile(fileobj, u"wb",
+                                                   compression_level=self.get_level()),
+                             fileobj, closefd)
+
+
+class _CloseFileobj:
+    u"""
+    Delegate to a codec file object, closing the underlying file too
+    """
+    def __init__(self, codecobj, fileobj, closefd):
+        self.codecobj = codecobj
+        self.fileobj = fileobj
+        self.closefd = closefd
+        self.name = getattr(fileobj, u"name", None)
+
+    def read(self, length=-1):
+        with stagetimes.stage(u"compression") as st:
+            buf = self.codecobj.read(length)
+            st.add(len(buf))
+        return buf
+
+    def write(self, buf):
+        with stagetimes.stage(u"compression") as st:
+            st.add(len(buf))
+            return self.codecobj.write(buf)
+
+    def tell(self):
+        return self.codecobj.tell()
+
+    def seek(self, offset):
+        return self.codecobj.seek(offset)
+
+    def flush(self):
+        self.codecobj.flush()
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        self.codecobj.close()
+        if self.closefd:
+            return self.fileobj.close()
+
+
+class _StreamWriter:
+    u"""
+    File-like writer feeding a compressobj, for codecs that lack one
+    """
+    def __init__(self, fileobj, compressobj, closefd):
+        self.fileobj = fileobj
+        self.compressobj = compressobj
+        self.closefd = closefd
+        self.name = getattr(fileobj, u"name", None)
+        self.byte_count = 0
+
+    def write(self, buf):
+        self.byte_count += len(buf)
+        with stagetimes.stage(u"compression") as st:
+            data = self.compressobj.compress(buf)
+            st.add(len(buf))
+        if data:
+            self.fileobj.write(data)
+
+    def tell(self):
+        return self.byte_count
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        with stagetimes.stage(u"compression"):
+            data = self.compressobj.flush()
+        self.fileobj.write(data)
+        if self.closefd:
+            return self.fileobj.close()
+
+
+def _stream_ended(decompressobj):
+    u"""
+    Return true if decompressobj has reached the end of its stream
+
+    Only called once the input is used up, as it may spoil decompressobj.
+    """
+    if hasattr(decompressobj, u"eof"):
+        return decompressobj.eof
+    if hasattr(decompressobj, u"copy"):
+        # zlib of python 2 has no eof, but past the end input is left unused
+        probe = decompressobj.copy()
+        try:
+            probe.decompress(b"\0")
+        except zlib.error:
+            return False
+        return bool(probe.unused_data)
+    # python-zstandard before 0.15 refuses input once its frame has ended
+    try:
+        decompressobj.decompress(b"")
+    except Exception:
+        return True
+    return False
+
+
+class _StreamReader:
+    u"""
+    File-like reader draining a decompressobj, for codecs that lack one
+
+    new_decompressobj is called for the first stream and for every
+    further one concatenated to it, like the members of a gzip file.
+    Decompressobjs without unused_data, like those of python-zstandard
+    before 0.15, cannot tell where their stream ended, so only the first
+    stream is read.
+    """
+    def __init__(self, fileobj, new_decompressobj, closefd):
+        self.fileobj = fileobj
+        self.new_decompressobj = new_decompressobj
+        self.decompressobj = new_decompressobj()
+        self.closefd = closefd
+        self.name = getattr(fileobj, u"name", None)
+        self.buffer = b""
+        self.offset = 0  # position of unreturned data in self.buffer
+        self.byte_count = 0
+        self.eof = False
+
+    def decompress_more(self):
+        u"""
+        Return more decompressed data, setting self.eof when done
+
+        Raises EOFError if the input ends inside a stream, as it does
+        when the file was truncated.
+        """
+        data = self.fileobj.read(blocksize)
+        if not data:
+            self.eof = True
+            if not _stream_ended(self.decompressobj):
+                raise EOFError(u"Compressed file %s ended before the end-of-stream marker was reached" %
+                               (self.name,))
+            return b""
+        with stagetimes.stage(u"compression") as st:
+            result = self.decompressobj.decompress(data)
+            unused = getattr(self.decompressobj, u"unused_data", b"")
+            # like gzip, ignore zeros padding the end of the file
+            while unused and unused.lstrip(b"\0"):
+                self.decompressobj = self.new_decompressobj()
+                result += self.decompressobj.decompress(unused)
+                unused = getattr(self.decompressobj, u"unused_data", b"")
+            st.add(len(result))
+        return result
+
+    def read(self, length=-1):
+        if length < 0:
+            bufs = [self.buffer[self.offset:]]
+            while not self.eof:
+                bufs.append(self.decompress_more())
+            result = b"".join(bufs)
+            self.buffer, self.offset = b"", 0
+        else:
+            while not self.eof and len(self.buffer) - self.offset < length:
+                self.buffer = self.buffer[self.offset:] + self.decompress_more()
+                self.offset = 0
+            result = self.buffer[self.offset:self.offset + length]
+            self.offset += len(result)
+        self.byte_count += len(result)
+        return result
+
+    def tell(self):
+        return self.byte_count
+
+    def seek(self, offset):
+        assert offset >= self.byte_count, u"%d < %d" % (offset, self.byte_count)
+        while offset > self.byte_count:
+            if not self.read(min(offset - self.byte_count, blocksize)):
+                break
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        if self.closefd:
+            return self.fileobj.close()
+
+
+codecs = [GzipCodec(), ZstdCodec(), Lz4Codec()]
+
+
+def get_names():
+    u"""
+    Return names of all known codecs
+    """
+    return [codec.name for codec in codecs]
+
+
+def get_codec(name=None):
+    u"""
+    Return codec called name, or the configured codec if name is None
+    """
+    if name is None:
+        name = globals.compression_codec
+    for codec in codecs:
+        if codec.name == name:
+            return codec
+    raise CompressionError(_(u"Unknown compression codec %s") % (name,))
+
+
+def get_suffixes():
+    u"""
+    Return all filename suffixes any codec may use
+    """
+    suffixes = []
+    for codec in codecs:
+        suffixes.extend([codec.suffix, codec.short_suffix])
+    return suffixes
+
+
+def codec_from_filename(filename, short_filenames=False):
+    u"""
+    Return codec whose suffix filename ends with, or None
+    """
+    for codec in codecs:
+        if (filename.endswith(codec.short_suffix) or
+                not short_filenames and filename.endswith(codec.suffix)):
+            return codec
+    return None
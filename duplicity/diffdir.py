@@ -32,17 +32,29 @@ from future_builtins import map
 import cStringIO
 import types
 import math
+from duplicity import blocksize
 from duplicity import statistics
 from duplicity import util
 from duplicity import globals
 from duplicity.path import *  # @UnusedWildImport
 from duplicity.lazy import *  # @UnusedWildImport
 from duplicity import progress
+from duplicity import stagetimes
 
 # A StatsObj will be written to this from DirDelta and DirDelta_WriteSig.
 stats = None
 tracker = None
 
+# A blocksize.History of the deltas, set by DirDelta_WriteSig when
+# --adaptive-blocksize is given
+history = None
+
+# Size of the data blocks large files are split into, see get_read_size()
+read_size = 64 * 1024
+
+# Most blocks compared by --append-only-check sample
+append_check_blocks = 16
+
 
 class DiffDirException(Exception):
     pass
@@ -67,11 +79,12 @@ def DirFull(path_iter):
     return DirDelta(path_iter, cStringIO.StringIO(""))
 
 
-def DirFull_WriteSig(path_iter, sig_outfp):
+def DirFull_WriteSig(path_iter, sig_outfp, restart=None):
     """
     Return full backup like above, but also write signature to sig_outfp
     """
-    return DirDelta_WriteSig(path_iter, cStringIO.StringIO(""), sig_outfp)
+    return DirDelta_WriteSig(path_iter, cStringIO.StringIO(""), sig_outfp,
+                             restart)
 
 
 def DirDelta(path_iter, dirsig_fileobj_list):
@@ -83,6 +96,7 @@ def DirDelta(path_iter, dirsig_fileobj_list):
     """
     global stats
     stats = statistics.StatsDeltaProcess()
+    path_iter = stagetimes.timed_iter("select", path_iter)
     if isinstance(dirsig_fileobj_list, list):
         sig_iter = combine_path_iters([sigtar2path_iter(x) for x
                                        in dirsig_fileobj_list])
@@ -132,11 +146,42 @@ def get_delta_path(new_path, sig_path, sigTarFile=None):
     if new_path.isreg() and sig_path and sig_path.isreg() and sig_path.difftype == "signature":
         delta_path.difftype = "diff"
         old_sigfp = sig_path.open("rb")
-        newfp = FileWithReadCounter(new_path.open("rb"))
-        if sigTarFile:
-            newfp = FileWithSignature(newfp, callback,
-                                      new_path.getsize())
-        delta_path.setfileobj(librsync.DeltaFile(old_sigfp, newfp))
+        append = None
+        if globals.append_only_check or history:
+            sig_string = old_sigfp.read()
+            assert not old_sigfp.close()
+            old_sigfp = sig_string
+        if globals.append_only_check:
+            append = get_append_prefix(new_path, sig_string)
+        if append:
+            # only read what was appended, copy the rest from the old file
+            prefix_len, block_len, prefix_sig = append
+            log.Debug(_("Only reading %s after byte %d") % (new_path, prefix_len))
+            if stats:
+                stats.SourceFileSize += prefix_len
+            infp = new_path.open("rb")
+            infp.seek(prefix_len)
+            newfp = FileWithReadCounter(infp)
+            if sigTarFile:
+                newfp = FileWithSignature(
+                    newfp, lambda sig: callback(prefix_sig + sig[librsync.sig_header_len:]),
+                    new_path.getsize(), block_len)
+            deltafp = librsync.AppendDeltaFile(prefix_len, newfp)
+        else:
+            newfp = FileWithReadCounter(new_path.open_sparse())
+            if sigTarFile:
+                newfp = FileWithSignature(newfp, callback,
+                                          new_path.getsize(),
+                                          get_path_block_size(new_path))
+            deltafp = librsync.DeltaFile(old_sigfp, newfp)
+        if history:
+            try:
+                block_len = librsync.get_sig_blocks(sig_string)[0]
+            except librsync.librsyncError:
+                pass
+            else:
+                deltafp = FileWithHistory(deltafp, new_path.index, block_len)
+        delta_path.setfileobj(deltafp)
     else:
         delta_path.difftype = "snapshot"
         if sigTarFile:
@@ -147,16 +192,67 @@ def get_delta_path(new_path, sig_path, sigTarFile=None):
             if stats:
                 stats.SourceFileSize += delta_path.getsize()
         else:
-            newfp = FileWithReadCounter(new_path.open("rb"))
+            delta_path.sparse = new_path.issparse()
+            newfp = FileWithReadCounter(new_path.open_sparse())
             if sigTarFile:
                 newfp = FileWithSignature(newfp, callback,
-                                          new_path.getsize())
+                                          new_path.getsize(),
+                                          get_path_block_size(new_path))
             delta_path.setfileobj(newfp)
     new_path.copy_attribs(delta_path)
     delta_path.stat.st_size = new_path.stat.st_size
     return delta_path
 
 
+def get_append_prefix(new_path, sig_string):
+    """
+    Return (length, block length, signature) of the unchanged start of
+    new_path, or None if it does not seem to have only grown
+
+    For --append-only-check.  new_path must be larger than the file
+    sig_string is the signature of, and with "sample" a few of its
+    blocks, spread over the old size, must match their checksums in
+    sig_string.  The last old block may have been partial, so it is not
+    counted as unchanged.  The signature returned is that of the
+    unchanged blocks.
+    """
+    try:
+        block_len, entry_len, num_blocks = librsync.get_sig_blocks(sig_string)
+    except librsync.librsyncError:
+        return None
+    if num_blocks < 2 or new_path.getsize() <= num_blocks * block_len:
+        return None
+    header_len = librsync.sig_header_len
+    if librsync.SigGenerator(block_len).getsig() != sig_string[:header_len]:
+        # made by a librsync using another checksum, we cannot extend it
+        return None
+    prefix_blocks = num_blocks - 1
+
+    if globals.append_only_check == "sample":
+        step = max(prefix_blocks // append_check_blocks, 1)
+        indexes = set(range(0, prefix_blocks, step))
+        indexes.add(prefix_blocks - 1)
+        with stagetimes.stage("signature") as st:
+            fp = new_path.open("rb")
+            try:
+                for i in sorted(indexes):
+                    fp.seek(i * block_len)
+                    sig_gen = librsync.SigGenerator(block_len)
+                    sig_gen.update(fp.read(block_len))
+                    st.add(block_len)
+                    start = header_len + i * entry_len
+                    if sig_gen.getsig()[header_len:] != sig_string[start:start + entry_len]:
+                        log.Debug(_("Block %d of %s changed, reading all of it") % (i, new_path))
+                        return None
+            finally:
+                assert not fp.close()
+    else:
+        assert globals.append_only_check == "size", globals.append_only_check
+
+    return (prefix_blocks * block_len, block_len,
+            sig_string[:header_len + prefix_blocks * entry_len])
+
+
 def log_delta_path(delta_path, new_path=None, stats=None):
     """
     Look at delta path and log delta.  Add stats if new_path is set
@@ -177,7 +273,7 @@ def log_delta_path(delta_path, new_path=None, stats=None):
                  util.escape(delta_path.get_relative_path()))
 
 
-def get_delta_iter(new_iter, sig_iter, sig_fileobj=None):
+def get_delta_iter(new_iter, sig_iter, sig_fileobj=None, restart=None):
     """
     Generate delta iter from new Path iter and sig Path iter.
 
@@ -186,12 +282,23 @@ def get_delta_iter(new_iter, sig_iter, sig_fileobj=None):
     instead of Paths.
 
     If sig_fileobj is not None, will also write signatures to sig_fileobj.
+
+    If restart is not None and restart.fast_index is set by the time
+    iteration starts, paths before that index are skipped without
+    being read, and their signatures are copied over from the partial
+    sigtar at restart.sig_path instead.
     """
     collated = collate2iters(new_iter, sig_iter)
     if sig_fileobj:
         sigTarFile = util.make_tarfile("w", sig_fileobj)
     else:
         sigTarFile = None
+    if restart and restart.fast_index is not None:
+        collated = skip_before_index(collated, restart.fast_index)
+        if sigTarFile:
+            for tarinfo, data in sigtar_entries_before(restart.sig_path.open("rb"),
+                                                       restart.fast_index):
+                sigTarFile.addfile(tarinfo, cStringIO.StringIO(data))
     for new_path, sig_path in collated:
         log.Debug(_("Comparing %s and %s") % (new_path and util.uindex(new_path.index),
                                               sig_path and util.uindex(sig_path.index)))
@@ -210,6 +317,8 @@ def get_delta_iter(new_iter, sig_iter, sig_fileobj=None):
                     ti.name = "deleted/" + "/".join(sig_path.index)
                     sigTarFile.addfile(ti)
                 stats.add_deleted_file(sig_path)
+                if history:
+                    history.forget(sig_path.index)
                 yield ROPath(sig_path.index)
         elif not sig_path or new_path != sig_path:
             # Must calculate new signature and create delta
@@ -228,6 +337,88 @@ def get_delta_iter(new_iter, sig_iter, sig_fileobj=None):
     stats.close()
     if sigTarFile:
         sigTarFile.close()
+        if history:
+            history.save()
+
+
+def skip_before_index(collated, index):
+    """
+    Drop pairs from collated until one at or after index
+    """
+    for new_path, sig_path in collated:
+        if (new_path or sig_path).index >= index:
+            yield (new_path, sig_path)
+            break
+    for pair in collated:
+        yield pair
+
+
+def get_sigtar_index(tarinfo):
+    """
+    Return (index, difftype) pair of a signature tar entry
+    """
+    tiname = util.get_tarinfo_name(tarinfo)
+    for prefix in ["signature/", "snapshot/", "deleted/"]:
+        if tiname.startswith(prefix):
+            # strip prefix and '/' from name and set it to difftype
+            name, difftype = tiname[len(prefix):], prefix[:-1]
+            break
+    else:
+        raise DiffDirException("Bad tarinfo name %s" % (tiname,))
+
+    index = tuple(name.split("/"))
+    if not index[-1]:
+        index = index[:-1]  # deal with trailing /, ""
+    return index, difftype
+
+
+def get_sigtar_header_index(buf):
+    """
+    Return index of the signature tar entry whose header starts buf
+
+    buf is what a TarFile writes for a header, including a GNU long
+    name.  Return None if buf is the end of archive marker instead.
+    """
+    try:
+        tarinfo = tarfile.TarInfo.frombuf(buf[:tarfile.BLOCKSIZE])
+    except tarfile.HeaderError:
+        if not buf[:tarfile.BLOCKSIZE].strip("\0"):
+            return None
+        raise DiffDirException("Bad signature tar header")
+    if tarinfo.type == tarfile.GNUTYPE_LONGNAME:
+        name = buf[tarfile.BLOCKSIZE:tarfile.BLOCKSIZE + tarinfo.size]
+        blocks = (tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        offset = (blocks + 1) * tarfile.BLOCKSIZE
+        tarinfo = tarfile.TarInfo.frombuf(buf[offset:offset + tarfile.BLOCKSIZE])
+        tarinfo.name = name.rstrip("\0")
+    return get_sigtar_index(tarinfo)[0]
+
+
+def sigtar_entries_before(sigtarobj, index):
+    """
+    Yield (tarinfo, data) for the entries of a sigtar before index
+
+    The sigtar may be the partial one of an interrupted backup, so it
+    can end in a damaged entry.  Raise DiffDirException if that
+    happens before index is reached.
+    """
+    tf = util.make_tarfile("r", sigtarobj)
+    try:
+        for tarinfo in tf:
+            if get_sigtar_index(tarinfo)[0] >= index:
+                break
+            data = ""
+            if tarinfo.isreg():
+                fp = tf.extractfile(tarinfo)
+                data = fp.read()
+                fp.close()
+                if len(data) != tarinfo.size:
+                    raise DiffDirException("Signature of %s is truncated" %
+                                           (util.get_tarinfo_name(tarinfo),))
+            yield tarinfo, data
+    except (tarfile.TarError, IOError, EOFError) as e:
+        raise DiffDirException("Damaged signature file: %s" % (e,))
+    sigtarobj.close()
 
 
 def sigtar2path_iter(sigtarobj):
@@ -237,19 +428,7 @@ def sigtar2path_iter(sigtarobj):
     tf = util.make_tarfile("r", sigtarobj)
     tf.debug = 1
     for tarinfo in tf:
-        tiname = util.get_tarinfo_name(tarinfo)
-        for prefix in ["signature/", "snapshot/", "deleted/"]:
-            if tiname.startswith(prefix):
-                # strip prefix and '/' from name and set it to difftype
-                name, difftype = tiname[len(prefix):], prefix[:-1]
-                break
-        else:
-            raise DiffDirException("Bad tarinfo name %s" % (tiname,))
-
-        index = tuple(name.split("/"))
-        if not index[-1]:
-            index = index[:-1]  # deal with trailing /, ""
-
+        index, difftype = get_sigtar_index(tarinfo)
         ropath = ROPath(index)
         ropath.difftype = difftype
         if difftype == "signature" or difftype == "snapshot":
@@ -354,21 +533,30 @@ def combine_path_iters(path_iter_list):
         refresh_triple_list(triple_list)
 
 
-def DirDelta_WriteSig(path_iter, sig_infp_list, newsig_outfp):
+def DirDelta_WriteSig(path_iter, sig_infp_list, newsig_outfp, restart=None):
     """
     Like DirDelta but also write signature into sig_fileobj
 
     Like DirDelta, sig_infp_list can be a tar fileobj or a sorted list
     of those.  A signature will only be written to newsig_outfp if it
-    is different from (the combined) sig_infp_list.
+    is different from (the combined) sig_infp_list.  See
+    get_delta_iter for restart.
     """
-    global stats
+    global stats, history
     stats = statistics.StatsDeltaProcess()
+    history = None
+    if globals.adaptive_blocksize:
+        history_path = None
+        if globals.archive_dir_path:
+            history_path = globals.archive_dir_path.append("blocksize-history").name
+        history = blocksize.History(history_path)
+    path_iter = stagetimes.timed_iter("select", path_iter)
     if isinstance(sig_infp_list, list):
         sig_path_iter = get_combined_path_iter(sig_infp_list)
     else:
         sig_path_iter = sigtar2path_iter(sig_infp_list)
-    delta_iter = get_delta_iter(path_iter, sig_path_iter, newsig_outfp)
+    delta_iter = get_delta_iter(path_iter, sig_path_iter, newsig_outfp,
+                                restart)
     if globals.dry_run or (globals.progress and not progress.tracker.has_collected_evidence()):
         return DummyBlockIter(delta_iter)
     else:
@@ -391,11 +579,13 @@ class FileWithReadCounter:
         self.infile = infile
 
     def read(self, length=-1):
-        try:
-            buf = self.infile.read(length)
-        except IOError as ex:
-            buf = ""
-            log.Warn(_("Error %s getting delta for %s") % (str(ex), self.infile.uc_name))
+        with stagetimes.stage("read") as st:
+            try:
+                buf = self.infile.read(length)
+            except IOError as ex:
+                buf = ""
+                log.Warn(_("Error %s getting delta for %s") % (str(ex), self.infile.uc_name))
+            st.add(len(buf))
         if stats:
             stats.SourceFileSize += len(buf)
         return buf
@@ -404,31 +594,55 @@ class FileWithReadCounter:
         return self.infile.close()
 
 
+class FileWithHistory:
+    """
+    File-like object which records the changes in a delta in history
+    """
+    def __init__(self, infile, index, block_len):
+        """
+        infile is the delta of the file at index, made with a signature
+        of block_len blocks
+        """
+        self.infile, self.index, self.block_len = infile, index, block_len
+        self.delta_stats = librsync.DeltaStats()
+
+    def read(self, length=-1):
+        buf = self.infile.read(length)
+        self.delta_stats.update(buf)
+        return buf
+
+    def close(self):
+        history.record(self.index, self.block_len, self.delta_stats.literal_runs)
+        return self.infile.close()
+
+
 class FileWithSignature:
     """
     File-like object which also computes signature as it is read
     """
     blocksize = 32 * 1024
 
-    def __init__(self, infile, callback, filelen, *extra_args):
+    def __init__(self, infile, callback, filelen, blocksize=None):
         """
         FileTee initializer
 
         The object will act like infile, but whenever it is read it
         add infile's data to a SigGenerator object.  When the file has
         been read to the end the callback will be called with the
-        calculated signature, and any extra_args if given.
+        calculated signature.
 
-        filelen is used to calculate the block size of the signature.
+        filelen is used to calculate the block size of the signature,
+        unless blocksize is given.
         """
         self.infile, self.callback = infile, callback
-        self.sig_gen = librsync.SigGenerator(get_block_size(filelen))
+        self.sig_gen = librsync.SigGenerator(blocksize or get_block_size(filelen))
         self.activated_callback = None
-        self.extra_args = extra_args
 
     def read(self, length=-1):
         buf = self.infile.read(length)
-        self.sig_gen.update(buf)
+        with stagetimes.stage("signature") as st:
+            self.sig_gen.update(buf)
+            st.add(len(buf))
         return buf
 
     def close(self):
@@ -437,7 +651,9 @@ class FileWithSignature:
             while self.read(self.blocksize):
                 pass
             self.activated_callback = 1
-            self.callback(self.sig_gen.getsig(), *self.extra_args)
+            with stagetimes.stage("signature"):
+                sig = self.sig_gen.getsig()
+            self.callback(sig)
         return self.infile.close()
 
 
@@ -536,7 +752,7 @@ class TarBlockIter:
         # backup volume where the previous volume ended in a data block, we
         # have to be able to assume it's length in order to continue reading
         # the file from the right place.
-        return 64 * 1024
+        return read_size
 
     def get_previous_index(self):
         """
@@ -610,10 +826,12 @@ class SigTarBlockIter(TarBlockIter):
         """
         ti = path.get_tarinfo()
         if path.isreg():
-            sfp = librsync.SigFile(path.open("rb"),
-                                   get_block_size(path.getsize()))
-            sigbuf = sfp.read()
-            sfp.close()
+            with stagetimes.stage("signature") as st:
+                sfp = librsync.SigFile(path.open("rb"),
+                                       get_path_block_size(path))
+                sigbuf = sfp.read()
+                sfp.close()
+                st.add(path.getsize())
             ti.name = "signature/" + "/".join(path.index)
             return self.tarinfo2tarblock(path.index, ti, sigbuf)
         else:
@@ -666,8 +884,12 @@ class DeltaTarBlockIter(TarBlockIter):
                 assert 0, "Unknown difftype"
             return self.tarinfo2tarblock(index, ti, data)
 
-        # Finally, do multivol snapshot or diff case
-        full_name = "multivol_%s/%s" % (delta_ropath.difftype, ti.name)
+        # Finally, do multivol snapshot or diff case.  Sparse snapshots
+        # get their own prefix, because blocks of zeros are left out.
+        if delta_ropath.difftype == "snapshot" and delta_ropath.sparse:
+            full_name = "multivol_sparse/%s" % (ti.name,)
+        else:
+            full_name = "multivol_%s/%s" % (delta_ropath.difftype, ti.name)
         ti.name = full_name + "/1"
         self.process_prefix = full_name
         self.process_fp = fp
@@ -681,13 +903,15 @@ class DeltaTarBlockIter(TarBlockIter):
         Return pair (next data block, boolean last data block)
         """
         read_size = self.get_read_size()
-        buf = fp.read(read_size)
-        if len(buf) < read_size:
-            if fp.close():
-                raise DiffDirException("Error closing file")
-            return (buf, True)
-        else:
-            return (buf, False)
+        with stagetimes.stage("delta") as st:
+            buf = fp.read(read_size)
+            st.add(len(buf))
+            if len(buf) < read_size:
+                if fp.close():
+                    raise DiffDirException("Error closing file")
+                return (buf, True)
+            else:
+                return (buf, False)
 
     def process_continued(self):
         """
@@ -696,8 +920,14 @@ class DeltaTarBlockIter(TarBlockIter):
         assert self.process_waiting
         ropath = self.process_ropath
         ti, index = ropath.get_tarinfo(), ropath.index
-        ti.name = "%s/%d" % (self.process_prefix, self.process_next_vol_number)
         data, last_block = self.get_data_block(self.process_fp)
+        if ropath.sparse:
+            # holes are implied by the missing block numbers
+            zero_block = "\0" * read_size
+            while not last_block and data == zero_block:
+                self.process_next_vol_number += 1
+                data, last_block = self.get_data_block(self.process_fp)
+        ti.name = "%s/%d" % (self.process_prefix, self.process_next_vol_number)
         if stats:
             stats.RawDeltaSize += len(data)
         if last_block:
@@ -743,3 +973,17 @@ def get_block_size(file_len):
         # Split file into about 2000 pieces, rounding to 512
         file_blocksize = int((file_len / (2000 * 512)) * 512)
         return min(file_blocksize, globals.max_blocksize)
+
+
+def get_path_block_size(path):
+    """
+    Return block size of the signature of path
+
+    That is get_block_size() of its length, unless --adaptive-blocksize
+    is given, when the block size is chosen by blocksize.get_block_size()
+    from the size, name and history of the file.
+    """
+    if globals.adaptive_blocksize:
+        return blocksize.get_block_size(path.getsize(), path.index,
+                                        history and history.get(path.index))
+    return get_block_size(path.getsize())
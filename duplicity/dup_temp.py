@@ -25,6 +25,9 @@ import os
 import sys
 import shutil
 
+from duplicity import aead
+from duplicity import compression
+from duplicity import diffdir
 from duplicity import log
 from duplicity import util
 from duplicity import path
@@ -32,6 +35,7 @@ from duplicity import file_naming
 from duplicity import tempdir
 from duplicity import globals
 from duplicity import gpg
+from duplicity import manifest
 
 
 def new_temppath():
@@ -62,13 +66,17 @@ class TempPath(path.Path):
         return fh
 
 
-def get_fileobj_duppath(dirpath, partname, permname, remname, overwrite=False):
+def get_fileobj_duppath(dirpath, partname, permname, remname, overwrite=False,
+                        stream=False):
     """
     Return a file object open for writing, will write to filename
 
     Data will be processed and written to a temporary file.  When the
     return fileobject is closed, rename to final position.  filename
     must be a recognizable duplicity data file.
+
+    If stream is true, the permanent and remote copies are written
+    as the data comes in, see FileobjHooked.stream().
     """
     if not globals.restart:
         td = tempdir.TemporaryDirectory(dirpath.name)
@@ -91,9 +99,37 @@ def get_fileobj_duppath(dirpath, partname, permname, remname, overwrite=False):
     if not globals.restart:
         fh.addhook(rename_and_forget)
 
+    if stream and (overwrite or not globals.restart):
+        fh.stream()
+
     return fh
 
 
+def open_stream(filename, pr):
+    """
+    Return fileobj writing filename in the format given by parse results pr
+    """
+    if pr.compressed:
+        return compression.get_codec(pr.codec).open(filename, "wb")
+    elif pr.aead:
+        return aead.open_file(path.Path(filename), "wb",
+                              globals.gpg_profile.passphrase)
+    elif pr.encrypted:
+        return gpg.GPGFile(True, path.Path(filename), globals.gpg_profile)
+    else:
+        return open(filename, "wb")
+
+
+def get_part_name(filename, volume_number=None, manifest=False):
+    """
+    Return name of a later part or the part index of signature filename
+    """
+    pr = file_naming.parse(filename)
+    return file_naming.get(pr.type, volume_number, manifest=manifest,
+                           encrypted=pr.encrypted,
+                           gzipped=pr.compressed and not manifest)
+
+
 def new_tempduppath(parseresults):
     """
     Return a new TempDupPath, using settings from parseresults
@@ -148,11 +184,97 @@ class FileobjHooked:
         self.partname = partname  # partial filename
         self.permname = permname  # permanent filename
         self.remname = remname  # remote filename
+        self.streams = []  # (fileobj, filename, name) written alongside
+        self.streamed = {}  # name -> filename of closed streams
+        self.stream_td = None  # TemporaryDirectory holding the streams
+        self.part_names = []  # (permname, remname) of later signature parts
+        self.part_number = 1  # number of the signature part being written
+        self.part_size = 0  # bytes written since the part started
+        self.sigindex = None  # manifest.SigIndex, set once split
+        self.peek_index = False  # true if next write starts a part
+
+    def stream(self):
+        """
+        Write the permanent and remote copies while the data comes in
+
+        Otherwise to_remote() and to_final() produce them from the
+        partial file at the end, compressing or encrypting all of it
+        once each.  Streaming moves that work into the backup, so the
+        two only have to rename.  The partial file is still written,
+        as it is what a restarted backup reads back.  This is only
+        right if the whole file is written in this session.
+        """
+        self.add_streams(self.permname, self.remname)
+
+    def add_streams(self, permname, remname):
+        """
+        Start streaming the permanent and remote copies to these names
+        """
+        names = [permname]
+        if remname != permname:
+            names.append(remname)
+        for name in names:
+            pr = file_naming.parse(name)
+            if name == permname and not pr.compressed:
+                continue  # to_final only renames
+            if not self.stream_td:
+                self.stream_td = tempdir.TemporaryDirectory(self.dirpath.name)
+            filename = self.stream_td.mktemp()
+            self.streams.append((open_stream(filename, pr), filename, name))
+
+    def split(self):
+        """
+        Start the next part of a signature, see --sig-part-size
+
+        Only call this between signature tar entries, as at a
+        checkpoint.  The streamed permanent and remote copies are cut
+        here, so the parts concatenated are the whole signature.  The
+        partial file is not, restarts still read it back in one piece.
+        Does nothing if not streaming.
+        """
+        if not self.streams:
+            return
+        for fileobj, filename, name in self.streams:
+            fileobj.close()
+            self.streamed[name] = filename
+        self.streams = []
+        if not self.sigindex:
+            self.sigindex = manifest.SigIndex()
+            self.sigindex.add_part(1, ())
+        self.part_number += 1
+        self.part_size = 0
+        self.peek_index = True
+        permname = get_part_name(self.permname, self.part_number)
+        remname = get_part_name(self.remname, self.part_number)
+        self.part_names.append((permname, remname))
+        self.add_streams(permname, remname)
+
+    def write_sigindex(self):
+        """
+        Write the permanent and remote part index of a split signature
+        """
+        permname = get_part_name(self.permname, manifest=True)
+        remname = get_part_name(self.remname, manifest=True)
+        for name in set([permname, remname]):
+            filename = self.stream_td.mktemp()
+            fileobj = open_stream(filename, file_naming.parse(name))
+            fileobj.write(self.sigindex.to_string())
+            fileobj.close()
+            self.streamed[name] = filename
+        self.part_names.append((permname, remname))
 
     def write(self, buf):
         """
         Write fileobj, return result of write()
         """
+        if self.peek_index:
+            self.peek_index = False
+            index = diffdir.get_sigtar_header_index(buf)
+            if index is not None:
+                self.sigindex.add_part(self.part_number, index)
+        self.part_size += len(buf)
+        for fileobj, filename, name in self.streams:
+            fileobj.write(buf)
         return self.fileobj.write(buf)
 
     def flush(self):
@@ -161,6 +283,9 @@ class FileobjHooked:
         """
         self.fileobj.flush()
         os.fsync(self.fileobj.fileno())
+        for fileobj, filename, name in self.streams:
+            if hasattr(fileobj, "flush"):
+                fileobj.flush()
 
     def to_partial(self):
         """
@@ -176,12 +301,20 @@ class FileobjHooked:
         We have written the last checkpoint, now encrypt or compress
         and send a copy of it to the remote for final storage.
         """
+        for permname, remname in self.part_names:
+            self.move_stream(permname, remname)
+        if self.remname in self.streamed:
+            self.move_stream(self.permname, self.remname)
+            return
         pr = file_naming.parse(self.remname)
         src = self.dirpath.append(self.partname)
         tgt = self.dirpath.append(self.remname)
         src_iter = SrcIter(src)
         if pr.compressed:
-            gpg.GzipWriteFile(src_iter, tgt.name, size=sys.maxsize)
+            gpg.GzipWriteFile(src_iter, tgt.name, size=sys.maxsize, codec=pr.codec)
+        elif pr.aead:
+            aead.AEADWriteFile(src_iter, tgt.name, globals.gpg_profile.passphrase,
+                               size=sys.maxsize)
         elif pr.encrypted:
             gpg.GPGWriteFile(src_iter, tgt.name, globals.gpg_profile, size=sys.maxsize)
         else:
@@ -190,18 +323,45 @@ class FileobjHooked:
 
     def to_final(self):
         """
-        We are finished, rename to final, gzip if needed.
+        We are finished, rename to final, compress if needed.
         """
+        for permname, remname in self.part_names:
+            self.rename_stream(permname, self.dirpath.append(permname))
         src = self.dirpath.append(self.partname)
         tgt = self.dirpath.append(self.permname)
-        src_iter = SrcIter(src)
+        if self.permname in self.streamed:
+            self.rename_stream(self.permname, tgt)
+            os.unlink(src.name)
+            return
         pr = file_naming.parse(self.permname)
         if pr.compressed:
-            gpg.GzipWriteFile(src_iter, tgt.name, size=sys.maxsize)
+            src_iter = SrcIter(src)
+            gpg.GzipWriteFile(src_iter, tgt.name, size=sys.maxsize, codec=pr.codec)
             os.unlink(src.name)
         else:
             os.rename(src.name, tgt.name)
 
+    def move_stream(self, permname, remname):
+        """
+        Send the closed stream written for remname to the backend
+        """
+        tgt = self.dirpath.append(remname)
+        if remname == permname:
+            shutil.copyfile(self.streamed[remname], tgt.name)
+        else:
+            self.rename_stream(remname, tgt)
+        globals.backend.move(tgt)  # @UndefinedVariable
+
+    def rename_stream(self, name, tgt):
+        """
+        Move the closed stream written for name to tgt
+        """
+        filename = self.streamed.pop(name)
+        os.rename(filename, tgt.name)
+        self.stream_td.forget(filename)
+        if not self.streamed:
+            self.stream_td.cleanup()
+
     def read(self, length=-1):
         """
         Read fileobj, return result of read()
@@ -225,6 +385,12 @@ class FileobjHooked:
         Close fileobj, running hooks right afterwards
         """
         assert not self.fileobj.close()
+        for fileobj, filename, name in self.streams:
+            fileobj.close()
+            self.streamed[name] = filename
+        self.streams = []
+        if self.sigindex:
+            self.write_sigindex()
         for hook in self.hooklist:
             hook()
 
@@ -0,0 +1,407 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Reed-Solomon erasure coding of files
+
+A file is read in rows of k blocks of block_size bytes, the last row
+padded with zeros.  For each row m parity blocks are computed, so that
+any k of the k + m blocks of a row give back the k data blocks.  Block
+i of every row makes up shard i.  An ErasureIndex keeps the size of
+the file and a hash of every block, to tell which blocks are intact.
+
+The arithmetic is done in GF(2^8) with a systematic Cauchy matrix.
+Blocks are multiplied with numpy when it is installed, otherwise with
+str.translate and long integer xor, which is slower but still runs at
+C speed over whole blocks.
+"""
+
+import binascii
+import hashlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# largest block, so a row of blocks is kept in memory at a time
+max_block_size = 1024 * 1024
+
+
+class ErasureError(Exception):
+    u"""
+    Indicate too few intact blocks, or a bad index
+    """
+    pass
+
+
+# log and exp tables of GF(2^8) with polynomial x^8+x^4+x^3+x^2+1
+_exp = [0] * 512
+_log = [0] * 256
+_x = 1
+for _i in range(255):
+    _exp[_i] = _x
+    _log[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    _exp[_i] = _exp[_i - 255]
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _exp[_log[a] + _log[b]]
+
+
+def gf_inv(a):
+    assert a != 0
+    return _exp[255 - _log[a]]
+
+
+_translate_tables = {}
+_numpy_table = []
+
+
+def _get_translate_table(c):
+    u"""
+    Return str.translate table multiplying each byte by c
+    """
+    table = _translate_tables.get(c)
+    if table is None:
+        table = b"".join([chr(gf_mul(c, x)) for x in range(256)])
+        _translate_tables[c] = table
+    return table
+
+
+def _get_numpy_table():
+    u"""
+    Return 256x256 numpy array of all products
+    """
+    if not _numpy_table:
+        _numpy_table.append(numpy.array([[gf_mul(a, b) for b in range(256)]
+                                         for a in range(256)], numpy.uint8))
+    return _numpy_table[0]
+
+
+def combine(coefficients, blocks):
+    u"""
+    Return the sum of blocks each multiplied by its coefficient
+
+    All blocks must have the same, non-zero length.
+    """
+    length = len(blocks[0])
+    if numpy is not None:
+        table = _get_numpy_table()
+        acc = numpy.zeros(length, numpy.uint8)
+        for c, block in zip(coefficients, blocks):
+            if c == 0:
+                continue
+            array = numpy.frombuffer(block, numpy.uint8)
+            if c == 1:
+                acc ^= array
+            else:
+                acc ^= table[c][array]
+        return acc.tostring()
+
+    acc = 0
+    for c, block in zip(coefficients, blocks):
+        if c == 0:
+            continue
+        if c != 1:
+            block = block.translate(_get_translate_table(c))
+        acc ^= int(binascii.hexlify(block), 16)
+    return binascii.unhexlify(b"%0*x" % (2 * length, acc))
+
+
+def invert_matrix(matrix):
+    u"""
+    Return inverse of square matrix (list of rows) over GF(2^8)
+    """
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)]
+            for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = col
+        while pivot < n and rows[pivot][col] == 0:
+            pivot += 1
+        if pivot == n:
+            raise ErasureError(u"Singular matrix")
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        inv = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(inv, x) for x in rows[col]]
+        for i in range(n):
+            factor = rows[i][col]
+            if i != col and factor:
+                rows[i] = [x ^ gf_mul(factor, y) for x, y in zip(rows[i], rows[col])]
+    return [row[n:] for row in rows]
+
+
+class ReedSolomon:
+    u"""
+    Code k data blocks into k + m blocks, any k of which are enough
+    """
+    def __init__(self, k, m):
+        if not (k >= 1 and m >= 0 and k + m <= 256):
+            raise ErasureError(u"Cannot code %d data and %d parity blocks" % (k, m))
+        self.k = k
+        self.m = m
+        # parity block i is sum_j 1 / ((k + i) ^ j) * data block j
+        self.parity_matrix = [[gf_inv((k + i) ^ j) for j in range(k)]
+                              for i in range(m)]
+        self.decode_matrices = {}
+
+    def get_row(self, index):
+        u"""
+        Return coefficients of block index in terms of the data blocks
+        """
+        if index < self.k:
+            return [int(j == index) for j in range(self.k)]
+        return self.parity_matrix[index - self.k]
+
+    def encode(self, blocks):
+        u"""
+        Return list of m parity blocks of list of k data blocks
+        """
+        assert len(blocks) == self.k
+        return [combine(row, blocks) for row in self.parity_matrix]
+
+    def decode(self, shards):
+        u"""
+        Return list of k data blocks given dict of at least k blocks
+
+        shards maps block index (data blocks are 0 to k-1, parity
+        blocks k to k+m-1) to block.
+        """
+        if len(shards) < self.k:
+            raise ErasureError(u"%d blocks needed, %d available" % (self.k, len(shards)))
+        chosen = tuple(sorted(shards.keys())[:self.k])
+        if chosen == tuple(range(self.k)):
+            return [shards[j] for j in chosen]
+
+        inverse = self.decode_matrices.get(chosen)
+        if inverse is None:
+            inverse = invert_matrix([self.get_row(i) for i in chosen])
+            self.decode_matrices[chosen] = inverse
+        blocks = [shards[i] for i in chosen]
+        data = []
+        for j in range(self.k):
+            if j in shards:
+                data.append(shards[j])
+            else:
+                data.append(combine(inverse[j], blocks))
+        return data
+
+
+def get_hash(block):
+    return hashlib.sha1(block).hexdigest()
+
+
+def get_block_size(size, k):
+    u"""
+    Return block size to code a file of size bytes in rows of k blocks
+    """
+    return max(1, min(max_block_size, (size + k - 1) // k))
+
+
+class ErasureIndex:
+    u"""
+    Size, coding parameters and block hashes of an erasure coded file
+    """
+    def __init__(self, size=0, block_size=0, k=0, m=0):
+        self.size = size
+        self.block_size = block_size
+        self.k = k
+        self.m = m
+        self.hashes = []  # per row, hashes of its k + m blocks
+
+    def get_rows(self):
+        return len(self.hashes)
+
+    def to_string(self):
+        u"""
+        Return the index as bytes, to store with the shards
+        """
+        lines = [u"Size %d" % self.size,
+                 u"BlockSize %d" % self.block_size,
+                 u"DataBlocks %d" % self.k,
+                 u"ParityBlocks %d" % self.m]
+        for row in self.hashes:
+            lines.append(u"Row %s" % u" ".join(row))
+        return (u"\n".join(lines) + u"\n").encode(u"ascii")
+
+    def from_string(self, s):
+        u"""
+        Initialize self from bytes s as made by to_string, return self
+        """
+        fields = {}
+        self.hashes = []
+        try:
+            for line in s.decode(u"ascii").splitlines():
+                words = line.split()
+                if not words:
+                    continue
+                if words[0] == u"Row":
+                    self.hashes.append(words[1:])
+                else:
+                    fields[words[0]] = int(words[1])
+            self.size = fields[u"Size"]
+            self.block_size = fields[u"BlockSize"]
+            self.k = fields[u"DataBlocks"]
+            self.m = fields[u"ParityBlocks"]
+        except (KeyError, IndexError, ValueError):
+            raise ErasureError(u"Bad erasure index")
+        row_size = self.k * self.block_size
+        if (self.get_rows() != (self.size + row_size - 1) // max(row_size, 1) or
+                [row for row in self.hashes if len(row) != self.k + self.m]):
+            raise ErasureError(u"Bad erasure index")
+        return self
+
+
+def _read_full(fp, size):
+    u"""
+    Read size bytes from fp, less only at end of file
+    """
+    bufs = []
+    while size > 0:
+        buf = fp.read(size)
+        if not buf:
+            break
+        bufs.append(buf)
+        size -= len(buf)
+    return b"".join(bufs)
+
+
+def encode(infp, k, m, block_size, parity_fps, data_fps=None):
+    u"""
+    Read infp to its end, return its ErasureIndex
+
+    Parity shard i is written to parity_fps[i], and if data_fps is
+    given data shard j to data_fps[j].
+    """
+    rs = ReedSolomon(k, m)
+    index = ErasureIndex(0, block_size, k, m)
+    row_size = k * block_size
+    while True:
+        buf = _read_full(infp, row_size)
+        if not buf:
+            break
+        index.size += len(buf)
+        blocks = [buf[j * block_size:(j + 1) * block_size].ljust(block_size, b"\0")
+                  for j in range(k)]
+        parity = rs.encode(blocks)
+        if data_fps:
+            for fp, block in zip(data_fps, blocks):
+                fp.write(block)
+        for fp, block in zip(parity_fps, parity):
+            fp.write(block)
+        index.hashes.append([get_hash(block) for block in blocks + parity])
+        if len(buf) < row_size:
+            break
+    return index
+
+
+def _read_shard_block(fp, index, row):
+    u"""
+    Return block row of shard fp
+    """
+    fp.seek(row * index.block_size)
+    return _read_full(fp, index.block_size)
+
+
+def _get_row_shards(index, row, get_block):
+    u"""
+    Return dict of k intact blocks of row, or raise ErasureError
+
+    get_block(i) returns block i of the row or None.  Data blocks are
+    tried first, as they need no decoding.
+    """
+    shards = {}
+    for i in range(index.k + index.m):
+        block = get_block(i)
+        if block is not None and get_hash(block) == index.hashes[row][i]:
+            shards[i] = block
+            if len(shards) == index.k:
+                return shards
+    raise ErasureError(u"Row %d has %d intact blocks, %d needed" %
+                       (row, len(shards), index.k))
+
+
+def decode(shard_fps, index, outfp):
+    u"""
+    Write the file coded as index from its shards to outfp
+
+    shard_fps is a list of k + m seekable file objects, None for
+    missing shards.  Blocks with a wrong hash are not used.
+    """
+    rs = ReedSolomon(index.k, index.m)
+    row_size = index.k * index.block_size
+
+    for row in range(index.get_rows()):
+        def get_block(i):
+            if shard_fps[i] is None:
+                return None
+            return _read_shard_block(shard_fps[i], index, row)
+        data = rs.decode(_get_row_shards(index, row, get_block))
+        outfp.write(b"".join(data)[:index.size - row * row_size])
+
+
+def repair(fp, index, get_parity_fps):
+    u"""
+    Check file fp against index, rewrite its corrupt blocks
+
+    fp must be opened for reading and writing.  get_parity_fps() is
+    called once a corrupt block is found and returns the list of m
+    parity shard file objects, None for missing ones.  Return number
+    of blocks repaired, raise ErasureError if that is not possible.
+    """
+    rs = ReedSolomon(index.k, index.m)
+    row_size = index.k * index.block_size
+    parity_fps = []
+    repaired = 0
+
+    for row in range(index.get_rows()):
+        fp.seek(row * row_size)
+        buf = _read_full(fp, min(row_size, index.size - row * row_size))
+        blocks = [buf[j * index.block_size:(j + 1) * index.block_size].ljust(index.block_size, b"\0")
+                  for j in range(index.k)]
+        bad = [j for j in range(index.k) if get_hash(blocks[j]) != index.hashes[row][j]]
+        if not bad:
+            continue
+
+        if not parity_fps:
+            parity_fps = get_parity_fps()
+
+        def get_block(i):
+            if i < index.k:
+                return blocks[i]
+            if parity_fps[i - index.k] is None:
+                return None
+            return _read_shard_block(parity_fps[i - index.k], index, row)
+        data = rs.decode(_get_row_shards(index, row, get_block))
+        for j in bad:
+            offset = row * row_size + j * index.block_size
+            if offset >= index.size:
+                continue
+            fp.seek(offset)
+            fp.write(data[j][:index.size - offset])
+            repaired += 1
+
+    fp.truncate(index.size)
+    return repaired
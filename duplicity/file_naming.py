@@ -22,6 +22,8 @@
 """Produce and parse the names of duplicity's backup files"""
 
 import re
+from duplicity import aead
+from duplicity import compression
 from duplicity import dup_time
 from duplicity import globals
 
@@ -114,13 +116,15 @@ def prepare_regex(force=False):
 
     full_sig_re = re.compile("^" + globals.file_prefix + globals.file_prefix_signature + "duplicity-full-signatures"
                              "\\.(?P<time>.*?)"
-                             "\\.sigtar"
+                             "(\\.sig(?P<num>[0-9]+))?"
+                             "\\.(?P<kind>sigtar|sigindex)"
                              "(?P<partial>(\\.part))?"
                              "(\\.|$)")
 
     full_sig_re_short = re.compile("^" + globals.file_prefix + globals.file_prefix_signature + "dfs"
                                    "\\.(?P<time>[0-9a-z]+?)"
-                                   "\\.st"
+                                   "(\\.(?P<num>[0-9a-z]+))?"
+                                   "\\.(?P<kind>st|si)"
                                    "(?P<partial>(\\.p))?"
                                    "(\\.|$)")
 
@@ -128,14 +132,16 @@ def prepare_regex(force=False):
                             "\\.(?P<start_time>.*?)"
                             "\\.to"
                             "\\.(?P<end_time>.*?)"
-                            "\\.sigtar"
+                            "(\\.sig(?P<num>[0-9]+))?"
+                            "\\.(?P<kind>sigtar|sigindex)"
                             "(?P<partial>(\\.part))?"
                             "(\\.|$)")
 
     new_sig_re_short = re.compile("^" + globals.file_prefix + globals.file_prefix_signature + "dns"
                                   "\\.(?P<start_time>[0-9a-z]+?)"
                                   "\\.(?P<end_time>[0-9a-z]+?)"
-                                  "\\.st"
+                                  "(\\.(?P<num>[0-9a-z]+))?"
+                                  "\\.(?P<kind>st|si)"
                                   "(?P<partial>(\\.p))?"
                                   "(\\.|$)")
 
@@ -175,20 +181,27 @@ def from_base36(s):
 def get_suffix(encrypted, gzipped):
     """
     Return appropriate suffix depending on status of
-    encryption, compression, and short_filenames.
+    encryption, compression, and short_filenames.  The
+    compression suffix is that of the configured codec.
     """
     if encrypted:
         gzipped = False
-    if encrypted:
+    if encrypted and globals.aead_encryption:
+        if globals.short_filenames:
+            suffix = aead.short_suffix
+        else:
+            suffix = aead.suffix
+    elif encrypted:
         if globals.short_filenames:
             suffix = '.g'
         else:
             suffix = ".gpg"
     elif gzipped:
+        codec = compression.get_codec()
         if globals.short_filenames:
-            suffix = ".z"
+            suffix = codec.short_suffix
         else:
-            suffix = '.gz'
+            suffix = codec.suffix
     else:
         suffix = ""
     return suffix
@@ -202,6 +215,10 @@ def get(type, volume_number=None, manifest=False,
     type can be "full", "inc", "full-sig", or "new-sig". volume_number
     can be given with the full and inc types.  If manifest is true the
     filename is of a full or inc manifest file.
+
+    A signature split by --sig-part-size keeps the usual name for its
+    first part.  Its later parts are named by giving a volume_number
+    greater than one, its part index by setting manifest.
     """
     assert dup_time.curtimestr
     if encrypted:
@@ -216,29 +233,43 @@ def get(type, volume_number=None, manifest=False,
             part_string = ".part"
 
     if type == "full-sig" or type == "new-sig":
-        assert not volume_number and not manifest
-        assert not (volume_number and part_string)
+        assert not (volume_number and manifest)
+        assert not ((volume_number or manifest) and part_string)
+        if globals.short_filenames:
+            if manifest:
+                sig_string = "si"
+            elif volume_number > 1:
+                sig_string = "%s.st" % to_base36(volume_number)
+            else:
+                sig_string = "st"
+        else:
+            if manifest:
+                sig_string = "sigindex"
+            elif volume_number > 1:
+                sig_string = "sig%d.sigtar" % volume_number
+            else:
+                sig_string = "sigtar"
         if type == "full-sig":
             if globals.short_filenames:
                 return (globals.file_prefix + globals.file_prefix_signature +
-                        "dfs.%s.st%s%s" %
-                        (to_base36(dup_time.curtime), part_string, suffix))
+                        "dfs.%s.%s%s%s" %
+                        (to_base36(dup_time.curtime), sig_string, part_string, suffix))
             else:
                 return (globals.file_prefix + globals.file_prefix_signature +
-                        "duplicity-full-signatures.%s.sigtar%s%s" %
-                        (dup_time.curtimestr, part_string, suffix))
+                        "duplicity-full-signatures.%s.%s%s%s" %
+                        (dup_time.curtimestr, sig_string, part_string, suffix))
         elif type == "new-sig":
             if globals.short_filenames:
                 return (globals.file_prefix + globals.file_prefix_signature +
-                        "dns.%s.%s.st%s%s" %
+                        "dns.%s.%s.%s%s%s" %
                         (to_base36(dup_time.prevtime),
                          to_base36(dup_time.curtime),
-                         part_string, suffix))
+                         sig_string, part_string, suffix))
             else:
                 return (globals.file_prefix + globals.file_prefix_signature +
-                        "duplicity-new-signatures.%s.to.%s.sigtar%s%s" %
+                        "duplicity-new-signatures.%s.to.%s.%s%s%s" %
                         (dup_time.prevtimestr, dup_time.curtimestr,
-                         part_string, suffix))
+                         sig_string, part_string, suffix))
     else:
         assert volume_number or manifest
         assert not (volume_number and manifest)
@@ -304,6 +335,17 @@ def parse(filename):
         else:
             return int(s)
 
+    def get_sig_part(m, short):
+        """
+        Return volume_number and manifest arguments for signature match m
+        """
+        if m.group("kind") in ["si", "sigindex"]:
+            return {"manifest": True}
+        elif m.group("num"):
+            return {"volume_number": get_vol_num(m.group("num"), short)}
+        else:
+            return {}
+
     def check_full():
         """
         Return ParseResults if file is from full backup, None otherwise
@@ -365,7 +407,8 @@ def parse(filename):
             t = str2time(m.group("time"), short)
             if t:
                 return ParseResults("full-sig", time=t,
-                                    partial=(m.group("partial") is not None))
+                                    partial=(m.group("partial") is not None),
+                                    **get_sig_part(m, short))
             else:
                 return None
 
@@ -379,24 +422,33 @@ def parse(filename):
             t2 = str2time(m.group("end_time"), short)
             if t1 and t2:
                 return ParseResults("new-sig", start_time=t1, end_time=t2,
-                                    partial=(m.group("partial") is not None))
+                                    partial=(m.group("partial") is not None),
+                                    **get_sig_part(m, short))
         return None
 
     def set_encryption_or_compression(pr):
         """
         Set encryption and compression flags in ParseResults pr
         """
-        if (filename.endswith('.z') or
-                not globals.short_filenames and filename.endswith('gz')):
+        codec = compression.codec_from_filename(filename, globals.short_filenames)
+        if codec:
             pr.compressed = 1
+            pr.codec = codec.name
         else:
             pr.compressed = None
+            pr.codec = None
 
         if (filename.endswith('.g') or
                 not globals.short_filenames and filename.endswith('.gpg')):
             pr.encrypted = 1
+            pr.aead = None
+        elif (filename.endswith(aead.short_suffix) or
+                not globals.short_filenames and filename.endswith(aead.suffix)):
+            pr.encrypted = 1
+            pr.aead = 1
         else:
             pr.encrypted = None
+            pr.aead = None
 
     pr = check_full()
     if not pr:
@@ -415,7 +467,8 @@ class ParseResults:
     """
     def __init__(self, type, manifest=None, volume_number=None,
                  time=None, start_time=None, end_time=None,
-                 encrypted=None, compressed=None, partial=False):
+                 encrypted=None, compressed=None, partial=False, codec=None,
+                 aead=None):
 
         assert type in ["full-sig", "new-sig", "inc", "full"]
 
@@ -432,8 +485,10 @@ class ParseResults:
         self.time = time
         self.start_time, self.end_time = start_time, end_time
 
-        self.compressed = compressed  # true if gzip compressed
-        self.encrypted = encrypted  # true if gpg encrypted
+        self.compressed = compressed  # true if compressed
+        self.codec = codec  # name of compression codec if compressed
+        self.encrypted = encrypted  # true if gpg or aead encrypted
+        self.aead = aead  # true if encrypted with duplicity.aead
 
         self.partial = partial
 
@@ -443,4 +498,5 @@ class ParseResults:
             self.time == other.time and \
             self.start_time == other.start_time and \
             self.end_time == other.end_time and \
+            self.volume_number == other.volume_number and \
             self.partial == other.partial
@@ -93,6 +93,10 @@ gpg_options = ''
 # Maximum file blocksize
 max_blocksize = 2048
 
+# If true, choose the block size of each file's signature from its size,
+# type and last delta, see blocksize.py, instead of by max_blocksize
+adaptive_blocksize = False
+
 # If true, filelists and directory statistics will be split on
 # nulls instead of newlines.
 null_separator = None
@@ -116,6 +120,12 @@ lockfile = None
 # source directory doesn't match previous backup source directory.
 allow_source_mismatch = None
 
+# How to tell that a changed file was only appended to, so that only the
+# new data is read: "sample" compares some of its blocks with their old
+# checksums, "size" trusts that a file which grew was appended to, and
+# None reads all of every changed file
+append_only_check = None
+
 # If set, abort if cannot do an incremental backup.  Otherwise if
 # signatures not found, default to full.
 incremental = None
@@ -156,9 +166,36 @@ encryption = True
 # If set to false, then do not compress files on remote system
 compression = True
 
+# If set, encrypt symmetrically in-process instead of calling gpg
+aead_encryption = False
+
+# AEAD cipher used with aead_encryption
+aead_cipher = "aes-256-gcm"
+
+# Number of chunks encrypted or decrypted at once with aead_encryption,
+# 0 for one per CPU
+aead_threads = 0
+
+# Codec used to compress unencrypted volumes, signatures and manifests
+compression_codec = "gzip"
+
+# Compression level, or None for the codec's default
+compression_level = None
+
+# Number of compression threads for codecs that support them (zstd).
+# 0 compresses in the calling thread, -1 uses one thread per CPU.
+compression_threads = 0
+
+# Hash of each volume recorded in the manifest, one of gpg.hash_names
+volume_hash = "SHA1"
+
 # volume size. default 200M
 volsize = 200 * 1024 * 1024
 
+# If set, start a new signature part at the first checkpoint after
+# this many bytes of signatures.  0 writes one signature file.
+sig_part_size = 0
+
 # Working directory for the tempfile module. Defaults to /tmp on most systems.
 temproot = None
 
@@ -214,6 +251,10 @@ s3_multipart_minimum_chunk_size = 5 * 1024 * 1024
 # Maximum number of processes to use while doing a multipart upload to S3
 s3_multipart_max_procs = None
 
+# Upload the parts of multipart uploads to S3 with threads, rather than
+# with a process pool
+s3_multipart_threads = False
+
 # Maximum time to wait for a part to finish when doig a multipart upload to S3
 s3_multipart_max_timeout = None
 
@@ -265,6 +306,27 @@ ssl_cacert_file = None
 ssl_cacert_path = None
 ssl_no_check_certificate = False
 
+# File the wall and CPU time of each stage of the run is written to as
+# JSON, and how often in seconds it is rewritten during the run (0 only
+# writes it at the end)
+stage_times = None
+stage_times_interval = 0
+
+# Number of metadata files sync fetches into the archive dir at once
+sync_concurrency = 1
+
+# number of files, or batches of files, deleted at once
+delete_concurrency = 1
+
+# files larger than download_chunk_size are fetched in ranges of that
+# size, up to download_concurrency at once, by backends that can
+download_concurrency = 1
+download_chunk_size = 32 * 1024 * 1024
+
+# replicate copies files as they are, up to replicate_concurrency at once
+replicate_raw = False
+replicate_concurrency = 1
+
 # user added rsync options
 rsync_options = ""
 
@@ -310,6 +372,9 @@ par2_redundancy = 10
 # Verbatim par2 other options
 par2_options = ""
 
+# Compute Reed-Solomon recovery files in-process instead of with par2
+par2_native = False
+
 # Whether to enable gio backend
 use_gio = False
 
@@ -319,6 +384,9 @@ file_changed = None
 # delay (in seconds) before next operation after failure
 backend_retry_delay = 30
 
+# the delay doubles with each failed attempt, up to this many seconds
+backend_retry_max_delay = 300
+
 # default filesystem encoding
 # In Python 2 it seems that sys.getfilesystemencoding() will normally return
 # 'utf-8' or some other sane encoding, but will sometimes fail and return
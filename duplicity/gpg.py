@@ -30,22 +30,26 @@ import sys
 import types
 import tempfile
 import re
-import gzip
 import locale
 import platform
+import threading
 
+from duplicity import compression
 from duplicity import globals
 from duplicity import gpginterface
 from duplicity import log
+from duplicity import stagetimes
 from duplicity import tempdir
 from duplicity import util
 
 try:
     from hashlib import sha1
+    from hashlib import sha256
     from hashlib import md5
 except ImportError:
     from sha import new as sha1
     from md5 import new as md5
+    sha256 = None
 
 blocksize = 256 * 1024
 
@@ -116,7 +120,7 @@ class GPGFile:
     """
     File-like object that encrypts decrypts another file on the fly
     """
-    def __init__(self, encrypt, encrypt_path, profile):
+    def __init__(self, encrypt, encrypt_path, profile, hash_obj=None):
         """
         GPGFile initializer
 
@@ -128,6 +132,9 @@ class GPGFile:
 
         If passphrase is false, do not set passphrase - GPG program
         should prompt for it.
+
+        If hash_obj is given, it is updated with the encrypted data as
+        it is written to encrypt_path.
         """
         self.status_fp = None  # used to find signature
         self.closed = None  # set to true after file closed
@@ -135,6 +142,9 @@ class GPGFile:
         self.stderr_fp = tempfile.TemporaryFile(dir=tempdir.default().dir())
         self.name = encrypt_path
         self.byte_count = 0
+        self.output_byte_count = 0  # bytes gpg has written to encrypt_path
+        self.drain_thread = None
+        self.drain_error = None
 
         # Start GPG process - copied from GnuPGInterface docstring.
         gnupg = gpginterface.GnuPG()
@@ -197,17 +207,26 @@ class GPGFile:
                 gnupg.options.extra_args.append('--force-mdc')
             # Skip the passphrase if using the agent
             if globals.use_agent:
-                gnupg_fhs = ['stdin', ]
+                gnupg_fhs = ['stdin', 'stdout']
             else:
-                gnupg_fhs = ['stdin', 'passphrase']
+                gnupg_fhs = ['stdin', 'stdout', 'passphrase']
             p1 = gnupg.run(cmdlist, create_fhs=gnupg_fhs,
-                           attach_fhs={'stdout': encrypt_path.open("wb"),
-                                       'stderr': self.stderr_fp,
+                           attach_fhs={'stderr': self.stderr_fp,
                                        'logger': self.logger_fp})
             if not globals.use_agent:
                 p1.handles['passphrase'].write(passphrase)
                 p1.handles['passphrase'].close()
             self.gpg_input = p1.handles['stdin']
+            # gpg writes to a pipe that we drain into encrypt_path, so the
+            # size of the output is known without stat()ing the file.
+            outfp = encrypt_path.open("wb")
+            if hash_obj:
+                outfp = HashedFile(outfp, hash_obj)
+            self.drain_thread = threading.Thread(target=self.drain_output,
+                                                 name="gpgdrain%d" % p1.pid,
+                                                 args=(p1.handles['stdout'], outfp))
+            self.drain_thread.setDaemon(True)
+            self.drain_thread.start()
         else:
             if (profile.recipients or profile.hidden_recipients) and profile.encrypt_secring:
                 cmdlist.append('--secret-keyring')
@@ -231,23 +250,54 @@ class GPGFile:
         self.encrypt = encrypt
 
     def read(self, length=-1):
-        try:
-            res = self.gpg_output.read(length)
-            if res is not None:
-                self.byte_count += len(res)
-        except Exception:
-            self.gpg_failed()
+        with stagetimes.stage("gpg") as st:
+            try:
+                res = self.gpg_output.read(length)
+                if res is not None:
+                    self.byte_count += len(res)
+                    st.add(len(res))
+            except Exception:
+                self.gpg_failed()
         return res
 
     def write(self, buf):
-        try:
-            res = self.gpg_input.write(buf)
-            if res is not None:
-                self.byte_count += len(res)
-        except Exception:
-            self.gpg_failed()
+        with stagetimes.stage("gpg") as st:
+            try:
+                res = self.gpg_input.write(buf)
+                self.byte_count += len(buf)
+                st.add(len(buf))
+            except Exception:
+                self.gpg_failed()
         return res
 
+    def drain_output(self, gpg_output, outfp):
+        """
+        Copy encrypted output of gpg to outfp, counting bytes
+
+        Runs in its own thread for the lifetime of the gpg process.
+        """
+        try:
+            try:
+                fd = gpg_output.fileno()
+                while True:
+                    buf = os.read(fd, blocksize)
+                    if not buf:
+                        break
+                    outfp.write(buf)
+                    self.output_byte_count += len(buf)
+            finally:
+                gpg_output.close()
+                outfp.close()
+        except Exception as e:
+            self.drain_error = e
+
+    def get_output_size(self):
+        """
+        Return number of encrypted bytes written to disk so far
+        """
+        assert self.encrypt
+        return self.output_byte_count
+
     def tell(self):
         return self.byte_count
 
@@ -285,6 +335,10 @@ class GPGFile:
                 self.gpg_process.wait()
             except Exception:
                 self.gpg_failed()
+            self.drain_thread.join()
+            if self.drain_error:
+                raise GPGError(u"Failed writing gpg output to %s: %s" %
+                               (self.name.uc_name, util.uexc(self.drain_error)))
         else:
             res = 1
             while res:
@@ -334,14 +388,17 @@ class GPGFile:
 
 def GPGWriteFile(block_iter, filename, profile,
                  size=200 * 1024 * 1024,
-                 max_footer_size=16 * 1024):
+                 max_footer_size=16 * 1024,
+                 hash_obj=None):
     """
     Write GPG compressed file of given size
 
     This function writes a gpg compressed file by reading from the
-    input iter and writing to filename.  When it has read an amount
-    close to the size limit, it "tops off" the incoming data with
-    incompressible data, to try to hit the limit exactly.
+    input iter and writing to filename.  The size of the volume is
+    tracked by counting the encrypted bytes as gpg emits them, and
+    the volume is ended as soon as another block might not fit.  Then
+    it "tops off" the incoming data with incompressible data, to try
+    to hit the limit exactly.
 
     block_iter should have methods .next(size), which returns the next
     block of data, which should be at most size bytes long.  Also
@@ -352,6 +409,9 @@ def GPGWriteFile(block_iter, filename, profile,
     bytes_in bytes into gpg will result in bytes_out = bytes_in out.
     However, do assume that bytes_out <= bytes_in approximately.
 
+    If hash_obj is given, it is updated with everything written to
+    filename, which saves reading the volume again to hash it.
+
     Returns true if succeeded in writing until end of block_iter.
     """
 
@@ -360,26 +420,22 @@ def GPGWriteFile(block_iter, filename, profile,
 
     def top_off(bytes, file):
         """
-        Add bytes of incompressible data to to_gpg_fp
+        Add bytes of incompressible data to file
 
-        In this case we take the incompressible data from the
-        beginning of filename (it should contain enough because size
-        >> largest block size).
+        Random data, so the volume is not read again to get some.
         """
-        incompressible_fp = open(filename, "rb")
-        assert util.copyfileobj(incompressible_fp, file.gpg_input, bytes) == bytes
-        incompressible_fp.close()
-
-    def get_current_size():
-        return os.stat(filename).st_size
+        while bytes > 0:
+            data = os.urandom(min(bytes, blocksize))
+            file.write(data)
+            bytes -= len(data)
 
-    target_size = size - 50 * 1024  # fudge factor, compensate for gpg buffering
+    target_size = size - 70 * 1024  # fudge factor, gpg holds back up to ~70 KB of output
     data_size = target_size - max_footer_size
-    file = GPGFile(True, path.Path(filename), profile)
+    file = GPGFile(True, path.Path(filename), profile, hash_obj)
     at_end_of_blockiter = 0
     try:
         while True:
-            bytes_to_go = data_size - get_current_size()
+            bytes_to_go = data_size - file.get_output_size()
             if bytes_to_go < block_iter.get_read_size():
                 break
             try:
@@ -392,7 +448,7 @@ def GPGWriteFile(block_iter, filename, profile,
         file.write(block_iter.get_footer())
         if not at_end_of_blockiter:
             # don't pad last volume
-            cursize = get_current_size()
+            cursize = file.get_output_size()
             if cursize < target_size:
                 top_off(target_size - cursize, file)
         file.close()
@@ -403,17 +459,23 @@ def GPGWriteFile(block_iter, filename, profile,
         raise
 
 
-def GzipWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=True):
+def GzipWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=True,
+                  codec=None, hash_obj=None):
     """
-    Write gzipped compressed file of given size
+    Write compressed file of given size
 
-    This is like the earlier GPGWriteFile except it writes a gzipped
+    This is like the earlier GPGWriteFile except it writes a compressed
     file instead of a gpg'd file.  This function is somewhat out of
     place, because it doesn't deal with GPG at all, but it is very
     similar to GPGWriteFile so they might as well be defined together.
 
-    The input requirements on block_iter and the output is the same as
-    GPGWriteFile (returns true if wrote until end of block_iter).
+    codec is the name of the compression codec to use, or None for
+    the one selected with --compression-codec.  Despite the name of
+    the function it need not be gzip.
+
+    The input requirements on block_iter, hash_obj and the output are
+    the same as GPGWriteFile (returns true if wrote until end of
+    block_iter).
     """
     class FileCounted:
         """
@@ -428,14 +490,20 @@ def GzipWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=True):
             self.byte_count += len(buf)
             return result
 
+        def flush(self):
+            return self.fileobj.flush()
+
         def close(self):
             return self.fileobj.close()
 
-    file_counted = FileCounted(open(filename, "wb"))
+    outfp = open(filename, "wb")
+    if hash_obj:
+        outfp = HashedFile(outfp, hash_obj)
+    file_counted = FileCounted(outfp)
 
-    # if gzipped wrap with GzipFile else plain file out
+    # if gzipped wrap with the codec's compressor else plain file out
     if gzipped:
-        outfile = gzip.GzipFile(None, "wb", 6, file_counted)
+        outfile = compression.get_codec(codec).open_writer(file_counted)
     else:
         outfile = file_counted
     at_end_of_blockiter = 0
@@ -454,7 +522,8 @@ def GzipWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=True):
     return at_end_of_blockiter
 
 
-def PlainWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=False):
+def PlainWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=False,
+                   hash_obj=None):
     """
     Write plain uncompressed file of given size
 
@@ -466,30 +535,81 @@ def PlainWriteFile(block_iter, filename, size=200 * 1024 * 1024, gzipped=False):
     The input requirements on block_iter and the output is the same as
     GPGWriteFile (returns true if wrote until end of block_iter).
     """
-    return GzipWriteFile(block_iter, filename, size, gzipped)
+    return GzipWriteFile(block_iter, filename, size, gzipped, hash_obj=hash_obj)
 
 
-def get_hash(hash, path, hex=1):
+hash_names = ["MD5", "SHA1", "SHA256", "BLAKE2B"]
+
+
+def get_hash_obj(hash):
     """
-    Return hash of path
+    Return new hash object of type hash, one of hash_names
 
-    hash should be "MD5" or "SHA1".  The output will be in hexadecimal
-    form if hex is true, and in text (base64) otherwise.
+    BLAKE2B needs python 3.6 or the pyblake2 module, GPGError is
+    raised if neither is there.
     """
-    # assert path.isreg()
-    fp = path.open("rb")
     if hash == "SHA1":
-        hash_obj = sha1()
+        return sha1()
     elif hash == "MD5":
-        hash_obj = md5()
+        return md5()
+    elif hash == "SHA256" and sha256:
+        return sha256()
+    elif hash == "BLAKE2B":
+        try:
+            from hashlib import blake2b
+        except ImportError:
+            try:
+                from pyblake2 import blake2b
+            except ImportError:
+                raise GPGError(_("The BLAKE2B hash requires the pyblake2 module"))
+        return blake2b()
     else:
         assert 0, "Unknown hash %s" % (hash,)
 
-    while 1:
-        buf = fp.read(blocksize)
-        if not buf:
-            break
-        hash_obj.update(buf)
+
+class HashedFile:
+    """
+    Wrapper around file object that hashes the data written to it
+    """
+    def __init__(self, fileobj, hash_obj):
+        self.fileobj = fileobj
+        self.hash_obj = hash_obj
+        self.name = getattr(fileobj, "name", None)
+
+    def write(self, buf):
+        with stagetimes.stage("hash") as st:
+            self.hash_obj.update(buf)
+            st.add(len(buf))
+        return self.fileobj.write(buf)
+
+    def flush(self):
+        return self.fileobj.flush()
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        return self.fileobj.close()
+
+
+def get_hash(hash, path, hex=1):
+    """
+    Return hash of path
+
+    hash should be one of hash_names.  The output will be in
+    hexadecimal form if hex is true, and in text (base64) otherwise.
+    """
+    # assert path.isreg()
+    fp = path.open("rb")
+    hash_obj = get_hash_obj(hash)
+
+    with stagetimes.stage("hash") as st:
+        while 1:
+            buf = fp.read(blocksize)
+            if not buf:
+                break
+            hash_obj.update(buf)
+            st.add(len(buf))
     assert not fp.close()
     if hex:
         return hash_obj.hexdigest()
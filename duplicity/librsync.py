@@ -30,6 +30,7 @@ import os
 from . import _librsync
 import types
 import array
+import struct
 
 if os.environ.get('READTHEDOCS') == 'True':
     import mock
@@ -38,6 +39,15 @@ if os.environ.get('READTHEDOCS') == 'True':
 
 blocksize = _librsync.RS_JOB_BLOCKSIZE
 
+# Parts of the librsync file formats, see doc/format.md in librsync
+RS_DELTA_MAGIC = 0x72730236
+RS_OP_END = 0x00
+RS_OP_LITERAL_N1 = 0x41
+RS_OP_LITERAL_N4 = 0x43
+RS_OP_COPY_N1_N1 = 0x45
+RS_OP_COPY_N8_N8 = 0x54
+sig_header_len = 12  # magic, block length and strong sum length
+
 
 class librsyncError(Exception):
     """Signifies error in internal librsync processing (bad signature, etc.)
@@ -161,6 +171,127 @@ class DeltaFile(LikeFile):
             raise librsyncError(str(e))
 
 
+class AppendDeltaMaker:
+    """Makes a delta copying a prefix of the basis file and adding data
+
+    Has the cycle() method of the _librsync makers, but produces the
+    delta in python: it copies the first prefix_len bytes of the basis
+    file and appends everything it is given as literal data.
+
+    """
+    def __init__(self, prefix_len):
+        self.header = struct.pack(">IBQQ", RS_DELTA_MAGIC, RS_OP_COPY_N8_N8,
+                                  0, prefix_len)
+
+    def cycle(self, inbuf):
+        """Return (eof, bytes of inbuf used, output) like _librsync makers"""
+        header, self.header = self.header, ""
+        if not inbuf:
+            return (1, 0, header + chr(RS_OP_END))
+        return (0, len(inbuf),
+                header + struct.pack(">BI", RS_OP_LITERAL_N4, len(inbuf)) + inbuf)
+
+
+class AppendDeltaFile(LikeFile):
+    """File-like object which generates the delta of an appended file
+
+    The new file is the first prefix_len bytes of the basis file
+    followed by what is read from new_file, so only those bytes are
+    read, and no signature is needed.
+
+    """
+    def __init__(self, prefix_len, new_file):
+        LikeFile.__init__(self, new_file)
+        self.maker = AppendDeltaMaker(prefix_len)
+
+
+def get_sig_blocks(sig_string):
+    """Return (block length, entry length, number of blocks) of signature
+
+    The signature starts with a header of sig_header_len bytes, and
+    has an entry of the weak and strong checksum of each block.
+
+    """
+    if len(sig_string) < sig_header_len:
+        raise librsyncError("Signature too short")
+    magic, block_len, strong_len = struct.unpack(">III", sig_string[:sig_header_len])
+    entry_len = 4 + strong_len
+    num_blocks, rest = divmod(len(sig_string) - sig_header_len, entry_len)
+    if rest or not block_len:
+        raise librsyncError("Bad signature length")
+    return block_len, entry_len, num_blocks
+
+
+class DeltaStats:
+    """Counts what a delta copies and what it adds as it is read
+
+    Give the delta to update() in pieces of any size.  Only the
+    commands are parsed, the literal data is skipped.  literal_runs
+    is the number of places the new file differs from the old one,
+    as each ends up as literal commands between two copies.
+
+    """
+    param_lens = [1, 2, 4, 8]
+    param_formats = {1: ">B", 2: ">H", 4: ">I", 8: ">Q"}
+
+    def __init__(self):
+        self.pending = ""
+        self.skip = 4  # the magic number
+        self.ended = False
+        self.in_literal = False
+        self.literal_runs = 0
+        self.literal_bytes = 0
+        self.copy_bytes = 0
+
+    def get_param(self, buf, pos, length):
+        return struct.unpack(self.param_formats[length], buf[pos:pos + length])[0]
+
+    def update(self, buf):
+        """Parse the next piece of the delta"""
+        if self.ended:
+            return
+        if self.pending:
+            buf = self.pending + buf
+            self.pending = ""
+        pos, end = 0, len(buf)
+        while pos < end:
+            if self.skip:
+                n = min(self.skip, end - pos)
+                self.skip -= n
+                pos += n
+                continue
+            op = ord(buf[pos])
+            if op == RS_OP_END:
+                self.ended = True
+                break
+            if op < RS_OP_LITERAL_N1:
+                cmd_len = 1
+            elif op < RS_OP_COPY_N1_N1:
+                cmd_len = 1 + self.param_lens[op - RS_OP_LITERAL_N1]
+            elif op <= RS_OP_COPY_N8_N8:
+                where_len, len_len = [self.param_lens[i] for i in divmod(op - RS_OP_COPY_N1_N1, 4)]
+                cmd_len = 1 + where_len + len_len
+            else:
+                raise librsyncError("Unknown delta command %d" % op)
+            if pos + cmd_len > end:
+                self.pending = buf[pos:]
+                break
+            if op < RS_OP_COPY_N1_N1:
+                if op < RS_OP_LITERAL_N1:
+                    length = op
+                else:
+                    length = self.get_param(buf, pos + 1, cmd_len - 1)
+                if not self.in_literal:
+                    self.literal_runs += 1
+                    self.in_literal = True
+                self.literal_bytes += length
+                self.skip = length
+            else:
+                self.copy_bytes += self.get_param(buf, pos + 1 + where_len, len_len)
+                self.in_literal = False
+            pos += cmd_len
+
+
 class PatchedFile(LikeFile):
     """File-like object which applies a librsync delta incrementally"""
     def __init__(self, basis_file, delta_file):
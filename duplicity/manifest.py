@@ -23,6 +23,7 @@
 
 from future_builtins import filter
 
+import os
 import re
 
 from duplicity import globals
@@ -326,7 +327,9 @@ class VolumeInfo:
 
     def set_hash(self, hash_name, data):
         """
-        Set the value of hash hash_name (e.g. "MD5") to data
+        Set the value of hash hash_name (e.g. "SHA1" or "SHA256") to data
+
+        hash_name is normally one of gpg.hash_names.
         """
         self.hashes[hash_name] = data
 
@@ -334,19 +337,15 @@ class VolumeInfo:
         """
         Return pair (hash_type, hash_data)
 
-        SHA1 is the best hash, and MD5 is the second best hash.  None
-        is returned if no hash is available.
+        The strongest hash is returned, trying BLAKE2B, SHA256, SHA1
+        and MD5 in that order.  None is returned if no hash is
+        available.
         """
         if not self.hashes:
             return None
-        try:
-            return ("SHA1", self.hashes['SHA1'])
-        except KeyError:
-            pass
-        try:
-            return ("MD5", self.hashes['MD5'])
-        except KeyError:
-            pass
+        for hash_name in ("BLAKE2B", "SHA256", "SHA1", "MD5"):
+            if hash_name in self.hashes:
+                return (hash_name, self.hashes[hash_name])
         return self.hashes.items()[0]
 
     def to_string(self):
@@ -471,6 +470,196 @@ class VolumeInfo:
             return self.start_index <= index_prefix <= self.end_index
 
 
+class SummaryCache:
+    """
+    Summaries of local manifests, kept in the archive dir between runs
+
+    The cache is a text file with an entry for each manifest: a line
+    "Manifest <filename> <mtime> <size> <length>" followed by length
+    bytes of the manifest as Manifest.to_string() writes it, which
+    leaves out the list of changed files unless --file-changed was
+    given.  Entries are only used while the manifest file has the
+    mtime and size it had when cached, and the cache is not used at
+    all with --file-changed.
+    """
+    def __init__(self, dirpath):
+        """
+        Load the cache of archive dir dirpath, or start an empty one
+        """
+        self.dirpath = dirpath
+        self.path = dirpath.append("manifest-cache")
+        self.entries = {}  # filename -> ((mtime, size), manifest text)
+        self.changed = False
+        try:
+            fp = open(self.path.name, "rb")
+            try:
+                self.entries = self.from_string(fp.read())
+            finally:
+                fp.close()
+        except Exception:
+            # no cache yet, or one we cannot read; it is only a cache
+            self.entries = {}
+
+    def from_string(self, s):
+        """
+        Return entries parsed from the cache file contents s
+        """
+        entries = {}
+        pos = 0
+        while pos < len(s):
+            end = s.index("\n", pos)
+            fields = s[pos:end].split(" ")
+            if len(fields) != 5 or fields[0] != "Manifest":
+                raise ManifestError("Bad manifest cache entry %s" % (fields,))
+            start, end = end + 1, end + 1 + int(fields[4])
+            entries[Unquote(fields[1])] = ((float(fields[2]), int(fields[3])), s[start:end])
+            pos = end
+        return entries
+
+    def to_string(self):
+        """
+        Return contents of the cache file
+        """
+        result = []
+        for filename, ((mtime, size), text) in sorted(self.entries.items()):
+            result.append("Manifest %s %r %d %d\n%s" %
+                          (Quote(filename), mtime, size, len(text), text))
+        return "".join(result)
+
+    def get_key(self, manifest_path):
+        return (manifest_path.stat.st_mtime, manifest_path.stat.st_size)
+
+    def get(self, manifest_path):
+        """
+        Return Manifest of manifest_path from the cache, or None
+        """
+        if globals.file_changed is not None:
+            return None
+        entry = self.entries.get(manifest_path.get_filename())
+        if entry and entry[0] == self.get_key(manifest_path):
+            return Manifest().from_string(entry[1])
+        return None
+
+    def put(self, manifest_path, manifest):
+        """
+        Cache Manifest manifest read from manifest_path
+        """
+        if globals.file_changed is not None:
+            return
+        self.entries[manifest_path.get_filename()] = (self.get_key(manifest_path),
+                                                      manifest.to_string())
+        self.changed = True
+
+    def save(self):
+        """
+        Write the cache back if it changed, dropping entries of removed files
+        """
+        if not self.changed:
+            return
+        for filename in list(self.entries.keys()):
+            if not self.dirpath.append(filename).exists():
+                del self.entries[filename]
+        tmpname = self.path.name + ".new"
+        fp = open(tmpname, "wb")
+        fp.write(self.to_string())
+        fp.close()
+        os.rename(tmpname, self.path.name)
+        self.changed = False
+
+
+_summary_cache = None
+
+
+def get_summary_cache():
+    """
+    Return the SummaryCache of globals.archive_dir_path
+    """
+    global _summary_cache
+    if (not _summary_cache or
+            _summary_cache.dirpath.name != globals.archive_dir_path.name):
+        _summary_cache = SummaryCache(globals.archive_dir_path)
+    return _summary_cache
+
+
+def save_summary_cache():
+    """
+    Save the SummaryCache if one was used
+    """
+    if _summary_cache:
+        try:
+            _summary_cache.save()
+        except (IOError, OSError) as e:
+            log.Warn(_("Unable to save manifest cache: %s") % util.uexc(e))
+
+
+class SigIndex:
+    """
+    Where the parts of a signature split by --sig-part-size start
+
+    Parts are cut between signature entries, and the entries are in
+    index order, so a part holds the entries from its own starting
+    index up to the one of the next part.
+    """
+    def __init__(self):
+        self.part_dict = {}  # part number -> index of first entry
+
+    def add_part(self, part_number, index):
+        """
+        Record that the entries of part part_number start at index
+        """
+        self.part_dict[part_number] = index
+
+    def get_parts(self, index_prefix):
+        """
+        Return sorted part numbers which may hold entries under index_prefix
+        """
+        part_nums = sorted(self.part_dict.keys())
+        result = []
+        for i in range(len(part_nums)):
+            start_index = self.part_dict[part_nums[i]]
+            if start_index[:len(index_prefix)] > index_prefix:
+                break
+            if (i + 1 < len(part_nums) and
+                    self.part_dict[part_nums[i + 1]] <= index_prefix):
+                continue
+            result.append(part_nums[i])
+        return result
+
+    def to_string(self):
+        """
+        Return string version of self, one line per part
+        """
+        slist = []
+        for part_number in sorted(self.part_dict.keys()):
+            index = self.part_dict[part_number]
+            if index:
+                index_string = Quote("/".join(index))
+            else:
+                index_string = "."
+            slist.append("Part %d %s\n" % (part_number, index_string))
+        return "".join(slist)
+
+    __str__ = to_string
+
+    def from_string(self, s):
+        """
+        Initialize self from string s as created by to_string
+        """
+        for line in s.split("\n"):
+            if not line:
+                continue
+            m = re.search("^Part ([0-9]+) (\\S+)$", line, re.I)
+            if not m:
+                raise ManifestError("Bad signature index line '%s'" % (line,))
+            index_string = Unquote(m.group(2))
+            if index_string == ".":
+                index = ()
+            else:
+                index = tuple(index_string.split("/"))
+            self.add_part(int(m.group(1)), index)
+        return self
+
+
 nonnormal_char_re = re.compile("(\\s|[\\\\\"'])")
 
 
@@ -32,6 +32,7 @@ from duplicity import librsync  # @UnusedImport
 from duplicity import log  # @UnusedImport
 from duplicity import diffdir
 from duplicity import selection
+from duplicity import stagetimes
 from duplicity import tempdir
 from duplicity import util  # @UnusedImport
 from duplicity.path import *  # @UnusedWildImport
@@ -139,6 +140,7 @@ def difftar2path_iter(diff_tarfile):
                 multivol_fileobj = Multivol_Filelike(diff_tarfile, tar_iter,
                                                      tarinfo_list, index)
                 ropath.setfileobj(multivol_fileobj)
+                ropath.sparse = multivol_fileobj.sparse
                 yield ropath
                 continue  # Multivol_Filelike will reset tarinfo_list
             else:
@@ -150,7 +152,7 @@ def difftar2path_iter(diff_tarfile):
 def get_index_from_tarinfo(tarinfo):
     """Return (index, difftype, multivol) pair from tarinfo object"""
     for prefix in ["snapshot/", "diff/", "deleted/",
-                   "multivol_diff/", "multivol_snapshot/"]:
+                   "multivol_diff/", "multivol_snapshot/", "multivol_sparse/"]:
         tiname = util.get_tarinfo_name(tarinfo)
         if tiname.startswith(prefix):
             name = tiname[len(prefix):]  # strip prefix
@@ -161,7 +163,7 @@ def get_index_from_tarinfo(tarinfo):
                     difftype = "snapshot"
                 multivol = 1
                 name, num_subs = \
-                    re.subn("(?s)^multivol_(diff|snapshot)/?(.*)/[0-9]+$",
+                    re.subn("(?s)^multivol_(diff|snapshot|sparse)/?(.*)/[0-9]+$",
                             "\\2", tiname)
                 if num_subs != 1:
                     raise PatchDirException(u"Unrecognized diff entry %s" %
@@ -200,9 +202,21 @@ class Multivol_Filelike:
         self.index = index
         self.buffer = ""
         self.at_end = 0
+        # Sparse snapshots leave out blocks of zeros, so a gap in the
+        # block numbers is a hole of that many blocks
+        self.sparse = util.get_tarinfo_name(tarinfo_list[0]).startswith("multivol_sparse/")
+        self.next_block = 1
+        self.hole_size = 0
+        self.zero_block = "\0" * diffdir.read_size
 
     def read(self, length=-1):
         """Read length bytes from file"""
+        if not self.buffer and 0 < length <= self.hole_size:
+            # don't build up large holes in the buffer
+            self.hole_size -= length
+            if length == len(self.zero_block):
+                return self.zero_block
+            return "\0" * length
         if length < 0:
             while self.addtobuffer():
                 pass
@@ -219,6 +233,11 @@ class Multivol_Filelike:
 
     def addtobuffer(self):
         """Add next chunk to buffer"""
+        if self.hole_size:
+            size = min(self.hole_size, len(self.zero_block))
+            self.buffer += self.zero_block[:size]
+            self.hole_size -= size
+            return 1
         if self.at_end:
             return None
         index, difftype, multivol = get_index_from_tarinfo(  # @UnusedVariable
@@ -229,6 +248,15 @@ class Multivol_Filelike:
             self.at_end = 1
             return None
 
+        if self.sparse:
+            tiname = util.get_tarinfo_name(self.tarinfo_list[0])
+            block = int(tiname.rsplit("/", 1)[1])
+            if block > self.next_block:
+                self.hole_size = (block - self.next_block) * diffdir.read_size
+                self.next_block = block
+                return self.addtobuffer()
+            self.next_block = block + 1
+
         fp = self.tf.extractfile(self.tarinfo_list[0])
         self.buffer += fp.read()
         fp.close()
@@ -243,6 +271,7 @@ class Multivol_Filelike:
 
     def close(self):
         """If not at end, read remaining data"""
+        self.hole_size = 0
         if not self.at_end:
             while 1:
                 self.buffer = ""
@@ -611,4 +640,7 @@ class ROPath_IterWriter(ITRBranch):
     def fast_process(self, index, ropath):
         """Write non-directory ropath to destination"""
         if ropath.exists():
-            ropath.copy(self.base_path.new_index(index))
+            with stagetimes.stage("patch") as st:
+                ropath.copy(self.base_path.new_index(index))
+                if ropath.isreg():
+                    st.add(ropath.getsize())
@@ -33,11 +33,12 @@ import errno
 import socket
 import time
 import re
-import gzip
 import shutil
 import sys
 
 from duplicity import tarfile
+from duplicity import aead
+from duplicity import compression
 from duplicity import file_naming
 from duplicity import globals
 from duplicity import gpg
@@ -50,6 +51,12 @@ from duplicity.lazy import *  # @UnusedWildImport
 
 _copy_blocksize = 64 * 1024
 _tmp_path_counter = 1
+_zero_block = "\0" * _copy_blocksize
+
+# lseek() whence values for finding data and holes in sparse files,
+# missing from the os module before python 3.3
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
 
 
 class StatResult:
@@ -76,6 +83,7 @@ class ROPath:
         self.index = index
         self.stat, self.type = None, None
         self.mode, self.devnums = None, None
+        self.sparse = None
 
     def set_from_stat(self):
         """Set the value of self.type, self.mode from self.stat"""
@@ -443,7 +451,7 @@ class ROPath:
     def copy(self, other):
         """Copy self to other.  Also copies data.  Other must be Path"""
         if self.isreg():
-            other.writefileobj(self.open("rb"))
+            other.writefileobj(self.open("rb"), self.sparse)
         elif self.isdir():
             os.mkdir(other.name)
         elif self.issym():
@@ -566,6 +574,18 @@ class Path(ROPath):
         """Return true if path is a directory and is empty"""
         return self.isdir() and not self.listdir()
 
+    def issparse(self):
+        """True if self is a regular file with unallocated blocks"""
+        return (self.isreg() and hasattr(self.stat, "st_blocks") and
+                self.stat.st_blocks * 512 < self.stat.st_size)
+
+    def open_sparse(self):
+        """Like open("rb"), but skip reading the holes of sparse files"""
+        fp = self.open("rb")
+        if not self.fileobj and self.issparse():
+            fp = SparseFile(fp, self.getsize())
+        return fp
+
     def open(self, mode="rb"):
         """
         Return fileobj associated with self
@@ -633,14 +653,25 @@ class Path(ROPath):
             else:
                 return Path("/".join(components[:-1]))
 
-    def writefileobj(self, fin):
-        """Copy file object fin to self.  Close both when done."""
+    def writefileobj(self, fin, sparse=None):
+        """Copy file object fin to self.  Close both when done.
+
+        If sparse is set, blocks of zeros are seeked over instead of
+        written, so they end up as holes in the new file.
+        """
         fout = self.open("wb")
+        size = 0
         while 1:
             buf = fin.read(_copy_blocksize)
             if not buf:
                 break
-            fout.write(buf)
+            size += len(buf)
+            if sparse and buf == _zero_block:
+                fout.seek(size)
+            else:
+                fout.write(buf)
+        if sparse:
+            fout.truncate(size)
         if fin.close() or fout.close():
             raise PathException("Error closing file object")
         self.setdata()
@@ -747,6 +778,74 @@ class Path(ROPath):
             return "."
 
 
+class SparseFile:
+    """
+    Read only file object which doesn't read the holes of a sparse file
+
+    Data extents are found with SEEK_DATA/SEEK_HOLE, and reads inside
+    a hole return zeros without touching the disk.  If the filesystem
+    can't report holes, the whole file is read as data.
+    """
+    def __init__(self, fileobj, size):
+        """SparseFile initializer, size is the length of the file"""
+        self.fileobj = fileobj
+        self.size = size
+        self.offset = 0  # logical position in the file
+        self.file_offset = 0  # position of fileobj
+        self.data_start = 0  # current data extent, data_end None means EOF
+        self.data_end = 0
+
+    def find_extent(self):
+        """Set data_start and data_end to the next extent after offset"""
+        fd = self.fileobj.fileno()
+        try:
+            self.data_start = os.lseek(fd, self.offset, SEEK_DATA)
+            self.data_end = os.lseek(fd, self.data_start, SEEK_HOLE)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # only a hole is left before the end of the file
+                self.data_start = max(self.offset, self.size)
+            else:
+                # no hole support, just read from here on
+                self.data_start = self.offset
+            self.data_end = None
+
+    def read(self, length=-1):
+        """Read length bytes, all of the rest if length is negative"""
+        if length < 0:
+            return "".join(iter(lambda: self.read(_copy_blocksize), ""))
+
+        bufs = []
+        while length > 0:
+            if self.data_end is not None and self.offset >= self.data_end:
+                self.find_extent()
+            if self.offset < self.data_start:
+                size = min(length, self.data_start - self.offset)
+                if size == len(_zero_block):
+                    buf = _zero_block
+                else:
+                    buf = "\0" * size
+            else:
+                size = length
+                if self.data_end is not None:
+                    size = min(size, self.data_end - self.offset)
+                if self.file_offset != self.offset:
+                    self.fileobj.seek(self.offset)
+                buf = self.fileobj.read(size)
+                self.file_offset = self.offset + len(buf)
+                if not buf:
+                    break
+            bufs.append(buf)
+            self.offset += len(buf)
+            length -= len(buf)
+        if len(bufs) == 1:
+            return bufs[0]
+        return "".join(bufs)
+
+    def close(self):
+        return self.fileobj.close()
+
+
 class DupPath(Path):
     """
     Represent duplicity data files
@@ -771,27 +870,40 @@ class DupPath(Path):
 
         Path.__init__(self, base, index)
 
-    def filtered_open(self, mode="rb", gpg_profile=None):
+    def filtered_open(self, mode="rb", gpg_profile=None, hash_obj=None):
         """
         Return fileobj with appropriate encryption/compression
 
         If encryption is specified but no gpg_profile, use
-        globals.default_profile.
+        globals.default_profile.  If hash_obj is given, it is updated
+        with the data written to the file itself, i.e. after
+        encryption, so the volume need not be read again to hash it.
         """
         assert not self.opened and not self.fileobj
         assert not (self.pr.encrypted and self.pr.compressed)
         if gpg_profile:
             assert self.pr.encrypted
+        assert not hash_obj or mode == "wb"
 
         if self.pr.compressed:
-            return gzip.GzipFile(self.name, mode)
+            codec = compression.get_codec(self.pr.codec)
+            if not hash_obj:
+                return codec.open(self.name, mode)
+            return codec.open_writer(gpg.HashedFile(self.open(mode), hash_obj),
+                                     closefd=True)
+        elif self.pr.aead:
+            if not gpg_profile:
+                gpg_profile = globals.gpg_profile
+            return aead.open_file(self, mode, gpg_profile.passphrase, hash_obj)
         elif self.pr.encrypted:
             if not gpg_profile:
                 gpg_profile = globals.gpg_profile
             if mode == "rb":
-                return gpg.GPGFile(False, self, gpg_profile)
+                return gpg.GPGFile(False, self, gpg_profile, hash_obj)
             elif mode == "wb":
-                return gpg.GPGFile(True, self, gpg_profile)
+                return gpg.GPGFile(True, self, gpg_profile, hash_obj)
+        elif hash_obj:
+            return gpg.HashedFile(self.open(mode), hash_obj)
         else:
             return self.open(mode)
 
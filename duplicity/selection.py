@@ -91,6 +91,7 @@ class Select:
         self.selection_functions = []
         self.rootpath = path
         self.prefix = self.rootpath.uc_name
+        self.skip_index = None
 
     def set_iter(self):
         u"""Initialize generator, prepare to iterate."""
@@ -101,6 +102,16 @@ class Select:
         self.__iter__ = lambda: self
         return self
 
+    def skip_before(self, index):
+        u"""Don't look at paths that sort, with everything below them, before index
+
+        Used when restarting a backup, where those have been saved
+        already.  The directories leading down to index are still
+        yielded.  Must be called before iteration gets that far.
+        """
+        # Externally-accessed method
+        self.skip_index = index
+
     def Iterate(self, path):
         u"""Return iterator yielding paths in path
 
@@ -140,6 +151,10 @@ class Select:
             # todo: get around circular dependency issue by importing here
             from duplicity import robust  # @Reimport
             for filename in robust.listpath(path):
+                if self.skip_index:
+                    sub_index = path.index + (filename,)
+                    if sub_index < self.skip_index[:len(sub_index)]:
+                        continue
                 new_path = robust.check_common_error(
                     error_handler, Path.append, (path, filename))
                 if new_path:
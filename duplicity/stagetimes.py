@@ -0,0 +1,270 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Wall and CPU time spent in each stage of a backup or restore
+
+The stages are timed with
+
+  with stagetimes.stage("gpg") as st:
+      fp.write(buf)
+      st.add(len(buf))
+
+Stages may be nested, e.g. reading a source file happens while its
+delta is computed, and then the time goes to the innermost one only,
+so the times of all stages of a thread add up to at most its run time.
+Threads are timed separately, so the stages of the upload thread and
+of the main thread overlap.
+
+Unless enable() has been called stage() returns a shared object that
+does nothing, so the timers can be left in the code for good.  While
+enabled each stage costs a few microseconds, which is little next to
+the 64KB blocks most stages handle at once.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+from duplicity import log
+
+# RUSAGE_THREAD is missing from the resource module of python 2
+if sys.platform.startswith(u"linux"):
+    RUSAGE_THREAD = getattr(resource, u"RUSAGE_THREAD", 1)
+else:
+    RUSAGE_THREAD = None
+
+enabled = False
+
+# name -> [wall seconds, cpu seconds, bytes, calls]
+totals = {}
+lock = threading.Lock()
+local = threading.local()
+start_time = None
+start_cpu = None
+writer_thread = None
+
+
+def thread_cpu():
+    u"""Return CPU seconds used by this thread, or the process if unknown"""
+    if RUSAGE_THREAD is not None:
+        try:
+            usage = resource.getrusage(RUSAGE_THREAD)
+            return usage.ru_utime + usage.ru_stime
+        except (ValueError, resource.error):
+            pass
+    return time.clock()
+
+
+def process_cpu():
+    u"""Return CPU seconds used by the whole process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    u"""
+    Times one run of a stage, use as a context manager
+    """
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def add(self, nbytes):
+        u"""Count nbytes handled by this stage"""
+        self.bytes += nbytes
+
+    def pause(self, wall, cpu):
+        u"""Stop the clock while a nested stage runs"""
+        self.wall += wall - self.resumed_wall
+        self.cpu += cpu - self.resumed_cpu
+
+    def resume(self, wall, cpu):
+        self.resumed_wall = wall
+        self.resumed_cpu = cpu
+
+    def __enter__(self):
+        try:
+            stack = local.stack
+        except AttributeError:
+            stack = local.stack = []
+        wall, cpu = time.time(), thread_cpu()
+        if stack:
+            stack[-1].pause(wall, cpu)
+        stack.append(self)
+        self.resume(wall, cpu)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall, cpu = time.time(), thread_cpu()
+        self.pause(wall, cpu)
+        stack = local.stack
+        stack.pop()
+        if stack:
+            stack[-1].resume(wall, cpu)
+        with lock:
+            counters = totals.setdefault(self.name, [0.0, 0.0, 0, 0])
+            counters[0] += self.wall
+            counters[1] += self.cpu
+            counters[2] += self.bytes
+            counters[3] += 1
+        return False
+
+
+class NullStage:
+    u"""
+    Stands in for Stage when stage timing is off
+    """
+    def add(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_stage = NullStage()
+
+
+def stage(name):
+    u"""
+    Return context manager timing stage name, if enabled
+    """
+    if enabled:
+        return Stage(name)
+    return null_stage
+
+
+def timed_iter(name, iterator):
+    u"""
+    Return iterator yielding from iterator, timing each step as name
+    """
+    if not enabled:
+        return iterator
+
+    def timed():
+        while True:
+            with Stage(name):
+                try:
+                    elem = iterator.next()
+                except StopIteration:
+                    return
+            yield elem
+    return timed()
+
+
+def enable():
+    u"""
+    Start timing stages, discarding what was timed before
+    """
+    global enabled, start_time, start_cpu
+    with lock:
+        totals.clear()
+    start_time = time.time()
+    start_cpu = process_cpu()
+    enabled = True
+
+
+def get_times():
+    u"""
+    Return dictionary of the times and byte counts so far
+
+    Stage times are in seconds.  "elapsed" and "cpu" are the wall time
+    since enable() and the CPU time of the whole process in that time.
+    """
+    with lock:
+        stages = {}
+        for name, (wall, cpu, nbytes, calls) in totals.items():
+            stages[name] = {u"wall": round(wall, 6),
+                            u"cpu": round(cpu, 6),
+                            u"bytes": nbytes,
+                            u"calls": calls}
+    return {u"start": start_time,
+            u"elapsed": round(time.time() - start_time, 6),
+            u"cpu": round(process_cpu() - start_cpu, 6),
+            u"pid": os.getpid(),
+            u"stages": stages}
+
+
+def write(filename, final=True):
+    u"""
+    Write get_times() to filename as JSON
+
+    The file is replaced in one go, so whoever watches it never sees
+    it half written.  final is false for the periodic updates.
+    """
+    times = get_times()
+    times[u"final"] = final
+    tmpname = b"%s.%d.tmp" % (filename, os.getpid())
+    with open(tmpname, u"w") as fp:
+        json.dump(times, fp, indent=1, sort_keys=True)
+        fp.write(u"\n")
+    os.rename(tmpname, filename)
+
+
+class WriterThread(threading.Thread):
+    u"""
+    Background thread that writes the stage times every interval seconds
+    """
+    def __init__(self, filename, interval):
+        super(WriterThread, self).__init__()
+        self.setDaemon(True)
+        self.filename = filename
+        self.interval = interval
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            try:
+                write(self.filename, False)
+            except (IOError, OSError) as e:
+                log.Warn(_(u"Cannot write stage times to %s: %s") % (self.filename, e))
+
+
+def start(filename, interval=None):
+    u"""
+    Enable stage timing, writing the times to filename every interval
+    seconds if interval is given
+    """
+    global writer_thread
+    enable()
+    if interval:
+        writer_thread = WriterThread(filename, interval)
+        writer_thread.start()
+
+
+def finish(filename):
+    u"""
+    Stop the periodic writes and write the final stage times
+    """
+    global writer_thread
+    if writer_thread:
+        writer_thread.finished.set()
+        writer_thread.join()
+        writer_thread = None
+    try:
+        write(filename)
+    except (IOError, OSError) as e:
+        log.Warn(_(u"Cannot write stage times to %s: %s") % (filename, e))
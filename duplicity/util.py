@@ -241,3 +241,47 @@ def which(program):
                 return exe_file
 
     return None
+
+
+def run_concurrently(function, items, concurrency, pool=None, timeout=None):
+    """
+    Call function on each of items on threads, return the results in order
+
+    Up to concurrency calls are made at once on a new thread pool, or
+    on the threads of pool if given, which is left running.  Whatever
+    a call raises, SystemExit from log.FatalError too, is raised here
+    as soon as it is seen, as a pool thread would just die of it and
+    leave the caller waiting.  The calls not started by then are
+    dropped with a new pool; those queued on a given pool still run,
+    so function has to check whether they are still wanted.  If no
+    call ends within timeout seconds, multiprocessing.TimeoutError is
+    raised.  Without pool, calls are made in turn if concurrency is
+    below 2 or there is only one item.
+    """
+    items = list(items)
+    if not pool and (concurrency < 2 or len(items) < 2):
+        return [function(item) for item in items]
+
+    def call(i):
+        try:
+            return i, function(items[i]), None
+        except BaseException:
+            # with the traceback, which is where the call went wrong
+            return i, None, sys.exc_info()
+
+    own_pool = not pool
+    if own_pool:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(concurrency, len(items)))
+    results = [None] * len(items)
+    try:
+        calls = pool.imap_unordered(call, range(len(items)))
+        for n in range(len(items)):
+            i, result, exc_info = calls.next(timeout)
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            results[i] = result
+    finally:
+        if own_pool:
+            pool.terminate()
+    return results
@@ -41,5 +41,19 @@ class BadUploadTest(FunctionalTestCase):
         else:
             self.fail('Expected CmdError not thrown')
 
+    def test_missing_file_checkpoint(self):
+        """
+        Test lost file is noticed before the next volume is uploaded
+        """
+        self.make_largefiles(count=1, size=3)
+        try:
+            self.backup(u"full", u"testfiles/largefiles", options=[u"--skip-volume=1"])
+        except CmdError as e:
+            self.assertEqual(e.exit_status, 44, str(e))
+        else:
+            self.fail('Expected CmdError not thrown')
+        # the backup stopped at the checkpoint after volume 1
+        self.assertEqual([f for f in self.get_backend_files() if b".vol" in f], [])
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,6 +19,8 @@
 # along with duplicity; if not, write to the Free Software Foundation,
 # Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
+import glob
+import os
 import unittest
 
 from . import FunctionalTestCase
@@ -70,5 +72,22 @@ class CleanupTest(FunctionalTestCase):
         leftovers = self.get_backend_files()
         self.assertEqual(full1_files | full2_files, leftovers)
 
+    def test_resume_delete(self):
+        """
+        Test that a deletion cut short is finished by the next remove.
+        """
+        full1_files = self.backup(u"full", u"testfiles/empty_dir")
+        full2_files = self.backup(u"full", u"testfiles/empty_dir")
+        # as if a remove-all-but-n 1 was interrupted after one file
+        filenames = sorted(full1_files)
+        os.unlink(os.path.join(u"testfiles/output", filenames[0]))
+        journal = os.path.join(glob.glob(u"testfiles/cache/*")[0], u"delete-journal")
+        with open(journal, "wb") as fp:
+            fp.write("".join(f + "\n" for f in filenames))
+        self.run_duplicity(options=[u"remove-all-but-n", u"2", self.backend_url, u"--force"])
+        leftovers = self.get_backend_files()
+        self.assertEqual(full2_files, leftovers)
+        self.assertFalse(os.path.exists(journal))
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,6 +19,7 @@
 # along with duplicity; if not, write to the Free Software Foundation,
 # Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
+import glob
 import os
 import unittest
 
@@ -156,6 +157,21 @@ class FinalTest(FunctionalTestCase):
         self.run_duplicity(options=[u"remove-older-than", u"50000", u"--force", self.backend_url])
         self.assertEqual(self.get_backend_files(), second_chain)
 
+    def test_sync_concurrency(self):
+        """Test rebuilding a lost archive dir several files at once"""
+        self.backup(u"full", u"testfiles/dir1", current_time=10000)
+        self.backup(u"inc", u"testfiles/dir2", current_time=20000)
+        self.backup(u"inc", u"testfiles/dir3", current_time=30000)
+        cached = sorted(map(os.path.basename, glob.glob(u"testfiles/cache/*/duplicity-*")))
+        assert not os.system(u"rm -rf testfiles/cache")
+
+        self.run_duplicity(options=[u"list-current-files", u"--sync-concurrency", u"3",
+                                    self.backend_url])
+        synced = glob.glob(u"testfiles/cache/*/*")
+        self.assertEqual(cached, sorted(map(os.path.basename, synced)))
+        self.restore()
+        self.check_same(u"testfiles/dir3", u"testfiles/restore_out")
+
     def test_piped_password(self):
         """Make sure that prompting for a password works"""
         self.set_environ(u"PASSPHRASE", None)
@@ -72,6 +72,17 @@ class ReplicateTest(FunctionalTestCase):
         self.runtest([u"testfiles/dir1", u"testfiles/dir2"],
                      replicate_options=[u"--no-encryption"])
 
+    def test_replicate_raw(self):
+        """Test replication of files as they are"""
+        self.runtest([u"testfiles/dir1", u"testfiles/dir2"],
+                     replicate_options=[u"--replicate-raw", u"--replicate-concurrency", u"3"])
+        source = sorted(os.listdir(u"testfiles/output"))
+        target = sorted(os.listdir(u"testfiles/replicate_out"))
+        assert source == target, (source, target)
+        for filename in source:
+            assert open(os.path.join(u"testfiles/output", filename), u"rb").read() == \
+                open(os.path.join(u"testfiles/replicate_out", filename), u"rb").read(), filename
+
     def test_replicate_asym(self):
         """Test replication with reencryption"""
         asym_options = [u"--encrypt-key", self.encrypt_key1]
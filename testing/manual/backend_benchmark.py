@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Time duplicity against a simulated slow remote
+
+Usage: backend_benchmark.py [--shape query] [--volsize MB] [--keep]
+                            [source_dir] [-- duplicity options]
+
+The remote is a shaped+file:// backend in a temporary directory, slowed
+down as the query string given with --shape says, by default
+
+  latency=0.05&jitter=0.02&stream_bandwidth=4000000&bandwidth=16000000
+
+See duplicity/backends/shapedbackend.py for all parameters.  These
+scenarios are run one after the other, each with the options after --:
+
+  full       full backup of a copy of source_dir
+  inc        incremental backup after changing every tenth file
+  restore    restore of the latest backup
+  replicate  replicate of the backups to a second shaped remote
+
+Wall time is reported for each, together with the throughput in MB/s
+of the bytes it moved: the source read for full, the changed files for
+inc, the files restored, and the backup files replicated.  With no
+source_dir the python standard library is used.  Compare runs with e.g.
+"-- --async-concurrency 4" or "-- --download-concurrency 4" to tune
+the upload and download pipelines without a real remote.
+"""
+
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), u"..", u"..")
+
+default_shape = u"latency=0.05&jitter=0.02&stream_bandwidth=4000000&bandwidth=16000000"
+
+
+def tree_size(dirname):
+    u"""Return total size of the regular files under dirname"""
+    size = 0
+    for root, dirs, files in os.walk(dirname):
+        for name in files:
+            filename = os.path.join(root, name)
+            if os.path.isfile(filename) and not os.path.islink(filename):
+                size += os.path.getsize(filename)
+    return size
+
+
+def change_files(dirname):
+    u"""Append to every tenth file under dirname, return their total size"""
+    size = 0
+    count = 0
+    for root, dirs, files in os.walk(dirname):
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            if not os.path.isfile(filename) or os.path.islink(filename):
+                continue
+            count += 1
+            if count % 10 == 0:
+                with open(filename, u"ab") as fp:
+                    fp.write(os.urandom(1024))
+                size += os.path.getsize(filename)
+    return size
+
+
+def run_duplicity(args, options):
+    u"""Run duplicity with args and options, return seconds it took"""
+    env = dict(os.environ)
+    env[u"PYTHONPATH"] = top
+    cmd = [sys.executable, os.path.join(top, u"bin", u"duplicity")] + args + options
+    start = time.time()
+    subprocess.check_call(cmd, env=env)
+    return time.time() - start
+
+
+def main(argv):
+    if u"--" in argv:
+        options = argv[argv.index(u"--") + 1:]
+        argv = argv[:argv.index(u"--")]
+    else:
+        options = []
+    opts, args = getopt.getopt(argv, u"", [u"shape=", u"volsize=", u"keep"])
+    shape = default_shape
+    volsize = 25
+    keep = False
+    for opt, val in opts:
+        if opt == u"--shape":
+            shape = val
+        elif opt == u"--volsize":
+            volsize = int(val)
+        elif opt == u"--keep":
+            keep = True
+    if len(args) > 1:
+        sys.exit(__doc__)
+    if args:
+        source = args[0]
+    else:
+        source = os.path.dirname(os.__file__)
+
+    work = tempfile.mkdtemp(prefix=u"duplicity-bench-")
+    try:
+        data = os.path.join(work, u"data")
+        shutil.copytree(source, data, symlinks=True)
+        url = u"shaped+file://%s?%s" % (os.path.join(work, u"remote"), shape)
+        url2 = u"shaped+file://%s?%s" % (os.path.join(work, u"remote2"), shape)
+        options = [u"--no-encryption", u"--volsize", str(volsize),
+                   u"--archive-dir", os.path.join(work, u"archive"), u"--name", u"bench",
+                   u"-v", u"warning", u"--no-print-statistics"] + options
+
+        print(u"source: %s, remote: %s" % (source, shape))
+        print(u"%-10s %10s %10s %10s" % (u"scenario", u"seconds", u"MB", u"MB/s"))
+
+        def report(name, secs, size):
+            mb = size / (1024.0 * 1024.0)
+            print(u"%-10s %10.2f %10.1f %10.1f" % (name, secs, mb, mb / max(secs, 1e-6)))
+
+        report(u"full", run_duplicity([u"full", data, url], options), tree_size(data))
+        changed = change_files(data)
+        report(u"inc", run_duplicity([u"inc", data, url], options), changed)
+        restored = os.path.join(work, u"restored")
+        report(u"restore", run_duplicity([u"restore", url, restored], options), tree_size(restored))
+        report(u"replicate", run_duplicity([u"replicate", url, url2], options),
+               tree_size(os.path.join(work, u"remote")))
+    finally:
+        if keep:
+            print(u"kept %s" % work)
+        else:
+            shutil.rmtree(work)
+
+
+if __name__ == u"__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,252 @@
+#!/usr/bin/env python2
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Compare the fixed and the adaptive signature block sizes on a corpus
+
+Usage: blocksize_benchmark.py [--rounds N] [--scale X] [--seed N]
+                              [--limit MB] [corpus_dir]
+
+Each file of the corpus gets a signature, and then for a number of
+rounds it is changed, its delta against the last signature made and a
+new signature taken, like in a chain of incremental backups.  That is
+done once with the block sizes of --max-blocksize (the default) and
+once with those of --adaptive-blocksize, where the history of the
+earlier rounds is used as it would be by duplicity.
+
+Files are changed by their kind:
+
+  scattered  a few small overwrites anywhere, like a database
+  append     about 1% added at the end, like a mailbox or log
+  rewrite    everything after a random point in the second half
+             replaced, like a compressed file that was edited
+
+With no corpus_dir a synthetic corpus of each kind is generated, up to
+128MB of it times --scale.  Files copied from corpus_dir, up to --limit
+MB of them, are rewritten if they look compressed and get scattered
+changes otherwise.  Reported for each file and policy are the last
+block size, the bytes of all signatures and all deltas, and the CPU
+seconds taken by making them.
+"""
+
+import getopt
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), b"..", b".."))
+
+import __builtin__
+__builtin__._ = lambda s: s
+
+from duplicity import blocksize
+from duplicity import diffdir
+from duplicity import librsync
+from duplicity import util
+
+# file name, size, kind of the synthetic corpus
+synthetic = [
+    (b"notes.txt", 200 * 1024, u"scattered"),
+    (b"mail.mbox", 16 * 1024 * 1024, u"append"),
+    (b"small.db", 16 * 1024 * 1024, u"scattered"),
+    (b"large.db", 128 * 1024 * 1024, u"scattered"),
+    (b"photos.tar.gz", 16 * 1024 * 1024, u"rewrite"),
+]
+
+policies = [u"fixed", u"adaptive"]
+
+
+def cpu():
+    u"""Return CPU seconds used by this process"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def write_random(filename, size, mode=u"wb"):
+    u"""Write size random bytes to filename"""
+    with open(filename, mode) as fp:
+        while size > 0:
+            n = min(size, 1024 * 1024)
+            fp.write(os.urandom(n))
+            size -= n
+
+
+def make_corpus(work, scale):
+    u"""Write the synthetic corpus to work, return list of (name, kind)"""
+    files = []
+    for name, size, kind in synthetic:
+        write_random(os.path.join(work, name), int(size * scale))
+        files.append((name, kind))
+    return files
+
+
+def copy_corpus(source, work, limit):
+    u"""Copy files of source to work up to limit bytes, return list of (name, kind)"""
+    files = []
+    total = 0
+    for root, dirs, names in os.walk(source):
+        for name in sorted(names):
+            filename = os.path.join(root, name)
+            if not os.path.isfile(filename) or os.path.islink(filename):
+                continue
+            size = os.path.getsize(filename)
+            if not size or total + size > limit:
+                continue
+            new_name = b"%04d-%s" % (len(files), name)
+            shutil.copyfile(filename, os.path.join(work, new_name))
+            total += size
+            if blocksize.is_compressed((name,)):
+                files.append((new_name, u"rewrite"))
+            else:
+                files.append((new_name, u"scattered"))
+    return files
+
+
+def change(filename, kind, rnd):
+    u"""Change filename like a file of kind would change"""
+    size = os.path.getsize(filename)
+    if kind == u"append":
+        write_random(filename, max(size // 100, 4096), u"ab")
+        return
+    with open(filename, u"r+b") as fp:
+        if kind == u"scattered":
+            for i in range(20):
+                fp.seek(rnd.randrange(size))
+                fp.write(os.urandom(100))
+        else:
+            offset = rnd.randrange(size // 2, size)
+            fp.seek(offset)
+            fp.write(os.urandom(size - offset))
+
+
+def get_sig(filename, block_len):
+    u"""Return signature of filename"""
+    sfp = librsync.SigFile(open(filename, u"rb"), block_len)
+    sig = sfp.read()
+    sfp.close()
+    return sig
+
+
+def get_delta(sig, filename):
+    u"""Return length and librsync.DeltaStats of the delta of filename against sig"""
+    dfp = librsync.DeltaFile(sig, open(filename, u"rb"))
+    delta_stats = librsync.DeltaStats()
+    length = 0
+    while True:
+        buf = dfp.read(librsync.blocksize)
+        if not buf:
+            break
+        length += len(buf)
+        delta_stats.update(buf)
+    dfp.close()
+    return length, delta_stats
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv, u"", [u"rounds=", u"scale=", u"seed=", u"limit="])
+    rounds = 4
+    scale = 1.0
+    seed = 1
+    limit = 256 * 1024 * 1024
+    for opt, val in opts:
+        if opt == u"--rounds":
+            rounds = int(val)
+        elif opt == u"--scale":
+            scale = float(val)
+        elif opt == u"--seed":
+            seed = int(val)
+        elif opt == u"--limit":
+            limit = int(val) * 1024 * 1024
+    if len(args) > 1:
+        sys.exit(__doc__)
+
+    rnd = random.Random(seed)
+    work = tempfile.mkdtemp(prefix=b"duplicity-blocksize-")
+    try:
+        if args:
+            files = copy_corpus(args[0], work, limit)
+        else:
+            files = make_corpus(work, scale)
+
+        history = blocksize.History()
+        sigs = {}
+        # (policy, name) -> [block size, signature bytes, delta bytes, cpu seconds]
+        results = {}
+
+        def sign(policy, name, filename):
+            size = os.path.getsize(filename)
+            if policy == u"fixed":
+                block_len = diffdir.get_block_size(size)
+            else:
+                block_len = blocksize.get_block_size(size, (name,), history.get((name,)))
+            start = cpu()
+            sigs[policy, name] = sig = get_sig(filename, block_len)
+            result = results.setdefault((policy, name), [0, 0, 0, 0.0])
+            result[0] = block_len
+            result[1] += len(sig)
+            result[3] += cpu() - start
+
+        for name, kind in files:
+            for policy in policies:
+                sign(policy, name, os.path.join(work, name))
+
+        for i in range(rounds):
+            for name, kind in files:
+                filename = os.path.join(work, name)
+                change(filename, kind, rnd)
+                for policy in policies:
+                    old_sig = sigs[policy, name]
+                    # duplicity picks the new block size before the
+                    # delta is made, so record its history afterwards
+                    sign(policy, name, filename)
+                    start = cpu()
+                    delta_len, delta_stats = get_delta(old_sig, filename)
+                    result = results[policy, name]
+                    result[2] += delta_len
+                    result[3] += cpu() - start
+                    if policy == u"adaptive":
+                        history.record((name,), librsync.get_sig_blocks(old_sig)[0],
+                                       delta_stats.literal_runs)
+
+        print(u"%d files, %d rounds of changes" % (len(files), rounds))
+        print(u"%-24s %-10s %-8s %8s %12s %12s %10s" %
+              (u"file", u"kind", u"policy", u"block", u"sig KB", u"delta KB", u"CPU s"))
+        totals = dict((policy, [0, 0, 0.0]) for policy in policies)
+        for name, kind in files:
+            for policy in policies:
+                block_len, sig_len, delta_len, secs = results[policy, name]
+                print(u"%-24s %-10s %-8s %8d %12.1f %12.1f %10.2f" %
+                      (util.fsdecode(name)[:24], kind, policy, block_len, sig_len / 1024.0,
+                       delta_len / 1024.0, secs))
+                totals[policy][0] += sig_len
+                totals[policy][1] += delta_len
+                totals[policy][2] += secs
+        for policy in policies:
+            sig_len, delta_len, secs = totals[policy]
+            print(u"%-24s %-10s %-8s %8s %12.1f %12.1f %10.2f" %
+                  (u"total", u"", policy, u"", sig_len / 1024.0, delta_len / 1024.0, secs))
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == u"__main__":
+    main(sys.argv[1:])
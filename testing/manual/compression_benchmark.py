@@ -0,0 +1,144 @@
+#!/usr/bin/env python2
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Compare the compression codecs on a corpus of files
+
+Usage: compression_benchmark.py [--levels] [--threads N] [corpus_dir ...]
+
+The corpus is tarred into memory the way duplicity packs volumes, then
+compressed and decompressed once per codec.  Throughput is reported in
+MB/s of uncompressed data, together with the compression ratio.  With no
+corpus_dir the python standard library is used (source, bytecode and
+shared objects); point it at a real home or /srv directory to get numbers
+for your own data.
+"""
+
+import getopt
+import os
+import sys
+import tarfile
+import tempfile
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), u"..", u".."))
+
+import __builtin__
+__builtin__._ = lambda s: s
+
+from duplicity import compression
+from duplicity import globals
+
+
+def build_corpus(dirs, limit):
+    u"""Return a tar stream of the files in dirs, at most limit bytes"""
+    buf = StringIO()
+    tf = tarfile.open(mode=u"w|", fileobj=buf)
+    for top in dirs:
+        for root, subdirs, files in os.walk(top):
+            for name in files:
+                filename = os.path.join(root, name)
+                if not os.path.isfile(filename) or os.path.islink(filename):
+                    continue
+                try:
+                    tf.add(filename)
+                except (IOError, OSError):
+                    continue
+                if buf.tell() >= limit:
+                    tf.close()
+                    return buf.getvalue()
+    tf.close()
+    return buf.getvalue()
+
+
+def bench(codec, data, chunk=64 * 1024):
+    u"""Return (compressed size, compress secs, decompress secs)"""
+    fd, filename = tempfile.mkstemp(suffix=codec.suffix)
+    os.close(fd)
+    try:
+        start = time.time()
+        fout = codec.open(filename, u"wb")
+        for i in xrange(0, len(data), chunk):
+            fout.write(data[i:i + chunk])
+        fout.close()
+        comp_secs = time.time() - start
+        size = os.path.getsize(filename)
+
+        start = time.time()
+        fin = codec.open(filename, u"rb")
+        total = 0
+        while True:
+            buf = fin.read(chunk)
+            if not buf:
+                break
+            total += len(buf)
+        fin.close()
+        decomp_secs = time.time() - start
+        assert total == len(data), (codec.name, total, len(data))
+    finally:
+        os.unlink(filename)
+    return size, comp_secs, decomp_secs
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv, u"", [u"levels", u"threads=", u"limit="])
+    levels = False
+    limit = 256 * 1024 * 1024
+    for opt, val in opts:
+        if opt == u"--levels":
+            levels = True
+        elif opt == u"--threads":
+            globals.compression_threads = int(val)
+        elif opt == u"--limit":
+            limit = int(val) * 1024 * 1024
+    if not args:
+        args = [os.path.dirname(os.__file__)]
+
+    data = build_corpus(args, limit)
+    mb = len(data) / (1024.0 * 1024.0)
+    print(u"corpus: %.1f MB from %s" % (mb, u", ".join(args)))
+    print(u"%-6s %5s %10s %7s %12s %12s" %
+          (u"codec", u"level", u"size", u"ratio", u"comp MB/s", u"decomp MB/s"))
+
+    for codec in compression.codecs:
+        try:
+            codec.check_available()
+        except compression.CompressionError as e:
+            print(u"%-6s skipped: %s" % (codec.name, e))
+            continue
+        if levels and codec.name == u"gzip":
+            level_list = [1, 6, 9]
+        elif levels and codec.name == u"zstd":
+            level_list = [1, 3, 9, 19]
+        elif levels and codec.name == u"lz4":
+            level_list = [0, 9]
+        else:
+            level_list = [codec.default_level]
+        for level in level_list:
+            globals.compression_level = level
+            size, comp_secs, decomp_secs = bench(codec, data)
+            print(u"%-6s %5d %10d %7.3f %12.1f %12.1f" %
+                  (codec.name, level, size, float(size) / len(data),
+                   mb / max(comp_secs, 1e-6), mb / max(decomp_secs, 1e-6)))
+    globals.compression_level = None
+
+
+if __name__ == u"__main__":
+    main(sys.argv[1:])
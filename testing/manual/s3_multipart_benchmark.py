@@ -0,0 +1,119 @@
+#!/usr/bin/env python2
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+u"""
+Compare the process pool and thread multipart uploaders to S3
+
+Usage: s3_multipart_benchmark.py [--volumes N] [--size MB] [--chunk MB]
+                                 [--workers N] [--https] s3://host:port/bucket
+
+Meant to be run against a local S3 compatible server, like minio or
+moto_server, so that the numbers show the overhead of the uploaders
+rather than of the network:
+
+  minio server /tmp/minio &
+  AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \\
+      s3_multipart_benchmark.py s3://localhost:9000/bench
+
+Each uploader puts the same random volumes, by default 8 of 200MB in
+parts of 25MB, and the wall time and throughput are reported.  The
+uploaded keys are deleted afterwards.
+"""
+
+import getopt
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), u"..", u".."))
+
+import __builtin__
+__builtin__._ = lambda s: s
+
+from duplicity import backend
+from duplicity import globals
+from duplicity import path
+from duplicity.backends import _boto_multi
+
+
+def make_volumes(count, size):
+    u"""Return names of count temporary files of size random bytes"""
+    filenames = []
+    for i in range(count):
+        fd, filename = tempfile.mkstemp(prefix=u"s3bench-")
+        with os.fdopen(fd, u"wb") as fp:
+            for j in xrange(0, size, 1024 * 1024):
+                fp.write(os.urandom(min(1024 * 1024, size - j)))
+        filenames.append(filename)
+    return filenames
+
+
+def bench(url, threads, filenames):
+    u"""Return seconds to upload filenames with one of the uploaders"""
+    globals.s3_multipart_threads = threads
+    s3 = _boto_multi.BotoBackend(backend.ParsedUrl(url))
+    remote_filenames = [b"s3bench-%d" % i for i in range(len(filenames))]
+    try:
+        start = time.time()
+        for filename, remote_filename in zip(filenames, remote_filenames):
+            s3._put(path.Path(filename), remote_filename)
+        return time.time() - start
+    finally:
+        for remote_filename in remote_filenames:
+            s3._delete(remote_filename)
+        s3._close()
+
+
+def main(argv):
+    opts, args = getopt.getopt(argv, u"", [u"volumes=", u"size=", u"chunk=", u"workers=", u"https"])
+    volumes = 8
+    size = 200 * 1024 * 1024
+    globals.s3_unencrypted_connection = True
+    for opt, val in opts:
+        if opt == u"--volumes":
+            volumes = int(val)
+        elif opt == u"--size":
+            size = int(val) * 1024 * 1024
+        elif opt == u"--chunk":
+            globals.s3_multipart_chunk_size = int(val) * 1024 * 1024
+        elif opt == u"--workers":
+            globals.s3_multipart_max_procs = int(val)
+        elif opt == u"--https":
+            globals.s3_unencrypted_connection = False
+    if len(args) != 1:
+        sys.exit(__doc__)
+
+    filenames = make_volumes(volumes, size)
+    try:
+        mb = volumes * size / (1024.0 * 1024.0)
+        print(u"%d volumes of %d MB in parts of %d MB, %s workers" %
+              (volumes, size / (1024 * 1024), globals.s3_multipart_chunk_size / (1024 * 1024),
+               globals.s3_multipart_max_procs or u"cpu count"))
+        print(u"%-10s %10s %10s" % (u"uploader", u"seconds", u"MB/s"))
+        for name, threads in ((u"processes", False), (u"threads", True)):
+            secs = bench(args[0], threads, filenames)
+            print(u"%-10s %10.2f %10.1f" % (name, secs, mb / max(secs, 1e-6)))
+    finally:
+        for filename in filenames:
+            os.unlink(filename)
+
+
+if __name__ == u"__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,153 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2002 Ben Escoto <ben@emerose.org>
+# Copyright 2007 Kenneth Loafman <kenneth@loafman.com>
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import os
+import unittest
+
+from duplicity import aead
+from duplicity import dup_time
+from duplicity import file_naming
+from duplicity import path
+from . import UnitTestCase
+from .test_gpg import GPGWriteFile_Helper
+
+try:
+    aead.check_available()
+    have_aead = True
+except aead.AEADError:
+    have_aead = False
+
+
+@unittest.skipUnless(have_aead, u"python cryptography module not installed")
+class AEADTest(UnitTestCase):
+    u"""Test AEADFile and its container format"""
+    def setUp(self):
+        super(AEADTest, self).setUp()
+        self.unpack_testfiles()
+        self.epath = path.Path(b"testfiles/output/encrypted_file")
+
+    def aead_cycle(self, s, passphrase=b"foobar"):
+        u"""Test encryption/decryption cycle on string s"""
+        fout = aead.open_file(self.epath, u"wb", passphrase)
+        fout.write(s)
+        assert not fout.close()
+
+        fin = aead.open_file(self.epath, u"rb", passphrase)
+        assert fin.read() == s, len(s)
+        assert not fin.close()
+
+    def test_aead_cycle(self):
+        u"""Test short, empty, chunk sized and long strings"""
+        for compress in (True, False):
+            self.set_global(u'compression', compress)
+            self.aead_cycle(b"")
+            self.aead_cycle(b"hello, world")
+            self.aead_cycle(os.urandom(aead.chunk_size))
+            self.aead_cycle(os.urandom(3 * aead.chunk_size + 1000))
+
+    def test_ciphers_and_threads(self):
+        u"""Test each cipher with and without threads"""
+        data = os.urandom(5 * aead.chunk_size + 17)
+        for cipher in aead.ciphers:
+            self.set_global(u'aead_cipher', cipher)
+            for threads in (1, 4):
+                self.set_global(u'aead_threads', threads)
+                self.aead_cycle(data)
+
+    def test_partial_reads(self):
+        u"""Test reading in small pieces across chunk boundaries"""
+        self.set_global(u'compression', False)
+        data = os.urandom(2 * aead.chunk_size + 5)
+        fout = aead.open_file(self.epath, u"wb", b"foobar")
+        fout.write(data)
+        fout.close()
+
+        fin = aead.open_file(self.epath, u"rb", b"foobar")
+        bufs = []
+        while True:
+            buf = fin.read(100000)
+            if not buf:
+                break
+            bufs.append(buf)
+        fin.close()
+        assert b"".join(bufs) == data
+
+    def test_wrong_passphrase(self):
+        u"""Test decrypting with the wrong passphrase fails"""
+        fout = aead.open_file(self.epath, u"wb", b"foobar")
+        fout.write(b"secret")
+        fout.close()
+        fin = aead.open_file(self.epath, u"rb", b"barfoo")
+        self.assertRaises(aead.AEADError, fin.read)
+
+    def test_damaged(self):
+        u"""Test that truncated and tampered files are detected"""
+        self.set_global(u'compression', False)
+        fout = aead.open_file(self.epath, u"wb", b"foobar")
+        fout.write(os.urandom(2 * aead.chunk_size))
+        fout.close()
+        with open(self.epath.name, u"rb") as fp:
+            data = fp.read()
+
+        # drop the final chunk, which is empty here
+        with open(self.epath.name, u"wb") as fp:
+            fp.write(data[:-aead.tag_size])
+        fin = aead.open_file(self.epath, u"rb", b"foobar")
+        self.assertRaises(aead.AEADError, fin.read)
+
+        # flip one bit in the middle
+        middle = len(data) // 2
+        with open(self.epath.name, u"wb") as fp:
+            fp.write(data[:middle] + chr(ord(data[middle]) ^ 1) + data[middle + 1:])
+        fin = aead.open_file(self.epath, u"rb", b"foobar")
+        self.assertRaises(aead.AEADError, fin.read)
+
+    def test_AEADWriteFile(self):
+        u"""Test AEADWriteFile keeps volumes near the requested size"""
+        size = 400 * 1000
+        gwfh = GPGWriteFile_Helper()
+        for i in range(10):  # @UnusedVariable
+            aead.AEADWriteFile(gwfh, u"testfiles/output/aeadwrite.aead",
+                               b"foobar", size=size)
+            assert size - 128 * 1024 <= os.stat(u"testfiles/output/aeadwrite.aead").st_size <= size
+        gwfh.set_at_end()
+        assert aead.AEADWriteFile(gwfh, u"testfiles/output/aeadwrite.aead",
+                                  b"foobar", size=size)
+
+    def test_file_naming(self):
+        u"""Test that the aead suffix is written and parsed"""
+        dup_time.setcurtime()
+        self.set_global(u'aead_encryption', True)
+        for short in (False, True):
+            self.set_global(u'short_filenames', short)
+            filename = file_naming.get(u"full", 1, encrypted=True)
+            assert filename.endswith(aead.short_suffix if short else aead.suffix), filename
+            pr = file_naming.parse(filename)
+            assert pr.encrypted and pr.aead and not pr.compressed, filename
+
+        self.set_global(u'aead_encryption', False)
+        self.set_global(u'short_filenames', False)
+        pr = file_naming.parse(file_naming.get(u"full", 1, encrypted=True))
+        assert pr.encrypted and not pr.aead
+
+
+if __name__ == u"__main__":
+    unittest.main()
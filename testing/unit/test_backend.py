@@ -0,0 +1,364 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import hashlib
+import os
+import threading
+import unittest
+
+from duplicity import backend
+from duplicity import path
+from duplicity.errors import BackendException
+from duplicity.errors import TemporaryLoadException
+from . import UnitTestCase
+
+
+class RangeBackend(backend.Backend):
+    u"""Backend of files in memory, which can read byte ranges"""
+    def __init__(self, files):
+        self.files = files
+        self.gets = []
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def _get(self, remote_filename, local_path):
+        self.gets.append(remote_filename)
+        with open(local_path.name, u"wb") as fp:
+            fp.write(self.files[remote_filename])
+
+    def _query(self, filename):
+        return {u'size': len(self.files[filename])}
+
+    def _read_range(self, remote_filename, offset, length):
+        with self.lock:
+            self.ranges.append((offset, length))
+        return self.files[remote_filename][offset:offset + length]
+
+
+class DeleteBackend(backend.Backend):
+    u"""Backend recording the files it is asked to delete"""
+    def __init__(self):
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def _delete(self, filename):
+        with self.lock:
+            self.deleted.append([filename])
+
+
+class DeleteListBackend(DeleteBackend):
+    u"""Backend recording the batches of files it is asked to delete"""
+    def _delete_list(self, filename_list):
+        with self.lock:
+            self.deleted.append(filename_list)
+
+
+class OverloadedBackend(backend.Backend):
+    u"""Backend refusing to list until asked failures times"""
+    def __init__(self, failures):
+        self.failures = failures
+
+    def _list(self):
+        if self.failures:
+            self.failures -= 1
+            raise TemporaryLoadException(u"slow down")
+        return [b"file"]
+
+
+class PutInfoBackend(backend.Backend):
+    u"""Backend reporting info about the files it is asked to put"""
+    def __init__(self, info):
+        self.info = info
+
+    def _put(self, source_path, remote_filename):
+        return self.info
+
+
+class RetryTest(UnitTestCase):
+    u"""Test failed operations are retried later and later, and throttled"""
+    def setUp(self):
+        super(RetryTest, self).setUp()
+        self.clock = [1000.0]
+        self.sleeps = []
+
+        def sleep(secs):
+            self.sleeps.append(secs)
+            self.clock[0] += secs
+        self.orig_time = backend.time.time
+        self.orig_sleep = backend.time.sleep
+        backend.time.time = lambda: self.clock[0]
+        backend.time.sleep = sleep
+
+    def tearDown(self):
+        backend.time.time = self.orig_time
+        backend.time.sleep = self.orig_sleep
+        super(RetryTest, self).tearDown()
+
+    def test_delay(self):
+        u"""Test the delay doubles up to the maximum, with jitter"""
+        self.set_global(u'backend_retry_delay', 10)
+        self.set_global(u'backend_retry_max_delay', 60)
+        for attempt, delay in [(1, 10), (2, 20), (3, 40), (4, 60), (5, 60)]:
+            delays = [backend.retry_delay(attempt) for i in range(20)]
+            assert delay / 2.0 <= min(delays) and max(delays) <= delay, delays
+            assert len(set(delays)) > 1, delays
+        assert 15 <= backend.retry_delay(1, True) <= 30
+
+    def test_throttle(self):
+        u"""Test the rate is halved when overloaded and recovers on success"""
+        throttle = backend.Throttle()
+        for i in range(20):
+            start = throttle.wait()
+            self.clock[0] += 0.5
+        assert not self.sleeps
+        throttle.throttled(start)
+        assert throttle.rate == 1.0, throttle.rate
+        throttle.throttled(start)
+        assert throttle.rate == 1.0, throttle.rate
+        assert throttle.throttled_count == 2
+
+        for i in range(3):
+            throttle.wait()
+        assert self.sleeps == [1.0, 1.0, 1.0], self.sleeps
+        throttle.throttled(self.clock[0])
+        assert throttle.rate == 0.5, throttle.rate
+
+        for i in range(42):
+            throttle.succeeded()
+            assert throttle.rate is not None
+        throttle.succeeded()
+        assert throttle.rate is None
+
+    def test_retry(self):
+        u"""Test an overloaded backend is retried after a growing delay"""
+        self.set_global(u'backend_retry_delay', 1)
+        wrapper = backend.BackendWrapper(OverloadedBackend(2))
+        assert wrapper.list() == [b"file"]
+        # retries wait 1.5-3 and 3-6 seconds, and maybe for the rate limit
+        throttle = wrapper.throttle
+        assert 4.5 <= throttle.retry_time <= 9, self.sleeps
+        assert abs(sum(self.sleeps) - throttle.retry_time - throttle.wait_time) < 1e-9
+        assert wrapper.throttle.rate == 0.25 * 1.05, wrapper.throttle.rate
+        assert wrapper.throttle.throttled_count == 2
+
+
+class DeleteTest(UnitTestCase):
+    u"""Test files are deleted in batches, and concurrently"""
+    def setUp(self):
+        super(DeleteTest, self).setUp()
+        self.backend = DeleteListBackend()
+        self.wrapper = backend.BackendWrapper(self.backend)
+        self.filenames = [b"file%03d" % i for i in range(250)]
+
+    def test_batches(self):
+        u"""Test the files are deleted in order in batches"""
+        self.wrapper.delete(self.filenames)
+        assert self.backend.deleted == [self.filenames[:100], self.filenames[100:200],
+                                        self.filenames[200:]]
+
+        self.backend.deleted = []
+        self.backend.delete_list_size = None
+        self.wrapper.delete(self.filenames)
+        assert self.backend.deleted == [self.filenames]
+
+    def test_concurrent(self):
+        u"""Test the first file is deleted alone, the others concurrently"""
+        self.set_global(u'delete_concurrency', 4)
+        self.wrapper.delete(self.filenames)
+        assert self.backend.deleted[0] == self.filenames[:1]
+        assert sorted(self.backend.deleted[1:]) == \
+            [self.filenames[1:101], self.filenames[101:201], self.filenames[201:]]
+
+        self.backend = DeleteBackend()
+        backend.BackendWrapper(self.backend).delete(self.filenames)
+        assert self.backend.deleted[0] == self.filenames[:1]
+        assert sorted(self.backend.deleted) == [[f] for f in self.filenames]
+
+    def test_failed(self):
+        u"""Test the files of failed deletes are returned"""
+        self.set_global(u'num_retries', 1)
+
+        def delete_list(filename_list):
+            if b"file150" in filename_list:
+                raise BackendException(u"cannot delete")
+        self.backend._delete_list = delete_list
+        assert self.wrapper.delete(self.filenames) == self.filenames[100:200]
+        self.set_global(u'delete_concurrency', 4)
+        assert self.wrapper.delete(self.filenames) == self.filenames[101:201]
+        self.backend._delete_list = lambda filename_list: None
+        assert self.wrapper.delete(self.filenames) == []
+
+
+class PutTest(UnitTestCase):
+    u"""Test put() returns what the backend reports of the stored file"""
+    def setUp(self):
+        super(PutTest, self).setUp()
+        self.unpack_testfiles()
+        with open(b"testfiles/volume", u"wb") as fp:
+            fp.write(b"x" * 1000)
+        self.volume = path.Path(b"testfiles/volume")
+
+    def test_info(self):
+        u"""Test the reported info is returned, with a size"""
+        wrapper = backend.BackendWrapper(PutInfoBackend(None))
+        assert wrapper.put(self.volume, b"volume") is None
+        wrapper.backend.info = {u'size': 1000}
+        assert wrapper.put(self.volume, b"volume") == {u'size': 1000}
+        wrapper.backend.info = {u'md5': b"abc"}
+        assert wrapper.put(self.volume, b"volume") == {u'md5': b"abc", u'size': None}
+
+    def test_local(self):
+        u"""Test the local backend reports the size of the stored file"""
+        wrapper = backend.get_backend(u"file://testfiles/output")
+        assert wrapper.put(self.volume, b"volume") == {u'size': 1000}
+        assert os.path.getsize(b"testfiles/output/volume") == 1000
+
+
+class RangedGetTest(UnitTestCase):
+    u"""Test files are downloaded in byte ranges"""
+    def setUp(self):
+        super(RangedGetTest, self).setUp()
+        self.unpack_testfiles()
+        self.set_global(u'download_concurrency', 3)
+        self.set_global(u'download_chunk_size', 1000)
+        self.files = {b"small": os.urandom(1000), b"large": os.urandom(4500)}
+        self.backend = RangeBackend(self.files)
+        self.wrapper = backend.BackendWrapper(self.backend)
+        self.local_path = path.Path(b"testfiles/output/restored")
+
+    def get(self, remote_filename):
+        self.wrapper.get(remote_filename, self.local_path)
+        with open(self.local_path.name, u"rb") as fp:
+            return fp.read()
+
+    def test_ranges(self):
+        u"""Test a file larger than a range is read in ranges"""
+        assert self.get(b"large") == self.files[b"large"]
+        assert not self.backend.gets
+        assert self.backend.ranges[0] == (0, 1000)
+        assert sorted(self.backend.ranges) == \
+            [(0, 1000), (1000, 1000), (2000, 1000), (3000, 1000), (4000, 500)]
+
+    def test_single(self):
+        u"""Test small files, or ranges turned off, use _get"""
+        assert self.get(b"small") == self.files[b"small"]
+        self.set_global(u'download_concurrency', 1)
+        assert self.get(b"large") == self.files[b"large"]
+        assert self.backend.gets == [b"small", b"large"]
+        assert not self.backend.ranges
+
+    def test_hash(self):
+        u"""Test downloads are hashed in ranges or after _get"""
+        for concurrency in (3, 1):
+            self.set_global(u'download_concurrency', concurrency)
+            for filename in (b"small", b"large"):
+                digest = self.wrapper.get(filename, self.local_path, u"SHA1")
+                assert digest == hashlib.sha1(self.files[filename]).hexdigest(), filename
+        assert self.wrapper.get(b"large", self.local_path) is None
+
+    def test_short_range(self):
+        u"""Test a range read short fails the download"""
+        self.backend._read_range = lambda f, offset, length: b"x"
+        self.assertRaises(BackendException, self.wrapper._BackendWrapper__get_ranges,
+                          b"large", self.local_path)
+
+
+class ShapedBackendTest(UnitTestCase):
+    u"""Test the shaped+ backend slows down and fails operations"""
+    def setUp(self):
+        super(ShapedBackendTest, self).setUp()
+        self.unpack_testfiles()
+        backend.import_backends()
+        from duplicity.backends import shapedbackend
+        self.shapedbackend = shapedbackend
+        self.sleeps = []
+        self.orig_sleep = shapedbackend.time.sleep
+        shapedbackend.time.sleep = self.sleeps.append
+        with open(b"testfiles/output/volume", u"wb") as fp:
+            fp.write(b"x" * 100000)
+        self.volume = path.Path(b"testfiles/output/volume")
+
+    def tearDown(self):
+        self.shapedbackend.time.sleep = self.orig_sleep
+        super(ShapedBackendTest, self).tearDown()
+
+    def test_latency(self):
+        u"""Test each operation waits for latency and bandwidth"""
+        shaped = backend.get_backend(u"shaped+file://testfiles/output/remote"
+                                     u"?latency=0.5&stream_bandwidth=50000")
+        shaped.put(self.volume, b"volume")
+        assert shaped.list() == [b"volume"]
+        assert self.sleeps[0] == 0.5 and 1.9 < self.sleeps[1] <= 2.0, self.sleeps
+        # list transfers next to nothing, so it may not wait at all
+        assert self.sleeps[2] == 0.5 and max(self.sleeps[3:] or [0]) < 0.01, self.sleeps
+        assert os.path.getsize(b"testfiles/output/remote/volume") == 100000
+
+    def test_fail(self):
+        u"""Test failures are injected for the chosen operations"""
+        shaped = backend.get_backend(u"shaped+file://testfiles/output/remote"
+                                     u"?fail=0.5&fail_ops=put&seed=1").backend
+        failures = 0
+        for i in range(20):
+            try:
+                shaped._put(self.volume, b"volume")
+            except BackendException:
+                failures += 1
+        assert 0 < failures < 20, failures
+        for i in range(20):
+            shaped._list()
+
+
+class Par2DeleteTest(UnitTestCase):
+    u"""Test par2+ deletes take their .par2 files along, concurrently"""
+    def setUp(self):
+        super(Par2DeleteTest, self).setUp()
+        self.unpack_testfiles()
+        backend.import_backends()
+        self.set_global(u'par2_native', True)
+        os.makedirs(b"testfiles/output/remote")
+        self.filenames = [b"vol%d" % i for i in range(1, 5)]
+        for filename in self.filenames:
+            for name in [filename, filename + b".par2", filename + b".vol0+1.par2"]:
+                with open(b"testfiles/output/remote/" + name, u"wb") as fp:
+                    fp.write(b"x")
+
+    def test_delete(self):
+        u"""Test the .par2 files are listed first and all files deleted"""
+        wrapper = backend.get_backend(u"par2+file://testfiles/output/remote")
+        par2 = wrapper.backend
+        assert par2.delete_list_size == 1
+        filenames = par2._get_delete_filenames(self.filenames[:2])
+        assert filenames[-2:] == self.filenames[:2]
+        assert sorted(filenames[:-2]) == [b"vol1.par2", b"vol1.vol0+1.par2",
+                                          b"vol2.par2", b"vol2.vol0+1.par2"]
+        assert wrapper.delete(self.filenames[:2]) == []
+        assert sorted(os.listdir(b"testfiles/output/remote")) == \
+            sorted(f + e for f in self.filenames[2:] for e in [b"", b".par2", b".vol0+1.par2"])
+
+        self.set_global(u'delete_concurrency', 4)
+        deleted = []
+        orig_delete = par2.wrapped_backend._delete
+        par2.wrapped_backend._delete = lambda filename: (deleted.append(filename),
+                                                         orig_delete(filename))
+        assert wrapper.delete(self.filenames[2:]) == []
+        assert os.listdir(b"testfiles/output/remote") == []
+        assert len(deleted) == 6
+
+
+if __name__ == u"__main__":
+    unittest.main()
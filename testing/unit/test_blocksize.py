@@ -0,0 +1,98 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import struct
+import unittest
+
+from duplicity import blocksize
+from duplicity import librsync
+from . import UnitTestCase
+
+
+class BlockSizeTest(UnitTestCase):
+    u"""Test block sizes are chosen by size, type and history"""
+    def test_size(self):
+        u"""Test the block size grows with the square root of the size"""
+        assert blocksize.get_block_size(0) == 512
+        assert blocksize.get_block_size(1000000) == 512
+        assert blocksize.get_block_size(16 * 1024 * 1024) == 4096
+        assert blocksize.get_block_size(1024 * 1024 * 1024) == 32768
+        assert blocksize.get_block_size(64 * 1024 * 1024 * 1024) == 65536
+
+    def test_type(self):
+        u"""Test compressed files get larger blocks"""
+        assert blocksize.get_block_size(16 * 1024 * 1024, (b"dir", b"photo.JPG")) == 16384
+        assert blocksize.get_block_size(16 * 1024 * 1024, (b"dir", b"notes.txt")) == 4096
+        assert blocksize.get_block_size(16 * 1024 * 1024, (b"dir", b"gz")) == 4096
+
+    def test_history(self):
+        u"""Test the block size follows the changes of the last delta"""
+        size = 16 * 1024 * 1024
+        # 12 * size / 100 is about 1419 squared, 12 * size / 10 about 4487
+        assert blocksize.get_block_size(size, (b"a.db",), (4096, 100)) == 1024
+        assert blocksize.get_block_size(size, (b"a.gz",), (4096, 10)) == 4096
+        # at most 4 times larger or smaller
+        assert blocksize.get_block_size(64 * size, (), (4096, 1)) == 16384
+        assert blocksize.get_block_size(size, (), (4096, 0)) == 16384
+        assert blocksize.get_block_size(size, (), (4096, 100000)) == 1024
+        assert blocksize.get_block_size(size, (), (65536, 0)) == 65536
+
+    def test_delta_stats(self):
+        u"""Test the changes of a delta are counted in pieces of any size"""
+        delta = (struct.pack(b">I", librsync.RS_DELTA_MAGIC) +
+                 struct.pack(b">BBB", librsync.RS_OP_COPY_N1_N1, 0, 100) +
+                 b"\x03abc" + struct.pack(b">BB", librsync.RS_OP_LITERAL_N1, 5) + b"hello" +
+                 struct.pack(b">BHI", librsync.RS_OP_COPY_N1_N1 + 6, 1000, 70000) +
+                 struct.pack(b">BI", librsync.RS_OP_LITERAL_N4, 300) + b"x" * 300 +
+                 chr(librsync.RS_OP_END))
+        for piece_len in [1, 7, len(delta)]:
+            delta_stats = librsync.DeltaStats()
+            for i in range(0, len(delta), piece_len):
+                delta_stats.update(delta[i:i + piece_len])
+            assert delta_stats.ended
+            assert delta_stats.literal_runs == 2
+            assert delta_stats.literal_bytes == 308
+            assert delta_stats.copy_bytes == 70100
+
+        delta_stats = librsync.DeltaStats()
+        self.assertRaises(librsync.librsyncError, delta_stats.update, delta[:4] + b"\xff")
+
+    def test_save(self):
+        u"""Test the history is saved and read back"""
+        self.unpack_testfiles()
+        filename = b"testfiles/output/blocksize-history"
+        history = blocksize.History(filename)
+        assert history.get((b"a",)) is None
+        history.record((b"a",), 512, 1)
+        history.record((b"b", b"c"), 1024, 20)
+        history.save()
+
+        history = blocksize.History(filename)
+        assert history.get((b"a",)) == (512, 1)
+        history.forget((b"a",))
+        history.forget((b"x",))
+        history.save()
+        assert blocksize.History(filename).entries == {(b"b", b"c"): (1024, 20)}
+
+        with open(filename, u"wb") as fp:
+            fp.write(b"garbage")
+        assert blocksize.History(filename).entries == {}
+
+
+if __name__ == u"__main__":
+    unittest.main()
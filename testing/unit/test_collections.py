@@ -28,7 +28,9 @@ import unittest
 
 from duplicity import collections
 from duplicity import backend
+from duplicity import file_naming
 from duplicity import globals
+from duplicity import manifest
 from duplicity import path
 from duplicity import gpg
 from duplicity import dup_time
@@ -124,6 +126,66 @@ class CollectionTest(UnitTestCase):
         check_cs(cs)
         assert cs.matched_chain_pair[0].islocal()
 
+    def write_local_manifests(self):
+        """Put plain manifests of the remote sets in the archive dir"""
+        local_paths = []
+        for filename in self.real_backend.list():
+            pr = file_naming.parse(filename)
+            if pr and pr.manifest:
+                vi = manifest.VolumeInfo()
+                vi.set_info(1, ("a",), None, ("b",), None)
+                mf = manifest.Manifest()
+                mf.add_volume_info(vi)
+                local_path = globals.archive_dir_path.append(filename[:-len(".gpg")])
+                fp = open(local_path.name, "w")
+                fp.write(mf.to_string())
+                fp.close()
+                local_paths.append(local_path)
+        return local_paths
+
+    def test_lazy_manifests(self):
+        """Test manifests are read when used, once per set, then from the cache"""
+        local_paths = self.write_local_manifests()
+        assert len(local_paths) == 3, local_paths
+        manifest._summary_cache = None
+        read = []
+        orig_get_local_manifest = collections.BackupSet.get_local_manifest
+
+        def counting_get_local_manifest(backup_set):
+            read.append(backup_set.local_manifest_path.name)
+            return orig_get_local_manifest(backup_set)
+        collections.BackupSet.get_local_manifest = counting_get_local_manifest
+
+        def get_sets():
+            cs = collections.CollectionsStatus(self.real_backend, globals.archive_dir_path,
+                                               "full").set_values()
+            return cs.matched_chain_pair[1].get_all_sets()
+
+        try:
+            sets = get_sets()
+            assert not read
+            for backup_set in sets:
+                backup_set.get_manifest()
+                backup_set.get_manifest()
+            assert len(read) == 3, read
+
+            # a new run reads the cache instead
+            manifest.save_summary_cache()
+            manifest._summary_cache = None
+            for backup_set in get_sets():
+                assert backup_set.get_manifest().volume_info_dict[1].end_index == ("b",)
+            assert len(read) == 3, read
+
+            # unless the manifest changed
+            os.utime(local_paths[0].name, (1000, 1000))
+            manifest._summary_cache = None
+            for backup_set in get_sets():
+                backup_set.get_manifest()
+            assert len(read) == 4, read
+        finally:
+            collections.BackupSet.get_local_manifest = orig_get_local_manifest
+            manifest._summary_cache = None
+
     def test_sig_chain(self):
         """Test a single signature chain"""
         chain = collections.SignatureChain(1, globals.archive_dir_path)
@@ -20,10 +20,13 @@ from __future__ import print_function
 # along with duplicity; if not, write to the Free Software Foundation,
 # Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 
+import cStringIO
 import unittest
 
 from duplicity.path import *  # @UnusedWildImport
+from duplicity import blocksize
 from duplicity import diffdir
+from duplicity import librsync
 from duplicity import selection
 from duplicity import util
 from duplicity import tarfile  # @Reimport
@@ -207,6 +210,154 @@ class DDTest(UnitTestCase):
             diffdir.write_block_iter(diffdir.SigTarBlockIter(get_sel(cur_dir)),
                                      cur_full_sigs)
 
+    def test_append_only(self):
+        """Test only the appended data of a grown file is read and sent"""
+        src = Path("testfiles/output/append")
+        src.mkdir()
+        log = src.append("log")
+        old_data = os.urandom(300000)
+        with open(log.name, "wb") as fp:
+            fp.write(old_data)
+        get_sel = lambda: selection.Select(Path(src.name)).set_iter()
+        diffdir.write_block_iter(diffdir.SigTarBlockIter(get_sel()), "testfiles/output/append.sigtar")
+
+        def get_delta():
+            """Return delta and signature of log against the old signature"""
+            block_iter = diffdir.DirDelta_WriteSig(
+                get_sel(), open("testfiles/output/append.sigtar", "rb"),
+                open("testfiles/output/append.incsig", "wb"))
+            diffdir.write_block_iter(block_iter, "testfiles/output/append.difftar")
+            result = []
+            for name in ["difftar", "incsig"]:
+                # the delta may be split into multivol_diff/log/1, /2, ...
+                tf = tarfile.TarFile("testfiles/output/append." + name, "r")
+                result.append("".join(tf.extractfile(tarinfo).read() for tarinfo in tf
+                                      if "/log" in tarinfo.name))
+                tf.close()
+            return result
+
+        def check(new_data, appended):
+            with open(log.name, "wb") as fp:
+                fp.write(new_data)
+            os.utime(log.name, (1000000000, 1000000000))
+            delta, sig = get_delta()
+            # only the fast path copies the prefix with an 8 byte offset and length
+            assert (delta[4] == chr(librsync.RS_OP_COPY_N8_N8)) == appended
+            assert len(delta) < 80000
+            basis = open("testfiles/output/append.basis", "w+b")
+            basis.write(old_data)
+            basis.seek(0)
+            assert librsync.PatchedFile(basis, cStringIO.StringIO(delta)).read() == new_data
+            assert sig == librsync.SigFile(cStringIO.StringIO(new_data), 512).read()
+
+        new_data = old_data + os.urandom(70000)
+        self.set_global('append_only_check', "size")
+        check(new_data, True)
+        self.set_global('append_only_check', "sample")
+        check(new_data, True)
+
+        # a changed block is noticed, but only if compared
+        changed_data = new_data[:36 * 512] + "x" + new_data[36 * 512 + 1:]
+        check(changed_data, False)
+        self.set_global('append_only_check', None)
+        check(new_data, False)
+
+    def test_adaptive_blocksize(self):
+        """Test block sizes follow the history of the deltas"""
+        self.set_global('adaptive_blocksize', True)
+        self.set_global('archive_dir_path', Path("testfiles/output"))
+        src = Path("testfiles/output/adaptive")
+        src.mkdir()
+        data = src.append("data")
+        index = ("data",)
+        contents = os.urandom(2000000)
+        with open(data.name, "wb") as fp:
+            fp.write(contents)
+        get_sel = lambda: selection.Select(Path(src.name)).set_iter()
+
+        def backup(sigtar, new_sigtar):
+            """Back up against sigtar, return the block size of new_sigtar"""
+            if sigtar:
+                block_iter = diffdir.DirDelta_WriteSig(get_sel(), open(sigtar, "rb"),
+                                                       open(new_sigtar, "wb"))
+            else:
+                block_iter = diffdir.DirFull_WriteSig(get_sel(), open(new_sigtar, "wb"))
+            diffdir.write_block_iter(block_iter, "testfiles/output/adaptive.difftar")
+            tf = tarfile.TarFile(new_sigtar, "r")
+            block_lens = [librsync.get_sig_blocks(tf.extractfile(tarinfo).read())[0]
+                          for tarinfo in tf if tarinfo.name == "signature/data"]
+            tf.close()
+            return block_lens and block_lens[0]
+
+        def change(contents, offset):
+            contents = contents[:offset] + "x" + contents[offset + 1:]
+            with open(data.name, "wb") as fp:
+                fp.write(contents)
+            os.utime(data.name, (1000000000 + offset, 1000000000 + offset))
+            return contents
+
+        assert backup(None, "testfiles/output/adaptive1.sigtar") == 1024
+        assert blocksize.History("testfiles/output/blocksize-history").get(index) is None
+
+        contents = change(contents, 500000)
+        assert backup("testfiles/output/adaptive1.sigtar", "testfiles/output/adaptive2.sigtar") == 1024
+        previous = blocksize.History("testfiles/output/blocksize-history").get(index)
+        assert previous == (1024, 1), previous
+
+        # one change in 2000000 bytes is worth blocks of 4899, but at most 4096
+        contents = change(contents, 600000)
+        assert backup("testfiles/output/adaptive2.sigtar", "testfiles/output/adaptive3.sigtar") == 4096
+
+        data.delete()
+        backup("testfiles/output/adaptive3.sigtar", "testfiles/output/adaptive4.sigtar")
+        assert blocksize.History("testfiles/output/blocksize-history").get(index) is None
+
+    def test_restart_fast_forward(self):
+        """Test a restarted backup skips the files saved before the restart point"""
+        class Restart:
+            fast_index = None
+            sig_path = None
+
+        def get_sel():
+            return selection.Select(Path("testfiles/dir2")).set_iter()
+
+        full_sigs = Path("testfiles/output/fullsig.dir2")
+        sig_outfp = full_sigs.open("wb")
+        diffdir.write_block_iter(diffdir.DirFull_WriteSig(get_sel(), sig_outfp),
+                                 Path("testfiles/output/full.dir2"))
+        sig_outfp.close()
+
+        # an interrupted backup can leave a damaged entry at the end
+        tf = tarfile.TarFile(full_sigs.name, "r")
+        last = tf.getmembers()[-1]
+        tf.close()
+        assert last.name > "signature/largefile", last.name
+        partial_sigs = Path("testfiles/output/partialsig.dir2")
+        fp = partial_sigs.open("wb")
+        fp.write(full_sigs.open("rb").read()[:last.offset_data + 1])
+        fp.close()
+        self.assertRaises(diffdir.DiffDirException, list,
+                          diffdir.sigtar_entries_before(partial_sigs.open("rb"),
+                                                        ("zzz",)))
+
+        restart = Restart()
+        restart.sig_path = partial_sigs
+        restart.fast_index = ("largefile",)
+        sel = get_sel()
+        sel.skip_before(restart.fast_index)
+        restart_sigs = Path("testfiles/output/restartsig.dir2")
+        sig_outfp = restart_sigs.open("wb")
+        restart_delta = Path("testfiles/output/restart.dir2")
+        diffdir.write_block_iter(diffdir.DirFull_WriteSig(sel, sig_outfp, restart),
+                                 restart_delta)
+        sig_outfp.close()
+
+        compare_tar(full_sigs.open("rb"), restart_sigs.open("rb"))
+        tf = tarfile.TarFile(restart_delta.name, "r")
+        for tarinfo in tf:
+            assert tarinfo.name.split("/")[1] >= "largefile", tarinfo.name
+        tf.close()
+
     def test_combine_path_iters(self):
         """Test diffdir.combine_path_iters"""
         class Dummy:
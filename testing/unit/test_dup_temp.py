@@ -0,0 +1,193 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# Copyright 2002 Ben Escoto <ben@emerose.org>
+# Copyright 2007 Kenneth Loafman <kenneth@loafman.com>
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+
+import cStringIO
+import unittest
+
+from duplicity import collections
+from duplicity import diffdir
+from duplicity import dup_temp
+from duplicity import dup_time
+from duplicity import file_naming
+from duplicity import globals
+from duplicity import gpg
+from duplicity import path
+from duplicity import util
+from . import UnitTestCase
+
+
+class MoveBackend:
+    u"""Backend that keeps what is moved to it"""
+    def __init__(self):
+        self.files = {}
+
+    def move(self, source_path):
+        dp = path.DupPath(source_path.base, index=source_path.index)
+        fp = dp.filtered_open(u"rb")
+        self.files[source_path.get_filename()] = fp.read()
+        fp.close()
+        source_path.delete()
+
+
+class StreamTest(UnitTestCase):
+    u"""Test FileobjHooked writing the permanent and remote copies as it goes"""
+    def setUp(self):
+        super(StreamTest, self).setUp()
+        self.unpack_testfiles()
+        dup_time.setcurtime()
+        self.set_global(u'gpg_profile', gpg.GPGProfile(passphrase=b"foobar"))
+        self.set_global(u'backend', MoveBackend())
+        self.orig_srciter = dup_temp.SrcIter
+
+        def no_srciter(src):
+            raise AssertionError(u"%s read back" % src.name)
+        dup_temp.SrcIter = no_srciter
+
+    def tearDown(self):
+        dup_temp.SrcIter = self.orig_srciter
+        super(StreamTest, self).tearDown()
+
+    def stream_cycle(self, partname, permname, remname):
+        u"""Write through a streamed fileobj, check both copies"""
+        dirpath = path.Path(b"testfiles/output")
+        fh = dup_temp.get_fileobj_duppath(dirpath, partname, permname, remname,
+                                          overwrite=True, stream=True)
+        data = b"hello, world " * 10000
+        fh.write(data[:1000])
+        fh.to_partial()
+        fh.write(data[1000:])
+        fh.flush()
+        fh.close()
+        fh.to_remote()
+        fh.to_final()
+
+        assert not dirpath.append(partname).exists()
+        perm = path.DupPath(dirpath.name, index=(permname,))
+        fp = perm.filtered_open(u"rb")
+        assert fp.read() == data
+        fp.close()
+        assert globals.backend.files == {remname: data}, globals.backend.files.keys()
+
+    def test_stream_encrypted(self):
+        u"""Test a compressed local copy and an encrypted remote one"""
+        self.stream_cycle(file_naming.get(u"full-sig", gzipped=False, partial=True),
+                          file_naming.get(u"full-sig", gzipped=True),
+                          file_naming.get(u"full-sig", encrypted=True))
+
+    def test_stream_compressed(self):
+        u"""Test local and remote copies that are the same"""
+        self.stream_cycle(file_naming.get(u"full-sig", gzipped=False, partial=True),
+                          file_naming.get(u"full-sig", gzipped=True),
+                          file_naming.get(u"full-sig", gzipped=True))
+
+    def test_stream_plain(self):
+        u"""Test a manifest, plain locally and encrypted remotely"""
+        self.stream_cycle(file_naming.get(u"full", manifest=True, partial=True),
+                          file_naming.get(u"full", manifest=True),
+                          file_naming.get(u"full", manifest=True, encrypted=True))
+
+
+class SplitTest(UnitTestCase):
+    u"""Test signatures split into parts while they are streamed"""
+    def setUp(self):
+        super(SplitTest, self).setUp()
+        self.unpack_testfiles()
+        dup_time.setcurtime()
+        self.set_global(u'gpg_profile', gpg.GPGProfile(passphrase=b"foobar"))
+        self.set_global(u'backend', MoveBackend())
+        self.dirpath = path.Path(b"testfiles/output")
+        self.indexes = [(), (b"a",), (b"a", b"b" * 150), (b"c",), (b"c", b"d"), (b"e",)]
+
+    def write_split_sig(self):
+        u"""Write a sigtar, starting a new part before a, c and e"""
+        fh = dup_temp.get_fileobj_duppath(self.dirpath,
+                                          file_naming.get(u"full-sig", partial=True),
+                                          file_naming.get(u"full-sig", gzipped=True),
+                                          file_naming.get(u"full-sig", encrypted=True),
+                                          overwrite=True, stream=True)
+        tf = util.make_tarfile(u"w", fh)
+        for index in self.indexes:
+            if index in [(b"a",), (b"c",), (b"e",)]:
+                fh.split()
+            ti = path.ROPath(index).get_tarinfo()
+            ti.name = b"signature/" + b"/".join(index)
+            ti.type = b"0"
+            ti.size = 10
+            tf.addfile(ti, cStringIO.StringIO(b"x" * 10))
+        tf.close()
+        fh.close()
+        fh.to_remote()
+        fh.to_final()
+
+    def read_indexes(self, chain, index=()):
+        fileobj = chain.get_fileobjs(index=index)[0]
+        return [p.index for p in diffdir.sigtar2path_iter(fileobj)]
+
+    def test_split(self):
+        u"""Test parts are written locally and remotely, and read as one"""
+        self.write_split_sig()
+        remote_names = sorted(globals.backend.files.keys())
+        assert remote_names == sorted([file_naming.get(u"full-sig", encrypted=True),
+                                       file_naming.get(u"full-sig", 2, encrypted=True),
+                                       file_naming.get(u"full-sig", 3, encrypted=True),
+                                       file_naming.get(u"full-sig", 4, encrypted=True),
+                                       file_naming.get(u"full-sig", manifest=True,
+                                                       encrypted=True)]), remote_names
+        for name in remote_names:
+            pr = file_naming.parse(name)
+            assert pr.type == u"full-sig" and pr.encrypted, name
+
+        chains, orphans = collections.CollectionsStatus(None, self.dirpath, u"list-current") \
+            .get_signature_chains(True)
+        assert len(chains) == 1 and not orphans, (chains, orphans)
+        assert len(chains[0].get_filenames()) == 5, chains[0].get_filenames()
+        assert self.read_indexes(chains[0]) == self.indexes
+
+    def test_split_subtree(self):
+        u"""Test reading a subtree only opens the parts which may hold it"""
+        self.write_split_sig()
+        chain = collections.CollectionsStatus(None, self.dirpath, u"list-current") \
+            .get_signature_chains(True)[0][0]
+        assert self.read_indexes(chain, (b"c",)) == [(b"c",), (b"c", b"d")]
+        assert self.read_indexes(chain, (b"a", b"b" * 150)) == [(b"a",), (b"a", b"b" * 150)]
+        assert self.read_indexes(chain, (b"b",)) == [(b"a",), (b"a", b"b" * 150)]
+
+    def test_missing_part(self):
+        u"""Test a signature with a part missing is not read with a gap"""
+        self.write_split_sig()
+        self.dirpath.append(file_naming.get(u"full-sig", 3, gzipped=True)).delete()
+        chain = collections.CollectionsStatus(None, self.dirpath, u"list-current") \
+            .get_signature_chains(True)[0][0]
+        self.assertRaises(collections.CollectionsError, chain.get_fileobjs)
+        self.assertRaises(collections.CollectionsError, chain.get_fileobjs, index=(b"c",))
+
+        # the last part is only known to be missing from the part index
+        self.write_split_sig()
+        self.dirpath.append(file_naming.get(u"full-sig", 4, gzipped=True)).delete()
+        chain = collections.CollectionsStatus(None, self.dirpath, u"list-current") \
+            .get_signature_chains(True)[0][0]
+        chain.get_fileobjs()
+        self.assertRaises(collections.CollectionsError, chain.get_fileobjs, index=(b"e",))
+
+
+if __name__ == u"__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import itertools
+import json
+import os
+import unittest
+from StringIO import StringIO
+
+from duplicity import backend
+from duplicity import erasure
+from duplicity import path
+from . import UnitTestCase
+
+
+class ReedSolomonTest(UnitTestCase):
+    u"""Test erasure coding of blocks and files"""
+    def test_decode_any_k(self):
+        u"""Test any k of the k + m blocks give back the data"""
+        rs = erasure.ReedSolomon(4, 3)
+        data = [os.urandom(100) for i in range(4)]
+        blocks = data + rs.encode(data)
+        for chosen in itertools.combinations(range(7), 4):
+            shards = dict((i, blocks[i]) for i in chosen)
+            assert rs.decode(shards) == data, chosen
+        self.assertRaises(erasure.ErasureError, rs.decode,
+                          dict((i, blocks[i]) for i in range(3)))
+
+    def test_pure_python(self):
+        u"""Test the fallback without numpy computes the same parity"""
+        rs = erasure.ReedSolomon(5, 2)
+        data = [os.urandom(1000) for i in range(5)]
+        parity = rs.encode(data)
+        numpy = erasure.numpy
+        erasure.numpy = None
+        try:
+            assert rs.encode(data) == parity
+        finally:
+            erasure.numpy = numpy
+
+    def encode(self, data, k, m, block_size):
+        parity_fps = [StringIO() for i in range(m)]
+        data_fps = [StringIO() for i in range(k)]
+        index = erasure.encode(StringIO(data), k, m, block_size, parity_fps, data_fps)
+        index = erasure.ErasureIndex().from_string(index.to_string())
+        return index, data_fps, parity_fps
+
+    def test_decode_file(self):
+        u"""Test a file comes back from k intact or corrupt shards"""
+        data = os.urandom(54321)
+        index, data_fps, parity_fps = self.encode(data, 5, 3, 1000)
+        assert index.size == len(data) and index.get_rows() == 11
+        shard_fps = data_fps + parity_fps
+        shard_fps[0] = None
+        shard_fps[6] = None
+        shard_fps[2] = StringIO(b"x" * len(shard_fps[2].getvalue()))
+        out = StringIO()
+        erasure.decode(shard_fps, index, out)
+        assert out.getvalue() == data
+
+        shard_fps[3] = None
+        self.assertRaises(erasure.ErasureError, erasure.decode,
+                          shard_fps, index, StringIO())
+
+    def test_repair(self):
+        u"""Test corrupt and missing blocks of a file are rewritten"""
+        data = os.urandom(54321)
+        index, data_fps, parity_fps = self.encode(data, 5, 2, 1000)
+        calls = []
+
+        def get_parity_fps():
+            calls.append(1)
+            return parity_fps
+
+        fp = StringIO(data)
+        assert erasure.repair(fp, index, get_parity_fps) == 0
+        assert not calls
+
+        fp = StringIO(data[:1500] + b"x" * 1000 + data[2500:-100])
+        assert erasure.repair(fp, index, get_parity_fps) == 3
+        assert fp.getvalue() == data
+        assert len(calls) == 1
+
+
+class Par2NativeTest(UnitTestCase):
+    u"""Test native recovery files of the par2 backend"""
+    def setUp(self):
+        super(Par2NativeTest, self).setUp()
+        self.unpack_testfiles()
+        self.set_global(u'par2_native', True)
+        self.set_global(u'par2_redundancy', 10)
+        backend.import_backends()
+        self.backend = backend.get_backend(u"par2+file://testfiles/output/par2")
+        self.remote_dir = u"testfiles/output/par2"
+
+    def test_repair(self):
+        u"""Test a corrupt file is repaired on get without a listing"""
+        data = os.urandom(300000)
+        with open(u"testfiles/output/volume", u"wb") as fp:
+            fp.write(data)
+        self.backend.put(path.Path(u"testfiles/output/volume"), b"volume")
+        assert sorted(os.listdir(self.remote_dir)) == \
+            [b"volume", b"volume.rs.par2", b"volume.rs1.par2", b"volume.rs2.par2"]
+        assert self.backend.list() == [b"volume"]
+
+        with open(os.path.join(self.remote_dir, u"volume"), u"r+b") as fp:
+            fp.seek(1000)
+            fp.write(b"x" * 10000)
+        self.backend.backend.wrapped_backend._list = None
+        local_path = path.Path(u"testfiles/output/volume.restored")
+        self.backend.get(b"volume", local_path)
+        with open(local_path.name, u"rb") as fp:
+            assert fp.read() == data
+
+        self.backend.backend.wrapped_backend._list = lambda: os.listdir(self.remote_dir)
+        self.backend.delete([b"volume"])
+        assert os.listdir(self.remote_dir) == []
+
+
+class MultiErasureTest(UnitTestCase):
+    u"""Test erasure mode of the multi backend"""
+    def setUp(self):
+        super(MultiErasureTest, self).setUp()
+        self.unpack_testfiles()
+        backend.import_backends()
+        self.store_dirs = [u"testfiles/output/store%d" % i for i in range(4)]
+        with open(u"testfiles/output/multi.json", u"w") as fp:
+            json.dump([{u"url": u"file://" + d} for d in self.store_dirs], fp)
+        self.url = u"multi://%s?mode=erasure&data=2" % os.path.abspath(u"testfiles/output/multi.json")
+
+    def test_erasure(self):
+        u"""Test any two of four stores give back a file coded 2 of 4"""
+        multi = backend.get_backend(self.url)
+        data = os.urandom(300000)
+        with open(u"testfiles/output/volume", u"wb") as fp:
+            fp.write(data)
+        multi.put(path.Path(u"testfiles/output/volume"), b"volume")
+        for d in self.store_dirs:
+            assert os.listdir(d) == [u"volume"]
+            assert os.path.getsize(os.path.join(d, u"volume")) < 160000
+        assert multi.list() == [b"volume"]
+
+        os.unlink(os.path.join(self.store_dirs[0], u"volume"))
+        with open(os.path.join(self.store_dirs[3], u"volume"), u"r+b") as fp:
+            fp.write(b"x" * 1000)
+        multi = backend.get_backend(self.url)
+        local_path = path.Path(u"testfiles/output/volume.restored")
+        multi.get(b"volume", local_path)
+        with open(local_path.name, u"rb") as fp:
+            assert fp.read() == data
+
+
+if __name__ == u"__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import unittest
+
+from duplicity.backends import _boto_single
+from . import UnitTestCase
+
+
+class FakeKey:
+    u"""Stands in for a boto Key, restored after polls_to_thaw checks"""
+    def __init__(self, bucket, name, storage_class, polls_to_thaw):
+        self.bucket = bucket
+        self.key = name
+        self.storage_class = storage_class
+        self.polls_to_thaw = polls_to_thaw
+        self.ongoing_restore = None
+
+    def restore(self, days):
+        self.bucket.restores.append(self.key)
+        self.ongoing_restore = True
+
+
+class FakeBucket:
+    u"""Stands in for a boto Bucket"""
+    def __init__(self):
+        self.keys = {}
+        self.restores = []
+        self.checks = []
+
+    def add(self, name, storage_class=u"GLACIER", polls_to_thaw=0):
+        self.keys[name] = FakeKey(self, name, storage_class, polls_to_thaw)
+        return self.keys[name]
+
+    def get_key(self, name):
+        key = self.keys[name]
+        self.checks.append(name)
+        if key.ongoing_restore:
+            if key.polls_to_thaw:
+                key.polls_to_thaw -= 1
+            else:
+                key.ongoing_restore = False
+        return key
+
+
+class FakeBackend:
+    def __init__(self):
+        self.bucket = FakeBucket()
+        self.resets = 0
+
+    def resetConnection(self):
+        self.resets += 1
+
+
+class ThawPlannerTest(UnitTestCase):
+    u"""Test restores from Glacier are requested and checked as a group"""
+    def setUp(self):
+        super(ThawPlannerTest, self).setUp()
+        self.sleeps = []
+        self.orig_sleep = _boto_single.time.sleep
+        _boto_single.time.sleep = self.sleeps.append
+
+    def tearDown(self):
+        _boto_single.time.sleep = self.orig_sleep
+        super(ThawPlannerTest, self).tearDown()
+
+    def test_thaw(self):
+        u"""Test all cold keys are restored at once and waited for together"""
+        backend = FakeBackend()
+        bucket = backend.bucket
+        keys = [bucket.add(u"vol1", polls_to_thaw=3),
+                bucket.add(u"vol2", polls_to_thaw=1),
+                bucket.add(u"vol3", storage_class=u"STANDARD"),
+                bucket.add(u"vol4", polls_to_thaw=5)]
+        done = bucket.add(u"vol5")
+        done.ongoing_restore = False
+
+        planner = _boto_single.ThawPlanner(backend)
+        planner.request(keys + [done])
+        assert bucket.restores == [u"vol1", u"vol2", u"vol4"], bucket.restores
+        assert planner.pending == set([u"vol1", u"vol2", u"vol4"])
+
+        # requesting again does not restore again
+        planner.request(keys)
+        assert bucket.restores == [u"vol1", u"vol2", u"vol4"], bucket.restores
+
+        # waiting for the first one finds the second thawed too
+        planner.wait(u"vol1")
+        assert len(self.sleeps) == 4, self.sleeps
+        assert planner.pending == set([u"vol4"])
+        planner.wait(u"vol2")
+        planner.wait(u"vol3")
+        assert len(self.sleeps) == 4, self.sleeps
+        planner.wait(u"vol4")
+        assert len(self.sleeps) == 6, self.sleeps
+        assert not planner.pending
+
+
+if __name__ == u"__main__":
+    unittest.main()
@@ -21,10 +21,13 @@
 
 import sys
 import os
+import hashlib
 import pytest
 import unittest
 import random
 
+from duplicity import dup_time
+from duplicity import file_naming
 from duplicity import gpg
 from duplicity import path
 from . import UnitTestCase
@@ -146,6 +149,14 @@ class GPGTest(UnitTestCase):
                          profile, size=size)
         # print os.stat("testfiles/output/gpgwrite.gpg").st_size
 
+    def test_gpg_output_size(self):
+        """Test that GPGFile counts the encrypted bytes it writes"""
+        epath = path.Path("testfiles/output/encrypted_file")
+        encrypted_file = gpg.GPGFile(1, epath, self.default_profile)
+        encrypted_file.write("aoeu" * 100000)
+        encrypted_file.close()
+        assert encrypted_file.get_output_size() == os.stat(epath.name).st_size
+
     def test_GzipWriteFile(self):
         """Test GzipWriteFile"""
         size = 400 * 1000
@@ -208,6 +219,58 @@ class SHATest(UnitTestCase):
         hash = gpg.get_hash("SHA1", path.Path("testfiles/various_file_types/regular_file"))
         assert hash == "886d722999862724e1e62d0ac51c468ee336ef8e", hash
 
+    def test_sha256(self):
+        filename = "testfiles/various_file_types/regular_file"
+        hash = gpg.get_hash("SHA256", path.Path(filename))
+        assert hash == hashlib.sha256(open(filename, "rb").read()).hexdigest(), hash
+
+
+class InlineHashTest(UnitTestCase):
+    """Test that volumes are hashed in the same pass that writes them"""
+    def setUp(self):
+        super(InlineHashTest, self).setUp()
+        self.unpack_testfiles()
+        dup_time.setcurtime()
+        self.profile = gpg.GPGProfile(passphrase="foobar")
+        self.set_global('gpg_profile', self.profile)
+        self.reads = []
+        self.orig_open = path.Path.open
+
+        def counting_open(p, mode="rb"):
+            if "r" in mode:
+                self.reads.append(p.name)
+            return self.orig_open(p, mode)
+        path.Path.open = counting_open
+
+    def tearDown(self):
+        path.Path.open = self.orig_open
+        super(InlineHashTest, self).tearDown()
+
+    def write_volumes(self):
+        """Write one volume of each kind, return list of (DupPath, hash)"""
+        volumes = []
+        for encrypted, gzipped in ((False, False), (False, True), (True, False)):
+            filename = file_naming.get("full", 1, encrypted=encrypted, gzipped=gzipped)
+            dp = path.DupPath("testfiles/output", index=(filename,))
+            hash_obj = gpg.get_hash_obj("SHA1")
+            gwfh = GPGWriteFile_Helper()
+            if encrypted:
+                gpg.GPGWriteFile(gwfh, dp.name, self.profile, size=300 * 1000,
+                                 hash_obj=hash_obj)
+            elif gzipped:
+                gpg.GzipWriteFile(gwfh, dp.name, size=300 * 1000, hash_obj=hash_obj)
+            else:
+                gpg.PlainWriteFile(gwfh, dp.name, size=300 * 1000, hash_obj=hash_obj)
+            volumes.append((dp, hash_obj.hexdigest()))
+        return volumes
+
+    def test_write_hash(self):
+        """Test writers hash the volume without reading it back"""
+        volumes = self.write_volumes()
+        assert not self.reads, self.reads
+        for dp, hash in volumes:
+            assert hash == gpg.get_hash("SHA1", dp), dp.name
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -79,6 +79,32 @@ class VolumeInfoTest(UnitTestCase):
         assert not vi3.contains(("3",), recursive=0)
 
 
+class SigIndexTest(UnitTestCase):
+    """Test the part index of split signatures"""
+    def test_basic(self):
+        """Test a round trip through to_string and from_string"""
+        si = manifest.SigIndex()
+        si.add_part(1, ())
+        si.add_part(2, ("a", "white space", "quote\""))
+        si.add_part(3, ("b",))
+        si2 = manifest.SigIndex().from_string(si.to_string())
+        assert si2.part_dict == si.part_dict, si2.part_dict
+
+    def test_get_parts(self):
+        """Test picking the parts which may hold a subtree"""
+        si = manifest.SigIndex()
+        si.add_part(1, ())
+        si.add_part(2, ("b",))
+        si.add_part(3, ("b", "x"))
+        si.add_part(4, ("d",))
+        assert si.get_parts(()) == [1, 2, 3, 4]
+        assert si.get_parts(("a",)) == [1]
+        assert si.get_parts(("b",)) == [2, 3]
+        assert si.get_parts(("b", "y")) == [3]
+        assert si.get_parts(("c",)) == [3]
+        assert si.get_parts(("e",)) == [4]
+
+
 class ManifestTest(UnitTestCase):
     """Test Manifest class"""
 
@@ -0,0 +1,249 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import json
+import os
+import threading
+import unittest
+
+from duplicity import backend
+from duplicity import path
+from duplicity.errors import BackendException
+from . import UnitTestCase
+
+
+class MultiBackendTest(UnitTestCase):
+    u"""Test the multi backend over three file:// stores"""
+    def setUp(self):
+        super(MultiBackendTest, self).setUp()
+        self.unpack_testfiles()
+        backend.import_backends()
+        self.store_dirs = [u"testfiles/output/store%d" % i for i in range(3)]
+        for d in self.store_dirs:
+            os.makedirs(d)
+        self.config = os.path.abspath(u"testfiles/output/multi.json")
+        with open(self.config, u"w") as fp:
+            json.dump([{u"url": u"file://" + d} for d in self.store_dirs], fp)
+
+    def get_multi(self, query):
+        u"""Return the MultiBackend for query and its store wrappers"""
+        multi = backend.get_backend(u"multi://%s?%s" % (self.config, query)).backend
+        return multi, multi._MultiBackend__stores
+
+    def make_volume(self, size, name=b"volume"):
+        with open(b"testfiles/output/" + name, u"wb") as fp:
+            fp.write(b"x" * size)
+        return path.Path(b"testfiles/output/" + name)
+
+    def fail_put(self, store):
+        def put(source_path, remote_filename=None):
+            raise BackendException(u"cannot write")
+        store.put = put
+
+    def stored(self):
+        return [sorted(os.listdir(d)) for d in self.store_dirs]
+
+
+class MultiWriteTest(MultiBackendTest):
+    u"""Test the mirror and stripe writes of the multi backend"""
+    def test_bad_query(self):
+        u"""Test invalid quorum and onfail values are refused"""
+        for query in [u"mode=mirror&quorum=0", u"mode=mirror&quorum=x",
+                      u"mode=mirror&onfail=ignore", u"mode=erasure&data=2&quorum=1"]:
+            self.assertRaises(BackendException, self.get_multi, query)
+        multi, stores = self.get_multi(u"mode=mirror&quorum=2")
+        assert multi._MultiBackend__quorum == 2
+
+    def test_mirror(self):
+        u"""Test a mirror write goes to all stores at once"""
+        multi, stores = self.get_multi(u"mode=mirror")
+        started = [threading.Event() for store in stores]
+        overlapped = []
+
+        def wrap(i, put):
+            def concurrent_put(source_path, remote_filename=None):
+                started[i].set()
+                # returns at once only if all writes run at the same time
+                overlapped.append(all(e.wait(5) for e in started))
+                return put(source_path, remote_filename)
+            return concurrent_put
+        for i, store in enumerate(stores):
+            store.put = wrap(i, store.put)
+
+        multi._put(self.make_volume(1000), b"volume")
+        assert overlapped == [True] * 3
+        assert self.stored() == [[b"volume"]] * 3
+
+    def test_mirror_quorum(self):
+        u"""Test a mirror write fails when fewer than quorum stores have it"""
+        multi, stores = self.get_multi(u"mode=mirror&quorum=2")
+        self.fail_put(stores[1])
+        multi._put(self.make_volume(1000), b"volume1")
+        assert self.stored() == [[b"volume1"], [], [b"volume1"]]
+
+        self.fail_put(stores[2])
+        self.assertRaises(BackendException, multi._put, self.make_volume(1000), b"volume2")
+
+        # the default quorum of one store is still met
+        multi, stores = self.get_multi(u"mode=mirror")
+        self.fail_put(stores[0])
+        self.fail_put(stores[1])
+        multi._put(self.make_volume(1000), b"volume3")
+        assert self.stored()[2] == [b"volume1", b"volume3"]
+
+    def test_mirror_abort(self):
+        u"""Test onfail=abort needs a mirror write to reach all stores"""
+        multi, stores = self.get_multi(u"mode=mirror&onfail=abort&quorum=1")
+        self.fail_put(stores[2])
+        self.assertRaises(BackendException, multi._put, self.make_volume(1000), b"volume")
+        assert self.stored() == [[b"volume"], [b"volume"], []]
+
+    def test_stripe(self):
+        u"""Test stripe writes go round the stores, skipping failed ones"""
+        multi, stores = self.get_multi(u"mode=stripe")
+        for i in range(4):
+            multi._put(self.make_volume(1000), b"volume%d" % i)
+        assert self.stored() == [[b"volume0", b"volume3"], [b"volume1"], [b"volume2"]]
+
+        self.fail_put(stores[1])
+        multi._put(self.make_volume(1000), b"volume4")
+        assert self.stored()[1:] == [[b"volume1"], [b"volume2", b"volume4"]]
+
+    def test_stripe_abort(self):
+        u"""Test onfail=abort stops a stripe write at the first failure"""
+        multi, stores = self.get_multi(u"mode=stripe&onfail=abort")
+        self.fail_put(stores[0])
+        self.assertRaises(BackendException, multi._put, self.make_volume(1000), b"volume")
+        assert self.stored() == [[], [], []]
+
+        multi, stores = self.get_multi(u"mode=stripe")
+        for store in stores:
+            self.fail_put(store)
+        self.assertRaises(BackendException, multi._put, self.make_volume(1000), b"volume")
+
+    def test_stripe_size(self):
+        u"""Test stripe=size puts each file on the store with the fewest bytes"""
+        multi, stores = self.get_multi(u"mode=stripe&stripe=size")
+        multi._put(self.make_volume(1000), b"big")
+        for i in range(4):
+            multi._put(self.make_volume(100), b"small%d" % i)
+        assert self.stored() == [[b"big"], [b"small0", b"small2"], [b"small1", b"small3"]]
+
+    def test_stripe_throughput(self):
+        u"""Test stripe=throughput tries unmeasured, then fastest done stores first"""
+        multi, stores = self.get_multi(u"mode=stripe&stripe=throughput")
+        stats = multi._MultiBackend__write_stats
+        stats[stores[0]] = [1000, 10.0]
+        stats[stores[1]] = [1000, 1.0]
+        assert multi._stripe_order(stores, 1000) == [stores[2], stores[1], stores[0]]
+
+        stats[stores[2]] = [1000, 2.0]
+        assert multi._stripe_order(stores, 1000) == [stores[1], stores[2], stores[0]]
+        # a slower store that has written less is done first
+        stats[stores[1]] = [100000, 100.0]
+        assert multi._stripe_order(stores, 1000) == [stores[2], stores[0], stores[1]]
+
+        multi._put(self.make_volume(1000), b"volume")
+        assert self.stored() == [[], [], [b"volume"]]
+        assert stats[stores[2]][0] == 2000
+
+
+class MultiReadTest(MultiBackendTest):
+    u"""Test the reads and listings of the multi backend"""
+    def test_read_order(self):
+        u"""Test read=fastest tries unmeasured, then fastest stores first"""
+        multi, stores = self.get_multi(u"mode=mirror")
+        stats = multi._MultiBackend__read_stats
+        stats[stores[0]] = [100.0, [1.0]]
+        stats[stores[1]] = [1000.0, [1.0]]
+        assert multi._read_order(stores) == stores
+
+        multi, stores = self.get_multi(u"mode=mirror&read=fastest")
+        stats = multi._MultiBackend__read_stats
+        stats[stores[0]] = [100.0, [1.0]]
+        stats[stores[1]] = [1000.0, [1.0]]
+        assert multi._read_order(stores) == [stores[2], stores[1], stores[0]]
+
+        # a store still busy with an abandoned read comes last
+        multi._MultiBackend__inflight[stores[2]] = threading.current_thread()
+        assert multi._read_order(stores) == [stores[1], stores[0], stores[2]]
+
+    def test_hedge_delay(self):
+        u"""Test the hedge delay is the percentile of previous reads"""
+        multi, stores = self.get_multi(u"mode=mirror&hedge=90")
+        stats = multi._MultiBackend__read_stats
+        assert multi._hedge_delay(stores[0]) is None
+        stats[stores[0]] = [1.0, [4.0, 1.0, 3.0, 2.0]]
+        assert multi._hedge_delay(stores[0]) == 4.0
+        # too few reads from the store, all stores are used
+        stats[stores[1]] = [1.0, [10.0]]
+        assert multi._hedge_delay(stores[1]) == 10.0
+        stats[stores[1]] = [1.0, [1.0, 1.0, 1.0]]
+        assert multi._hedge_delay(stores[1]) == 1.0
+
+    def test_hedged_read(self):
+        u"""Test a stalled read is overtaken by a read from the next store"""
+        multi, stores = self.get_multi(u"mode=mirror&hedge=50")
+        multi._put(self.make_volume(1000), b"volume")
+        multi._MultiBackend__read_stats[stores[0]] = [1.0, [0.01, 0.01, 0.01]]
+        release = threading.Event()
+        orig_get = stores[0].get
+
+        def stalled_get(remote_filename, local_path):
+            release.wait(10)
+            return orig_get(remote_filename, local_path)
+        stores[0].get = stalled_get
+
+        local_path = path.Path(b"testfiles/output/restored")
+        multi._get(b"volume", local_path)
+        assert not release.is_set()
+        with open(local_path.name, u"rb") as fp:
+            assert fp.read() == b"x" * 1000
+
+        # the stalled store is not read from until its read is done
+        inflight = multi._MultiBackend__inflight
+        thread = inflight[stores[0]]
+        assert multi._read_order(stores)[-1] is stores[0]
+        release.set()
+        thread.join()
+        assert stores[0] not in inflight
+
+    def test_listings(self):
+        u"""Test the cached listings follow our writes and deletes"""
+        multi, stores = self.get_multi(u"mode=stripe")
+        listings = multi._MultiBackend__listings
+        multi._put(self.make_volume(1000), b"volume0")
+        assert listings == {}
+        assert multi._list() == [b"volume0"]
+        assert listings == {stores[0]: {b"volume0"}, stores[1]: set(), stores[2]: set()}
+
+        multi._put(self.make_volume(1000), b"volume1")
+        assert listings[stores[1]] == {b"volume1"}
+        multi._delete(b"volume0")
+        assert listings[stores[0]] == set()
+        assert self.stored() == [[], [b"volume1"], []]
+
+        # reads find the file from the listings alone
+        stores[1].list = None
+        local_path = path.Path(b"testfiles/output/restored")
+        multi._get(b"volume1", local_path)
+        assert os.path.getsize(local_path.name) == 1000
+
+
+if __name__ == u"__main__":
+    unittest.main()
@@ -85,6 +85,37 @@ class PatchingTest(UnitTestCase):
             # print "#########", seq_path, new_path
             assert seq_path.compare_recursive(new_path, 1)
 
+    def test_sparse(self):
+        """Test a sparse file is stored without its holes and restored sparse"""
+        src = Path("testfiles/output/sparse_src")
+        src.mkdir()
+        fp = open("testfiles/output/sparse_src/file", "wb")
+        fp.truncate(5 * 1024 * 1024)
+        fp.seek(1024 * 1024 + 100)
+        fp.write("data" * 40000)
+        fp.seek(3 * 1024 * 1024)
+        fp.write("more data")
+        fp.close()
+        sparse_path = src.append("file")
+        if not sparse_path.issparse():
+            self.skipTest("filesystem doesn't support sparse files")
+
+        diff = Path("testfiles/output/diff.tar")
+        diffdir.write_block_iter(diffdir.DirFull(self.get_sel(src)), diff)
+        assert diff.getsize() < 1024 * 1024, diff.getsize()
+        tf = tarfile.TarFile("testfiles/output/diff.tar", "r")
+        names = [ti.name for ti in tf]
+        assert "multivol_sparse/file/1" in names, names
+        assert "multivol_sparse/file/2" not in names, names
+
+        seq_path = Path("testfiles/output/sequence")
+        patchdir.Patch(seq_path, diff.open("rb"))
+        assert seq_path.compare_recursive(src, 1)
+        restored = seq_path.append("file")
+        assert restored.getsize() == 5 * 1024 * 1024
+        # holes are restored in whole 64KB blocks
+        assert restored.stat.st_blocks * 512 < 1024 * 1024, restored.stat.st_blocks
+
     def test_block_tar(self):
         """Test building block tar from a number of files"""
         def get_fileobjs():
@@ -0,0 +1,86 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import json
+import unittest
+
+from duplicity import stagetimes
+from . import UnitTestCase
+
+
+class StageTimesTest(UnitTestCase):
+    u"""Test stages are timed exclusively and written as JSON"""
+    def setUp(self):
+        super(StageTimesTest, self).setUp()
+        self.unpack_testfiles()
+        self.clock = [100.0]
+        self.orig_time = stagetimes.time.time
+        stagetimes.time.time = lambda: self.clock[0]
+
+    def tearDown(self):
+        stagetimes.time.time = self.orig_time
+        stagetimes.enabled = False
+        super(StageTimesTest, self).tearDown()
+
+    def test_disabled(self):
+        u"""Test nothing is timed unless enabled"""
+        stagetimes.enabled = False
+        with stagetimes.stage(u"delta") as st:
+            st.add(10)
+        assert not stagetimes.totals
+        iterator = iter([1, 2])
+        assert stagetimes.timed_iter(u"select", iterator) is iterator
+
+    def test_nested(self):
+        u"""Test time in a nested stage only counts for that stage"""
+        stagetimes.enable()
+        for i in range(2):
+            with stagetimes.stage(u"delta") as delta:
+                self.clock[0] += 1
+                with stagetimes.stage(u"read") as read:
+                    self.clock[0] += 3
+                    read.add(1000)
+                self.clock[0] += 1
+                delta.add(100)
+        for elem in stagetimes.timed_iter(u"select", iter([1, 2, 3])):
+            self.clock[0] += 5
+        stages = stagetimes.get_times()[u"stages"]
+        assert stages[u"delta"][u"wall"] == 4 and stages[u"delta"][u"bytes"] == 200, stages
+        assert stages[u"read"][u"wall"] == 6 and stages[u"read"][u"bytes"] == 2000, stages
+        assert stages[u"read"][u"calls"] == 2, stages
+        assert stages[u"select"][u"wall"] == 0 and stages[u"select"][u"calls"] == 4, stages
+
+    def test_write(self):
+        u"""Test the times are written to a file as JSON"""
+        filename = b"testfiles/output/stage-times.json"
+        stagetimes.start(filename)
+        with stagetimes.stage(u"backend.put") as st:
+            self.clock[0] += 2
+            st.add(5)
+        self.clock[0] += 1
+        stagetimes.finish(filename)
+        with open(filename) as fp:
+            times = json.load(fp)
+        assert times[u"final"] is True
+        assert times[u"elapsed"] == 3
+        put = times[u"stages"][u"backend.put"]
+        assert put == {u"wall": 2, u"cpu": put[u"cpu"], u"bytes": 5, u"calls": 1}, put
+
+
+if __name__ == u"__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- Mode:Python; indent-tabs-mode:nil; tab-width:4 -*-
+#
+# This file is part of duplicity.
+#
+# Duplicity is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# Duplicity is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with duplicity; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+
+import sys
+import threading
+import time
+import traceback
+import unittest
+
+from duplicity import util
+from . import UnitTestCase
+
+
+class RunConcurrentlyTest(UnitTestCase):
+    u"""Test util.run_concurrently"""
+    def test_results(self):
+        u"""Test results come back in order, from several threads at once"""
+        threads = set()
+        lock = threading.Lock()
+
+        def square(x):
+            with lock:
+                threads.add(threading.current_thread())
+            time.sleep(0.01)
+            return x * x
+        for concurrency in (1, 4):
+            assert util.run_concurrently(square, range(20), concurrency) == [x * x for x in range(20)]
+        assert util.run_concurrently(square, [], 4) == []
+        assert len(threads) > 1
+
+    def test_exit(self):
+        u"""Test SystemExit of a call is raised again"""
+        def fail(x):
+            if x == 3:
+                raise SystemExit(x)
+            return x
+        self.assertRaises(SystemExit, util.run_concurrently, fail, range(10), 4)
+
+    def test_traceback(self):
+        u"""Test the traceback of a failed call is kept"""
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        try:
+            util.run_concurrently(fail, range(10), 4)
+        except ValueError:
+            names = [frame[2] for frame in traceback.extract_tb(sys.exc_info()[2])]
+            assert names[-1] == u"fail", names
+        else:
+            self.fail(u"ValueError not raised")
+
+
+if __name__ == u"__main__":
+    unittest.main()